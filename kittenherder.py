@@ -32,7 +32,11 @@
 
 import os
 import re
+import sys
+import glob
+import time
 import datetime
+import itertools
 import smtplib
 import email.utils
 
@@ -41,30 +45,65 @@ from email.mime.text import MIMEText
 
 from multiprocessing import get_logger
 
-from boto.ec2 import connect_to_region
-
-from releng import initOptions, initLogs, fetchUrl, dbRedis, initKeystore, relative, getPassword, getPlatform
+from releng import initOptions, initLogs, streamUrl, dbRedis, initKeystore, relative, getPassword, getPlatform
 import releng.remote
+from releng.history import HistoryStore
+from releng.lastseen import LastSeen
+import releng.hoststate as hoststate
+import releng.negcache as negcache
+from releng.workqueue import WorkQueue, workerID
+from releng.sharding import ShardMember, parseShard
+from releng.ec2 import EC2Reconciler, EC2Drain, loadLimits
+import releng.events as events
+import releng.timing as timing
+import releng.tracing as tracing
+import releng.profiling as profiling
 
 
 log        = get_logger()
 _keyExpire = 1209600 # 14 days in seconds (1 day = 86,400 seconds)
 _workers   = 1
+_pending   = {}
+
+negativeCache = None
+
+# kittenherder:<date>.<hour>:<kitten>, not the seen, state, negative or recovery keys
+_reHistoryKey = re.compile(r'^kittenherder:\d{4}-\d{2}-\d{2}\.\d{2}:')
 
 urlNeedingReboot = 'http://builddata.pub.build.mozilla.org/reports/slaves_needing_reboot.txt'
 
 
-_defaultOptions = { 'kittens':    ('-k', '--kittens',    None,     'farm keyword, list or url to use as source of kittens'),
+_defaultOptions = { 'kittens':    ('-k', '--kittens',    None,     'farm keyword, lastseen, list or url to use as source of kittens'),
                     'filter':     ('-f', '--filter',     None,     'regex filter to apply to list'),
                     'environ':    ('',   '--environ',    'prod',   'which environ to process, defaults to prod'),
                     'workers':    ('-w', '--workers',    '1',      'how many workers to spawn'),
                     'filterbase': ('',   '--filterbase', '^%s',    'string to insert filter expression into'),
-                    'cachefile':  ('',   '--cachefile',  None,     'filename to store the "have we touched this kitten before" cache'),
-                    'force':      ('',   '--force',      False,    'force processing of a kitten. This ignores the seen cache *AND* SlaveAlloc'),
+                    'seenttl':    ('',   '--seenttl',    '3600',   'seconds a processed kitten is skipped for by this and other runs'),
+                    'queue':      ('',   '--queue',      None,     'name of the redis work queue to take kittens from'),
+                    'produce':    ('',   '--produce',    False,    'queue the kitten list on --queue, work on it and report on the whole sweep once it is done'),
+                    'visibility': ('',   '--visibility', '900',    'seconds a kitten taken from --queue stays leased before another worker may take it over'),
+                    'shard':      ('',   '--shard',      None,     'i/N or auto: only handle the kittens this instance owns in its shard group'),
+                    'shardgroup': ('',   '--shardgroup', None,     'name of the shard group, defaults to the filter'),
+                    'ec2':        ('',   '--ec2',        False,    'stop ec2 slaves idle for more than an hour, down to the minimum count of their type'),
+                    'force':      ('',   '--force',      False,    'force processing of a kitten. This ignores the seen cache (except with --shard) *AND* SlaveAlloc'),
                     'email':      ('-e', '--email',      False,    'send result email'),
                     'redis':      ('-r', '--redis',     'localhost:6379', 'Redis connection string'),
                     'redisdb':    ('',   '--redisdb',   '10',             'Redis database'),
                     'smtpServer': ('',   '--smtpServer', None,     'where to send generated email to'),
+                    'nomasters':  ('',   '--nomasters',  False,    'do not ask the buildbot masters for slave status, inspect every kitten over ssh'),
+                    'history':    ('',   '--history',    None,     'sqlite file to record kitten results and reboot attempts in'),
+                    'trackwait':  ('',   '--trackwait',  '0',      'seconds to wait at the end of the run for rebooted kittens to recover, escalating to PDU and IPMI reboots; kittens still pending are picked up by the next run. 0 disables tracking'),
+                    'thresholds': ('',   '--thresholds', None,     'json file of per pool/platform reboot thresholds generated by releng.analytics'),
+                    'ignorestate': ('',  '--ignorestate', False,   'check every kitten even if its state or a run of failures says nothing can have changed yet'),
+                    'events':     ('',   '--events',     None,     'ZeroMQ endpoint to publish check, state, reboot and phase timing events on, e.g. tcp://*:5556 (prefix with > to connect instead of bind)'),
+                    'eventshwm':  ('',   '--eventshwm',  '1000',   'events queued for slow subscribers before new ones are dropped'),
+                    'timing':     ('',   '--timing',     False,    'time every phase (dns, ping, ssh, buildapi, inventory, check, reboot...), store the histograms in redis and print them at the end'),
+                    'trace':      ('',   '--trace',      None,     'write a trace event timeline of the run (chrome://tracing) to this file'),
+                    'profile':    ('',   '--profile',    None,     'cProfile the run and its worker threads into this stats file (suffixed with the worker id with --queue or --shard) and log the top hot spots'),
+                    'profilephase': ('', '--profilephase', None,   'only profile these timing phases (check, logparse, ansi-strip, report...) or functions (releng.remote:Host.wait), comma separated'),
+                    'profiletop': ('',   '--profiletop', '25',     'how many of the top cumulative hot spots to log'),
+                    'profilemerge': ('', '--profilemerge', None,   'at the end of the run merge the worker stats files matching this glob, e.g. "run.prof.*", into the --profile file and log its hot spots'),
+                    'lastseen':   ('',   '--lastseen',   False,    'use the build activity kittenpulse.py stores in redis, skip kittens that built recently and default --kittens to lastseen'),
                   }
 
 
@@ -94,9 +133,18 @@ def previouslySeen(hostlist, lastrun):
 
     return l
 
-def getHistory(kitten):
+def getHistory(kitten, store=None):
     result = ''
-    keys   = db.keys('kittenherder:*:%s' % kitten)
+    if store is not None:
+        for row in store.history(kitten):
+            ts, reachable, buildbot, tacfile, lastseen, reboot, recovery, pdu, ipmi = row
+            indent  = '    %s ' % datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d.%H')
+            result += '%sreachable: %s buildbot: %s \r\n' % (indent, bool(reachable), buildbot)
+            result += ' ' * len(indent)
+            result += 'reboot: %s recovery: %s lastseen: %s \r\n' % (bool(reboot), bool(recovery), lastseen)
+        return result
+
+    keys   = [key for key in db.keys('kittenherder:*:%s' % kitten) if _reHistoryKey.match(key)]
     keys.sort(reverse=True)
     for key in keys:
         d = db.hgetall(key)
@@ -176,7 +224,9 @@ def getTemplateLink(kitten):
     link = '<a href="https://bugzilla.mozilla.org/enter_bug.cgi?alias=' + kitten + '&assigned_to=nobody%40mozilla.org&bug_severity=normal&bug_status=NEW&component=Release%20Engineering%3A%20Machine%20Management&contenttypemethod=autodetect&contenttypeselection=text%2Fplain&data=&defined_groups=1&flag_type-4=X&flag_type-481=X&flag_type-607=X&flag_type-674=X&flag_type-720=X&flag_type-721=X&flag_type-737=X&flag_type-775=X&flag_type-780=X&form_name=enter_bug&keywords=&maketemplate=Remember%20values%20as%20bookmarkable%20template&op_sys=' + os + '&priority=--&product=mozilla.org&qa_contact=armenzg%40mozilla.com&rep_platform=' + platform + '&requestee_type-4=&requestee_type-607=&requestee_type-753=&short_desc=' + kitten + '%20problem%20tracking&status_whiteboard=%5Bbuildduty%5D%5Bbuildslave%5D%5Bcapacity%5D&version=other">File new bug</a>'
     return link
 
-def formatHTMLResults(table_header, kitten_list):
+def formatHTMLResults(table_header, kitten_list, notes=None):
+    if notes is None:
+        notes = {}
     results = """
 <table cellpadding="0" cellspacing="0" width="620" class="body">
 <tr>
@@ -186,7 +236,7 @@ def formatHTMLResults(table_header, kitten_list):
 
     row_class = 'odd'
     for kitten in kitten_list:        
-        results += '<tr class="%s"><td>%s</td>\n' % (row_class,kitten)
+        results += '<tr class="%s"><td>%s%s</td>\n' % (row_class, kitten, notes.get(kitten, ''))
         results += '<td><a href="https://bugzilla.mozilla.org/show_bug.cgi?id=%s">Check Existing Bug</a></td>\n' % kitten
         results += '<td>' + getTemplateLink(kitten) + '</td>\n'
         results += '</tr>\n'
@@ -200,7 +250,7 @@ def formatHTMLResults(table_header, kitten_list):
 def addHTMLLineBreak():
     return '<br/>'
 
-def sendEmail(data, smtpServer=None):
+def sendEmail(data, smtpServer=None, history=None):
     if len(data) > 0:
         rebootedOS   = []
         rebootedIPMI = []
@@ -208,6 +258,7 @@ def sendEmail(data, smtpServer=None):
         recovered    = []
         idle         = []
         neither      = []
+        notes        = {}
         body         = ''
         html_body    = ''
 
@@ -220,6 +271,8 @@ def sendEmail(data, smtpServer=None):
             db.lpush('kittenherder:lastrun', kitten)
 
             print len(result), kitten, result
+            if 'lasttried' in result:
+                notes[kitten] = ' (%s, last tried %s)' % (result['failure'], relative(datetime.datetime.now() - result['lasttried']))
             if len(result) > 0:
                 if result['reboot']:
                     if result['ipmi']:
@@ -268,12 +321,12 @@ def sendEmail(data, smtpServer=None):
         if len(recovered) > 0:
             body += '\r\nrecovery needed\r\n'
             for kitten in recovered:
-                body += '%s\r\n%s' % (kitten, getHistory(kitten))
-            html_body += formatHTMLResults('recovery needed', recovered)
+                body += '%s%s\r\n%s' % (kitten, notes.get(kitten, ''), getHistory(kitten, history))
+            html_body += formatHTMLResults('recovery needed', recovered, notes)
             html_body += addHTMLLineBreak()
 
         if len(neither) > 0:
-            body += '\r\nbear needs to look into these\r\n    %s\r\n' % ', '.join(neither)
+            body += '\r\nbear needs to look into these\r\n    %s\r\n' % ', '.join(['%s%s' % (kitten, notes.get(kitten, '')) for kitten in neither])
 
         if len(body) > 0:
             addr = 'release@mozilla.com'                                     
@@ -313,18 +366,41 @@ def processKitten(options, remoteEnv, job):
         if job in remoteEnv.hosts:
             info = remoteEnv.hosts[job]
             if info['environment'] == options.environ:
+                action, reason = 'check', None
+                failed         = None
+                active         = None
+                if not options.ignorestate:
+                    if remoteEnv.states is not None:
+                        action, reason = remoteEnv.states.nextAction(job)
+                    if action == 'check' and negativeCache is not None:
+                        failed = negativeCache.skip(job, info)
+                    if action == 'check' and failed is None:
+                        active = remoteEnv.recentActivity(job)
+
                 if not info['enabled'] and not options.force:
                     if options.verbose:
                         log.info('%s not enabled, skipping' % job)
+                    if remoteEnv.states is not None and not options.dryrun:
+                        remoteEnv.states.observe(job, hoststate.disabled, 'disabled in slavealloc')
                 elif len(info['notes']) > 0 and 'tegra' not in job and not options.force:
                     if options.verbose:
                         log.info('%s has a slavealloc notes field, skipping' % job)
+                elif action == 'skip':
+                    log.info('%s is %s, skipping' % (job, reason))
+                elif failed is not None:
+                    r = negativeResult(failed)
+                    log.info('%s %s' % (job, r['output'][0]))
+                elif active is not None:
+                    log.info('%s built %s, skipping' % (job, relative(active)))
+                    if remoteEnv.states is not None and not options.dryrun:
+                        remoteEnv.states.observe(job, hoststate.healthy, 'build activity')
                 else:
                     log.info(job)
-                    host = remoteEnv.getHost(job)
+                    host = remoteEnv.getHost(job, connect=False)
                     if host is None:
                         log.error('unknown host for %s' % job)
                     else:
+                        checkStart = time.time()
                         r = remoteEnv.check(host, indent='    ', dryrun=options.dryrun, verbose=options.verbose)
                         if host.farm != 'ec2':
                             d = remoteEnv.rebootIfNeeded(host, lastSeen=r['lastseen'], indent='    ', dryrun=options.dryrun, verbose=options.verbose)
@@ -334,16 +410,31 @@ def processKitten(options, remoteEnv, job):
 
                         r['host'] = host
                         hostKey   = 'kittenherder:%s.%s:%s' % (dDate, dHour, job)
+
+                        observeFailure(job, host, r, info, dryrun=options.dryrun)
+
+                        if host.farm != 'ec2' and d.get('pending', False):
+                            _pending[job] = (hostKey, r, len(d['output']))
                         for key in r:
                             db.hset(hostKey, key, r[key])
                         db.expire(hostKey, _keyExpire)
 
+                        if host.farm != 'ec2' and job not in _pending:
+                            observeState(remoteEnv, job, r, dryrun=options.dryrun)
+
+                        publishCheck(remoteEnv, job, r, time.time() - checkStart)
+
+                        if remoteEnv.history is not None and job not in _pending:
+                            remoteEnv.history.addKitten(job, r, platform=getPlatform(job), farm=host.farm)
+
                         # all this because json cannot dumps() the timedelta object
                         td = r['lastseen']
                         if td is not None:
-                            secs             = td.seconds
+                            secs             = (td.days * 86400) + td.seconds
                             hours, remainder = divmod(secs, 3600)
                             minutes, seconds = divmod(remainder, 60)
+                            if remoteEnv.lastSeen is not None:
+                                remoteEnv.lastSeen.update({ job: time.time() - secs }, touch=False)
                             r['lastseen']    = { 'hours':    hours,
                                                  'minutes':  minutes,
                                                  'seconds':  seconds,
@@ -359,120 +450,360 @@ def processKitten(options, remoteEnv, job):
 
     return r
 
-def processEC2(ec2Kittens):
-    keynames = db.keys('counts:*')
-    counts   = {}
-
-    for item in keynames:
-        instanceType         = item.replace('counts:', '')
-        counts[instanceType] = { 'current': 0 }
-
-        count        = db.hgetall(item)
-        for key in count.keys():
-            counts[instanceType][key] = count[key]
-
-    for kitten, r in ec2Kittens:
-        host         = r['host']
-        instanceType = host.info['class']
-        if instanceType not in counts:
-            log.error('%s has a instance type [%s] not found in our counts, assuming minimum of 2 and max of 50' % (kitten, instanceType))
-            counts[instanceType]['max']     = 50
-            counts[instanceType]['min']     = 2
-            counts[instanceType]['current'] = 0
+def negativeResult(entry):
+    """ Build the report for a kitten left alone because it failed
+        the same way too recently, see releng.negcache
+    """
+    lastTried = datetime.datetime.fromtimestamp(entry['last'])
+    nextTry   = datetime.datetime.fromtimestamp(entry['next'])
+    return { 'reboot':    False,
+             'recovery':  True,
+             'ipmi':      False,
+             'pdu':       False,
+             'reachable': False,
+             'buildbot':  '',
+             'tacfile':   '',
+             'master':    '',
+             'fqdn':      '',
+             'lastseen':  None,
+             'failure':   entry['failure'],
+             'lasttried': lastTried,
+             'output':    ['%s %d times in a row, last tried %s, next try at %s' %
+                           (entry['failure'], entry['count'], relative(datetime.datetime.now() - lastTried), nextTry.strftime('%H:%M'))],
+           }
+
+def publishCheck(remoteEnv, kitten, r, elapsed):
+    if remoteEnv.events is None:
+        return
+
+    lastseen = r['lastseen']
+    if lastseen is not None:
+        lastseen = (lastseen.days * 86400) + lastseen.seconds
+    remoteEnv.publish(events.check, kitten,
+                      farm=r['host'].farm,
+                      reachable=r['reachable'],
+                      buildbot=r['buildbot'],
+                      master=remoteEnv.masterNickname(r['master']),
+                      lastseen=lastseen,
+                      reboot=r.get('reboot', False),
+                      recovery=r.get('recovery', False),
+                      pending=kitten in _pending,
+                      elapsed=elapsed)
+
+def observeState(remoteEnv, kitten, r, dryrun=False):
+    """ Record the state a check found the kitten in, unless a reboot
+        or shutdown already moved it on, see releng.hoststate
+
+        Nothing is stored for a dryrun: it never reboots, so every kitten
+        needing one would be held as awaiting-recovery and skipped by
+        the next real run.
+    """
+    if remoteEnv.states is None or dryrun:
+        return
+
+    if r['recovery'] and not r['reboot']:
+        state, reason = hoststate.awaitingRecovery, 'recovery needed'
+    elif 'active' in r['buildbot']:
+        state, reason = hoststate.healthy, 'active'
+    elif r['reachable']:
+        state, reason = hoststate.idle, 'no recent activity'
+    else:
+        state, reason = hoststate.awaitingRecovery, 'not reachable'
 
-        if host.info['enabled'] and host.info['state'] == 'running':
-            counts[instanceType]['current'] += 1
+    remoteEnv.states.observe(kitten, state, reason)
 
-        if 'lastseen' in r:
-            log.info('%s: count = %d idle: %dh %dm %ss' % (instanceType, counts[instanceType]['current'], r['lastseen']['hours'], r['lastseen']['minutes'], r['lastseen']['seconds']))
+def observeFailure(kitten, host, r, info, dryrun=False):
+    """ Back off from the kitten if the check could not resolve or reach
+        it, forget its failures otherwise, see releng.negcache
 
-            if r['lastseen']['since'] > 3600:
-                if host.info['enabled'] and host.info['state'] == 'running':
-                    log.info('shutting down ec2 instance')
-                    # if we can ssh to host, then try and do normal shutdowns
-                    if host.graceful_shutdown():
-                        log.info("instance was graceful'd")
-                    try:
-                        conn = connect_to_region(host.info['region'],
-                                                 aws_access_key_id=getPassword('aws_access_key_id'),
-                                                 aws_secret_access_key=getPassword('aws_secret_access_key'))
-                        conn.stop_instances(instance_ids=[host.info['id'],])
-                    except:
-                        log.error('unable to stop ec2 instance %s [%s]' % (kitten, host.info['id']), exc_info=True)
-                else:
-                    log.error('ec2 instance flagged for reboot/recovery but it is not running')
+        Like observeState() nothing is stored for a dryrun, the next real
+        run would skip the check and hard reboot of every kitten that
+        did not answer.
+    """
+    if negativeCache is None or dryrun or host.farm == 'ec2':
+        return
 
-def loadCache(cachefile):
+    if host.fqdn is None:
+        negativeCache.fail(kitten, negcache.unresolvable, info)
+    elif not r['reachable']:
+        negativeCache.fail(kitten, negcache.unreachable, info)
+    else:
+        negativeCache.clear(kitten)
+
+def finishReboots(remoteEnv, dryrun=False):
+    """ Complete the reboots rebootIfNeeded() queued behind a graceful
+        shutdown and record their outcome for the kittens.
+        Returns the kittens that were completed.
+    """
+    completed = []
+    for kitten, d in remoteEnv.finishReboots():
+        if kitten in _pending:
+            completed.append(kitten)
+            hostKey, r, n = _pending.pop(kitten)
+            for s in ['reboot', 'recovery', 'ipmi', 'pdu']:
+                r[s] = d[s]
+                db.hset(hostKey, s, r[s])
+            r['output'] += d['output'][n:]
+            db.hset(hostKey, 'output', r['output'])
+
+            observeState(remoteEnv, kitten, r, dryrun=dryrun)
+
+            if remoteEnv.history is not None:
+                remoteEnv.history.addKitten(kitten, r, platform=getPlatform(kitten), farm=r['host'].farm)
+
+    return completed
+
+def queueResult(r):
+    """ Return the part of a processKitten() result sendEmail() needs
+        in a form that can be stored as json in the work queue
+    """
     result = {}
-    if os.path.isfile(cachefile):
-        for item in open(cachefile, 'r+'):
-            kitten, s = item.split(' ')
-            ts        = datetime.datetime.strptime(s.strip(), '%Y-%m-%dT%H:%M:%S')
-            now       = datetime.datetime.now()
-            elapsed   = now - ts
-            seconds   = (elapsed.days * 86400) + elapsed.seconds
-            if seconds <= 3600:
-                result[kitten] = ts
+    for key in ('reboot', 'recovery', 'ipmi', 'pdu', 'reachable', 'buildbot', 'failure'):
+        if key in r:
+            result[key] = r[key]
+    if 'lasttried' in r:
+        result['lasttried'] = time.mktime(r['lasttried'].timetuple())
+    return result
 
+def reportResult(result):
+    """ Undo queueResult()
+    """
+    if 'lasttried' in result:
+        result['lasttried'] = datetime.datetime.fromtimestamp(result['lasttried'])
     return result
 
-def writeCache(cachefile, cache):
-    h = open(cachefile, 'w+')
-    for kitten in cache.keys():
-        ts = cache[kitten]
-        h.write('%s %s\n' % (kitten, ts.strftime('%Y-%m-%dT%H:%M:%S')))
-    h.close()
-
-def loadKittenList(options):
-    result = []
-
-    if options.kittens.lower() in ('ec2',):
-        for item in db.smembers('farm:%s:active' % options.kittens):
-            itemName = db.hget(item, 'name')
-            if itemName is None:
-                log.info('Skipping bad entry [%s]' % item)
+def parseKittens(kittens, reFilter):
+    """ Yield the names from the kitten list that pass the filter,
+        stripped, lower cased and each one only once
+    """
+    # one slave per line:
+    #    slavename, enabled yes/no
+    #   talos-r4-snow-078,Yes
+    #   tegra-050,No
+    seen = set()
+    for item in kittens:
+        try:
+            if ',' in item:
+                kitten = item.split(',')[0]
+            else:
+                kitten = item
+            kitten = kitten.strip().lower()
+
+            if len(kitten) == 0 or kitten.startswith('#') or kitten in seen:
+                kitten = None
+            elif reFilter is not None and reFilter.search(kitten) is None:
+                log.debug('%s rejected by filter' % kitten)
+                kitten = None
             else:
-                result.append(db.hget(item, 'name'))
+                log.debug('kitten %s matched filter' % kitten)
+                seen.add(kitten)
+        except:
+            kitten = None
+            log.error('unable to parse line [%s]' % item, exc_info=True)
+
+        if kitten is not None:
+            yield kitten
+
+def shardKittens(shard, kittens):
+    """ Yield the kittens the shard owns, then the ones it took over
+        from members that died while we went through the list. Members
+        that left cleanly keep their kittens, see ShardMember.
+    """
+    others = []
+    for kitten in kittens:
+        if shard.owns(kitten):
+            yield kitten
+        else:
+            others.append(kitten)
+
+    if not shard.lost:
+        shard.refresh()
+        for kitten in others:
+            if shard.owns(kitten):
+                log.info('%s taken over from a shard that died' % kitten)
+                yield kitten
+
+def processEC2(remoteEnv, ec2Kittens, dryrun=False):
+    """ Drain and stop the ec2 slaves that have been idle for more than
+        an hour, keeping at least the minimum count of every instance type
+    """
+    if len(ec2Kittens) == 0:
+        return
+
+    reconciler = EC2Reconciler(getPassword('aws_access_key_id'), getPassword('aws_secret_access_key'))
+    regions    = set([r['host'].info['region'] for kitten, r in ec2Kittens])
+    instances  = reconciler.instances(regions)
+    counts     = reconciler.counts(instances, loadLimits(db))
+
+    for instanceType in counts:
+        log.info('%s: count = %d (min %d, max %d)' % (instanceType, counts[instanceType]['current'], counts[instanceType]['min'], counts[instanceType]['max']))
+
+    idle  = []
+    hosts = {}
+    for kitten, r in ec2Kittens:
+        host = r['host']
+        if r.get('lastseen', None) is not None:
+            log.info('%s: idle: %dh %dm %ss' % (kitten, r['lastseen']['hours'], r['lastseen']['minutes'], r['lastseen']['seconds']))
+
+            if r['lastseen']['since'] > 3600:
+                instanceID = host.info['id']
+                if instanceID in instances:
+                    idle.append((instanceID, r['lastseen']['since']))
+                    hosts[instanceID] = (kitten, host)
+                else:
+                    log.error('%s: ec2 instance %s not found' % (kitten, instanceID))
+
+    stop = reconciler.plan(idle, instances, counts)
+    for instanceID in stop:
+        log.info('shutting down ec2 instance %s' % hosts[instanceID][0])
+
+    drain = EC2Drain(reconciler, remoteEnv, dryrun=dryrun)
+    drain.run([hosts[instanceID][1] for instanceID in stop], instances)
+
+def seenKey(kitten):
+    return 'kittenherder:seen:%s' % kitten
+
+def claimSeen(kitten, ttl):
+    """ Mark the kitten as processed before processing it, returns
+        False if this or any other herder already did so within the
+        last seenttl seconds. The claim is atomic so concurrent
+        herders never both pass it.
+    """
+    return db.set(seenKey(kitten), datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), expires=ttl, nx=True)
+
+def isSeen(kitten):
+    return db.exists(seenKey(kitten))
+
+def markSeen(kitten, ttl):
+    db.set(seenKey(kitten), datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), expires=ttl)
+
+def lastSeenCandidates(remoteEnv, lastSeen, now):
+    """ Return the kittens idle past their reboot threshold and the
+        enabled slavealloc slaves never seen building, see releng.lastseen
+
+        While the index is stale every slave whose score stopped moving
+        would look idle, so the slaves_needing_reboot list is used instead.
+    """
+    if not lastSeen.fresh():
+        log.error('lastseen index is stale, using %s instead' % urlNeedingReboot)
+        return streamUrl(urlNeedingReboot)
+
+    minHours, maxHours = remoteEnv.rebootHoursRange()
+    result             = lastSeen.candidates(now, remoteEnv._rebootHours, minHours)
+    unseen             = lastSeen.unseen([name for name, info in remoteEnv.hosts.items() if info.get('enabled', False)])
+    log.info('%d kittens idle past their threshold, %d never seen building' % (len(result), len(unseen)))
+    return result + unseen
+
+def streamKittenList(options, remoteEnv=None, batchSize=100):
+    """ Yield the raw entries of the kitten list as they are read, the
+        url, file, comma list or farm set named by --kittens
+    """
+    if options.kittens.lower() == 'lastseen':
+        for kitten in lastSeenCandidates(remoteEnv, LastSeen(db), time.time()):
+            yield kitten
+
+    elif options.kittens.lower() in ('ec2',):
+        # names are fetched batchSize farm entries per round trip
+        items = list(db.smembers('farm:%s:active' % options.kittens))
+        for n in range(0, len(items), batchSize):
+            batch = items[n:n + batchSize]
+            pipe  = db.pipeline()
+            for item in batch:
+                pipe.hget(item, 'name')
+            for item, itemName in zip(batch, pipe.execute()):
+                if itemName is None:
+                    log.info('Skipping bad entry [%s]' % item)
+                else:
+                    yield itemName
 
     elif options.kittens.lower().startswith('http://'):
-        # fetch url, and yes, we assume it's a text file
-        items = fetchUrl(options.kittens)
-        # and then make it iterable
-        if items is not None:
-            result = items.split('\n')
+        # and yes, we assume it's a text file
+        for line in streamUrl(options.kittens):
+            yield line
 
     elif os.path.exists(options.kittens):
-        result = open(options.kittens, 'r').readlines()
+        h = open(options.kittens, 'r')
+        for line in h:
+            yield line
+        h.close()
 
     elif ',' in options.kittens:
-        result = options.kittens.split(',')
+        for item in options.kittens.split(','):
+            yield item
     else:
-        result.append(options.kittens)
-
-    return result
+        yield options.kittens
 
+def peekKittens(kittens):
+    """ Return (kittens, True) if there is at least one kitten, without
+        losing it, or (kittens, False)
+    """
+    kittens = iter(kittens)
+    for kitten in kittens:
+        return itertools.chain([kitten], kittens), True
+    return kittens, False
 
 if __name__ == "__main__":
     options = initOptions(params=_defaultOptions)
 
     initLogs(options, chatty=False)
 
-    if options.cachefile is None:
-        options.cachefile = os.path.join(options.appPath, 'kittenherder_seen.dat')
+    try:
+        seenTTL = int(options.seenttl)
+    except:
+        seenTTL = 3600
 
     if options.kittens is None:
-        log.info('kitten list not specified, defaulting to %s' % urlNeedingReboot)
-        options.kittens = urlNeedingReboot
+        if options.lastseen:
+            options.kittens = 'lastseen'
+        else:
+            options.kittens = urlNeedingReboot
+        log.info('kitten list not specified, defaulting to %s' % options.kittens)
 
     if options.filter is not None:
         reFilter = re.compile(options.filterbase % options.filter)
     else:
         reFilter = None
 
+    if options.shard is not None and options.queue is not None:
+        log.error('--shard and --queue can not be used together')
+        sys.exit(1)
+
     db = dbRedis(options)
 
     log.info('Starting')
 
+    if options.timing:
+        runStart = datetime.datetime.now()
+        timing.enable()
+
+    if options.trace is not None:
+        tracing.enable(options.trace)
+
+    profiler = None
+    if options.profile is not None:
+        profileFile = options.profile
+        if options.queue is not None or options.shard is not None:
+            profileFile = '%s.%s' % (profileFile, workerID())
+        phases = None
+        if options.profilephase is not None:
+            phases = [item.strip() for item in options.profilephase.split(',') if len(item.strip()) > 0]
+        profiler = profiling.Profiler(profileFile, phases, top=int(options.profiletop))
+        profiler.start()
+
+    shard = None
+    if options.shard is not None:
+        try:
+            index, count = parseShard(options.shard)
+        except ValueError, e:
+            log.error('%s' % e)
+            sys.exit(1)
+        group = options.shardgroup
+        if group is None:
+            group = options.filter or 'all'
+        shard = ShardMember(db, group, index, count)
+        if not shard.join():
+            sys.exit(1)
+
     initKeystore(options)
 
     if options.verbose:
@@ -480,53 +811,156 @@ if __name__ == "__main__":
 
     emailItems = []
     ec2Kittens = []
-    seenCache  = loadCache(options.cachefile)
-    kittens    = loadKittenList(options)
+    workQueue  = None
+    kittens    = []
+
+    if options.queue is not None:
+        try:
+            visibility = int(options.visibility)
+        except:
+            visibility = 900
+        workQueue = WorkQueue(db, options.queue, visibility=visibility)
+
     remoteEnv  = releng.remote.RemoteEnvironment(options.tools, db=db)
 
-    if len(kittens) > 0:
-        # one slave per line:
-        #    slavename, enabled yes/no
-        #   talos-r4-snow-078,Yes
-        #   tegra-050,No
-        for item in kittens:
-            try:
-                if ',' in item:
-                    kitten = item.split(',')[0]
-                else:
-                    kitten = item
+    if options.history is not None:
+        remoteEnv.history = HistoryStore(options.history)
 
-                if reFilter is not None and reFilter.search(kitten) is None:
-                    log.debug('%s rejected by filter' % kitten)
-                    kitten = None
-                else:
-                    log.debug('kitten %s matched filter' % kitten)
-            except:
-                kitten = None
-                log.error('unable to parse line [%s]' % item, exc_info=True)
+    if options.thresholds is not None:
+        remoteEnv.loadRebootThresholds(options.thresholds)
 
-            if kitten is not None:
-                if kitten in seenCache:
-                    if options.force:
-                        log.info("%s has been processed within the last hour but is being --force'd" % kitten)
-                    else:
-                        log.info('%s has been processed within the last hour, skipping' % kitten)
-                        kitten = None
-                if kitten is not None:
-                    r = processKitten(options, remoteEnv, kitten)
+    if options.events is not None:
+        try:
+            eventsHWM = int(options.eventshwm)
+        except:
+            eventsHWM = 1000
+        remoteEnv.events = events.EventPublisher(options.events, hwm=eventsHWM)
+        timing.publisher = remoteEnv.events
 
-                    if 'host' in r and r['host'].farm == 'ec2':
-                        ec2Kittens.append((kitten, r))
+    if options.lastseen:
+        remoteEnv.lastSeen = LastSeen(db)
 
-                    emailItems.append((kitten, r))
-                    seenCache[kitten] = datetime.datetime.now()
+    if workQueue is None or options.produce:
+        kittens = streamKittenList(options, remoteEnv)
 
-        #processEC2(ec2Kittens)
+    remoteEnv.states = hoststate.HostStates(db, events=remoteEnv.events)
+    negativeCache    = negcache.NegativeCache(db)
 
-        if options.email:
-            sendEmail(emailItems, options.smtpServer)
+    if not options.nomasters:
+        with timing.phase('masters'):
+            remoteEnv.collectMasterStatus()
 
-    writeCache(options.cachefile, seenCache)
+    remoteEnv.startReboots(dryrun=options.dryrun)
+
+    try:
+        trackWait = int(options.trackwait)
+    except:
+        trackWait = 0
+    if trackWait > 0 and not options.dryrun:
+        remoteEnv.startTracking(trackWait)
+
+    if workQueue is not None:
+        if options.produce:
+            workQueue.put(parseKittens(kittens, reFilter))
+        source      = workQueue.claims(timeout=workQueue.visibility * 2)
+        haveKittens = True
+    else:
+        source = parseKittens(kittens, reFilter)
+        if shard is not None:
+            source = shardKittens(shard, source)
+        # kittens are checked as the list streams in
+        source, haveKittens = peekKittens(source)
+
+    if haveKittens:
+        for kitten in source:
+            # the queue lease already keeps other workers off the kitten,
+            # and a seen key claimed up front would make one that a dead
+            # worker left behind look processed once it is reaped
+            if workQueue is not None:
+                seen = isSeen(kitten)
+            else:
+                seen = not claimSeen(kitten, seenTTL)
+            if seen:
+                # a shard that lost the claim may be racing another one
+                # that now owns the kitten, --force does not override that
+                if options.force and shard is None:
+                    log.info("%s has been processed within the last %d minutes but is being --force'd" % (kitten, seenTTL / 60))
+                else:
+                    log.info('%s has been processed within the last %d minutes, skipping' % (kitten, seenTTL / 60))
+                    if workQueue is not None:
+                        workQueue.ack(kitten)
+                    continue
+
+            with timing.phase('kitten', kitten):
+                r = processKitten(options, remoteEnv, kitten)
+
+            if 'host' in r and r['host'].farm == 'ec2':
+                ec2Kittens.append((kitten, r))
+
+            emailItems.append((kitten, r))
+            markSeen(kitten, seenTTL)
+
+            if workQueue is not None:
+                workQueue.ack(kitten, queueResult(r))
+
+        with timing.phase('finishReboots'):
+            completed = finishReboots(remoteEnv, dryrun=options.dryrun)
+
+        if workQueue is not None:
+            results = dict(emailItems)
+            for kitten in completed:
+                workQueue.record(kitten, queueResult(results[kitten]))
+
+        if remoteEnv.tracker is not None:
+            remoteEnv.finishTracking(trackWait)
+            for kitten in remoteEnv.tracker.recovered:
+                log.info('%s recovered in %ds' % (kitten, remoteEnv.tracker.recovered[kitten]))
+            for kitten in remoteEnv.tracker.failed:
+                log.error('%s did not recover after reboot' % kitten)
+
+        if options.ec2:
+            with timing.phase('ec2'):
+                processEC2(remoteEnv, ec2Kittens, dryrun=options.dryrun)
+
+        if workQueue is not None and options.produce:
+            # report on everything the workers did in this sweep
+            if not workQueue.join(timeout=workQueue.visibility * 2):
+                log.error('work queue %s did not drain' % options.queue)
+            emailItems = [(kitten, reportResult(result)) for kitten, result in workQueue.collect().items()]
+            log.info('collected results for %d kittens from %s' % (len(emailItems), options.queue))
+
+        if options.email and (workQueue is None or options.produce):
+            with timing.phase('report'):
+                sendEmail(emailItems, options.smtpServer, remoteEnv.history)
+
+    if remoteEnv.history is not None:
+        remoteEnv.history.close()
+
+    if remoteEnv.events is not None:
+        timing.publisher = None
+        remoteEnv.events.close()
+
+    if shard is not None:
+        shard.leave()
+
+    if workQueue is not None:
+        workQueue.close()
+
+    tracing.disable()
+
+    if profiler is not None:
+        stats = profiler.stop()
+        if options.profilemerge is not None:
+            stats = profiling.merge(options.profile, sorted(glob.glob(options.profilemerge))) or stats
+        if stats is not None:
+            for line in profiler.report(stats):
+                log.info(line)
+
+    timings = timing.disable()
+    if timings is not None:
+        timings.save(db, '%s:%s' % (runStart.strftime('%Y-%m-%dT%H:%M:%S'), workerID()))
+        for line in timings.report():
+            log.info(line)
 
     log.info('Finished')
 
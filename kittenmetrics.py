@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Kitten metrics aggregator
+
+    Subscribes to the events kittenherder --events publishes and keeps
+    per minute, hour and day counters in redis, see releng.metrics
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+
+    Usage
+        -c --config         Configuration file (json format)
+           --events         ZeroMQ endpoint of the herder(s) to subscribe to
+                            default: tcp://localhost:5556
+           --flush          Seconds between writes to redis
+                            default: 10
+        -r --redis          Redis connection string
+        -d --debug          Turn on debug logging
+                            default: False
+        -l --logpath        Path where the log file output is written
+                            default: None
+"""
+
+from multiprocessing import get_logger
+
+from releng import initOptions, initLogs, dbRedis
+from releng.events import EventSubscriber
+from releng.metrics import MetricsAggregator
+
+
+log = get_logger()
+
+
+_defaultOptions = { 'events':  ('', '--events',  'tcp://localhost:5556', 'ZeroMQ endpoint to subscribe to, comma separated for several herders'),
+                    'flush':   ('', '--flush',   '10',                   'seconds between writes to redis'),
+                    'redis':   ('-r', '--redis',   'localhost:6379', 'Redis connection string'),
+                    'redisdb': ('',   '--redisdb', '10',             'Redis database'),
+                  }
+
+
+if __name__ == "__main__":
+    options = initOptions(params=_defaultOptions)
+
+    initLogs(options, chatty=False)
+
+    try:
+        flushInterval = int(options.flush)
+    except:
+        flushInterval = 10
+
+    db = dbRedis(options)
+
+    log.info('Starting')
+
+    endpoints  = options.events.split(',')
+    subscriber = EventSubscriber(endpoints[0])
+    for endpoint in endpoints[1:]:
+        subscriber.connect(endpoint)
+
+    aggregator = MetricsAggregator(db)
+    try:
+        aggregator.run(subscriber, flushInterval=flushInterval)
+    except KeyboardInterrupt:
+        aggregator.flush()
+
+    subscriber.close()
+
+    log.info('Finished')
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Kitten build activity ingest
+
+    Keeps the last build start/finish time of every slave in redis so
+    kittenherder --lastseen can skip busy slaves, see releng.lastseen
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+
+    Usage
+        -c --config         Configuration file (json format)
+           --replay         File of json build events, one per line, to
+                            load instead of listening to Pulse
+           --events         ZeroMQ endpoint publishing build events to
+                            subscribe to instead of Pulse
+           --applabel       Pulse application label
+                            default: briar-patch-lastseen
+        -r --redis          Redis connection string
+        -d --debug          Turn on debug logging
+                            default: False
+        -l --logpath        Path where the log file output is written
+                            default: None
+"""
+
+from multiprocessing import get_logger
+
+from releng import initOptions, initLogs, dbRedis
+from releng.lastseen import LastSeen, LastSeenIngest
+
+
+log = get_logger()
+
+
+_defaultOptions = { 'replay':   ('',   '--replay',   None,                   'file of json build events to load instead of listening to Pulse'),
+                    'events':   ('',   '--events',   None,                   'ZeroMQ endpoint of build events to subscribe to instead of Pulse'),
+                    'applabel': ('',   '--applabel', 'briar-patch-lastseen', 'Pulse application label'),
+                    'redis':    ('-r', '--redis',    'localhost:6379',       'Redis connection string'),
+                    'redisdb':  ('',   '--redisdb',  '10',                   'Redis database'),
+                  }
+
+
+if __name__ == "__main__":
+    options = initOptions(params=_defaultOptions)
+
+    initLogs(options, chatty=False)
+
+    db = dbRedis(options)
+
+    log.info('Starting')
+
+    ingest = LastSeenIngest(LastSeen(db))
+    try:
+        if options.replay is not None:
+            ingest.replay(options.replay)
+        elif options.events is not None:
+            from releng.events import EventSubscriber, build
+            ingest.subscribe(EventSubscriber(options.events, topics=(build,)))
+        else:
+            ingest.listen(options.applabel)
+    except KeyboardInterrupt:
+        ingest.flush()
+
+    log.info('Finished')
@@ -16,6 +16,8 @@
 """
 
 import os, sys
+import re
+import zlib
 import types
 import json
 import gzip
@@ -88,11 +90,19 @@ def getPlatform(job):
     result = 'unknown'
     s      = job.lower()
     for platform in _platforms_hosts.keys():
-        if s in _platforms_hosts[platform]:
-            result = platform
-            break
+        for prefix in _platforms_hosts[platform]:
+            if prefix in s:
+                return platform
     return result
 
+def getPool(hostname):
+    """ Return the pool a host belongs to - its short name
+        without the trailing slave number, e.g. talos-r3-w7-029
+        is in pool talos-r3-w7
+    """
+    s = hostname.lower().split('.')[0]
+    return re.sub(r'-?\d+$', '', s)
+
 def relative(delta):
     if delta.days == 1:
         return '1 day ago'
@@ -141,6 +151,9 @@ class dbRedis(object):
     def exists(self, key):
         return self._redis.exists(key)
 
+    def delete(self, key):
+        return self._redis.delete(key)
+
     def keys(self, search):
         return self._redis.keys(search)
 
@@ -162,6 +175,12 @@ class dbRedis(object):
     def rpush(self, listName, item):
         return self._redis.rpush(listName, item)
 
+    def rpoplpush(self, source, destination):
+        return self._redis.rpoplpush(source, destination)
+
+    def llen(self, listName):
+        return self._redis.llen(listName)
+
     def sadd(self, setName, item):
         return self._redis.sadd(setName, item)
 
@@ -174,12 +193,23 @@ class dbRedis(object):
     def sismember(self, setName, item):
         return self._redis.sismember(setName, item) == 1
 
-    def set(self, key, value, expires=None):
+    def get(self, key):
+        return self._redis.get(key)
+
+    def set(self, key, value, expires=None, nx=False):
+        """ With nx the key is only set if it does not exist yet,
+            returns True if it was set
+        """
+        if nx:
+            return bool(self._redis.set(key, value, ex=expires, nx=True))
         if expires is None:
             return self._redis.set(key, value)
         else:
             return self._redis.setex(key, expires, value)
 
+    def setnx(self, key, value):
+        return self._redis.setnx(key, value)
+
     def incr(self, key):
         return self._redis.incr(key)
 
@@ -192,9 +222,40 @@ class dbRedis(object):
     def hget(self, key, field):
         return self._redis.hget(key, field)
 
+    def hdel(self, key, field):
+        return self._redis.hdel(key, field)
+
     def hgetall(self, key):
         return self._redis.hgetall(key)
 
+    def hgetallMany(self, keys):
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        return pipe.execute()
+
+    def pipeline(self, transaction=False):
+        """ Return a pipeline to batch many commands in one round trip,
+            commands are queued with the redis-py method names and sent
+            by execute()
+        """
+        return self._redis.pipeline(transaction=transaction)
+
+    def zadd(self, key, score, member):
+        return self._redis.zadd(key, score, member)
+
+    def zrem(self, key, member):
+        return self._redis.zrem(key, member)
+
+    def zscore(self, key, member):
+        return self._redis.zscore(key, member)
+
+    def zrangebyscore(self, key, low, high, withscores=False):
+        return self._redis.zrangebyscore(key, low, high, withscores=withscores)
+
+    def zremrangebyscore(self, key, low, high):
+        return self._redis.zremrangebyscore(key, low, high)
+
 def loadConfig(filename):
     result = {}
     if os.path.isfile(filename):
@@ -350,13 +411,16 @@ class DefaultErrorHandler(urllib2.HTTPDefaultErrorHandler):
         result.status = code
         return result
 
-def fetchUrl(url, debug=False):
+def fetchUrl(url, debug=False, timeout=None):
     result = None
     opener = urllib2.build_opener(DefaultErrorHandler())
     opener.addheaders.append(('Accept-Encoding', 'gzip'))
 
     try:
-        response = opener.open(url)
+        if timeout is None:
+            response = opener.open(url)
+        else:
+            response = opener.open(url, timeout=timeout)
         raw_data = response.read()
 
         if response.headers.get('content-encoding', None) == 'gzip':
@@ -367,3 +431,49 @@ def fetchUrl(url, debug=False):
         log.error('Error fetching url [%s]' % url, exc_info=True)
 
     return result
+
+def streamUrl(url, timeout=None, chunkSize=8192):
+    """ Yield the lines of url, without line endings, as they arrive
+        instead of waiting for the whole body like fetchUrl()
+    """
+    opener = urllib2.build_opener(DefaultErrorHandler())
+    opener.addheaders.append(('Accept-Encoding', 'gzip'))
+
+    try:
+        if timeout is None:
+            response = opener.open(url)
+        else:
+            response = opener.open(url, timeout=timeout)
+    except:
+        log.error('Error fetching url [%s]' % url, exc_info=True)
+        return
+
+    if getattr(response, 'code', 200) >= 400:
+        log.error('Error fetching url [%s]: HTTP %s' % (url, response.code))
+        return
+
+    if response.headers.get('content-encoding', None) == 'gzip':
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    else:
+        decoder = None
+
+    buf = ''
+    try:
+        while True:
+            data = response.read(chunkSize)
+            if not data:
+                break
+            if decoder is not None:
+                data = decoder.decompress(data)
+            buf  += data
+            lines = buf.split('\n')
+            buf   = lines.pop()
+            for line in lines:
+                yield line.rstrip('\r')
+        if decoder is not None:
+            buf += decoder.flush()
+    except:
+        log.error('Error reading url [%s]' % url, exc_info=True)
+
+    if len(buf) > 0:
+        yield buf.rstrip('\r')
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.analytics
+
+    Fleet wide idle time analytics used to tune per pool reboot thresholds
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+
+    Requires numpy
+
+    Usage
+        python -m releng.analytics --db kittenherder.sqlite --days 30 --output reboot_thresholds.json
+"""
+
+import json
+import time
+
+from datetime import datetime
+from optparse import OptionParser
+from multiprocessing import get_logger
+
+import numpy as np
+
+from . import getPlatform, getPool
+from .history import HistoryStore
+
+
+log = get_logger()
+
+percentiles = (50, 90, 95, 99)
+
+
+def groupCodes(hosts, keyFunc):
+    """ Map an array of hostnames to integer group codes
+
+        keyFunc is only called once per distinct host, the per
+        sample mapping is done with numpy indexing.
+        Returns (group names, codes)
+    """
+    uniqueHosts, inverse = np.unique(hosts, return_inverse=True)
+    names, hostCodes     = np.unique(np.array([keyFunc(h) for h in uniqueHosts], dtype=object), return_inverse=True)
+    return names, hostCodes[inverse]
+
+def groupPercentiles(codes, values, nGroups, percentiles=percentiles):
+    """ Return an nGroups x len(percentiles) array of the linearly
+        interpolated percentiles of values within each group
+
+        All groups are handled at once: the samples are sorted by
+        (group, value) and each percentile is read at its offset from
+        the start of every group. Empty groups are nan.
+    """
+    result = np.empty((nGroups, len(percentiles)))
+    result.fill(np.nan)
+    if len(values) == 0:
+        return result
+
+    ordered = values[np.lexsort((values, codes))]
+    counts  = np.bincount(codes, minlength=nGroups)
+    starts  = np.cumsum(counts) - counts
+    present = counts > 0
+
+    for i, p in enumerate(percentiles):
+        pos  = starts + (counts - 1) * (p / 100.0)
+        lo   = np.clip(np.floor(pos).astype(int), 0, len(ordered) - 1)
+        hi   = np.clip(np.ceil(pos).astype(int),  0, len(ordered) - 1)
+        frac = pos - np.floor(pos)
+        result[present, i] = (ordered[lo] * (1.0 - frac) + ordered[hi] * frac)[present]
+
+    return result
+
+def groupRates(codes, outcomes, nGroups):
+    """ Return (attempts, success rate) per group, the rate is nan
+        for groups without attempts
+    """
+    attempts  = np.bincount(codes, minlength=nGroups)
+    successes = np.bincount(codes, weights=outcomes, minlength=nGroups)
+    rates     = np.empty(nGroups)
+    rates.fill(np.nan)
+    rates[attempts > 0] = successes[attempts > 0] / attempts[attempts > 0]
+    return attempts, rates
+
+class FleetAnalytics(object):
+    """ Load the idle time (lastseen) of every check and the outcome of
+        every reboot attempt recorded in a HistoryStore into numpy arrays
+        and derive a reboot threshold for every pool and platform.
+
+        A group's threshold is the given percentile of how long its
+        reachable hosts are seen idle, rounded up to whole hours and
+        clamped to [minHours, maxHours]. When less than minSuccess of a
+        group's reboots succeeded, rebooting it sooner only creates more
+        work for buildduty, so its threshold is never set below the
+        default. Groups with less than minSamples checks are left out
+        and use the next level (pool, then platform, then default).
+    """
+    def __init__(self, percentile=95, minSamples=50, minHours=2, maxHours=24, minSuccess=0.5, defaultHours=6):
+        self.percentile   = percentile
+        self.minSamples   = minSamples
+        self.minHours     = minHours
+        self.maxHours     = maxHours
+        self.minSuccess   = minSuccess
+        self.defaultHours = defaultHours
+        self.idleHosts    = np.array([], dtype=object)
+        self.idleHours    = np.array([], dtype=np.float64)
+        self.rebootHosts  = np.array([], dtype=object)
+        self.rebootOK     = np.array([], dtype=np.float64)
+
+    def load(self, store, since):
+        samples = store.idleSamples(since)
+        reboots = store.rebootResults(since)
+
+        self.idleHosts   = np.array([row[0] for row in samples], dtype=object)
+        self.idleHours   = np.fromiter((row[1] for row in samples), dtype=np.float64, count=len(samples)) / 3600.0
+        self.rebootHosts = np.array([row[0] for row in reboots], dtype=object)
+        self.rebootOK    = np.fromiter((bool(row[1]) for row in reboots), dtype=np.float64, count=len(reboots))
+
+        log.info('loaded %d idle samples and %d reboot attempts' % (len(samples), len(reboots)))
+
+    def _groups(self, keyFunc):
+        nIdle   = len(self.idleHosts)
+        names, codes = groupCodes(np.concatenate((self.idleHosts, self.rebootHosts)), keyFunc)
+        nGroups = len(names)
+
+        idleCodes   = codes[:nIdle]
+        rebootCodes = codes[nIdle:]
+
+        stats    = groupPercentiles(idleCodes, self.idleHours, nGroups, percentiles + (self.percentile,))
+        samples  = np.bincount(idleCodes, minlength=nGroups)
+        attempts, rates = groupRates(rebootCodes, self.rebootOK, nGroups)
+
+        hours = np.clip(np.ceil(stats[:, -1]), self.minHours, self.maxHours)
+        with np.errstate(invalid='ignore'):
+            hours = np.where((rates < self.minSuccess) & (hours < self.defaultHours), self.defaultHours, hours)
+
+        result = {}
+        for i in np.flatnonzero(samples >= self.minSamples):
+            entry = { 'hours':   int(hours[i]),
+                      'samples': int(samples[i]),
+                      'reboots': int(attempts[i]),
+                    }
+            for j, p in enumerate(percentiles):
+                entry['p%d' % p] = round(float(stats[i, j]), 2)
+            if attempts[i] > 0:
+                entry['success'] = round(float(rates[i]), 3)
+            result[names[i]] = entry
+        return result
+
+    def thresholds(self):
+        """ Return the thresholds document read by
+            RemoteEnvironment.loadRebootThresholds()
+        """
+        if len(self.idleHosts) + len(self.rebootHosts) == 0:
+            pools     = {}
+            platforms = {}
+        else:
+            pools     = self._groups(getPool)
+            platforms = self._groups(getPlatform)
+
+        return { 'generated':  datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                 'percentile': self.percentile,
+                 'default':    self.defaultHours,
+                 'pools':      pools,
+                 'platforms':  platforms,
+               }
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog --db FILE [--output FILE]')
+    parser.add_option('', '--db',         dest='db',         default='kittenherder.sqlite', help='history database')
+    parser.add_option('', '--days',       dest='days',       default='30',  help='how many days back to look')
+    parser.add_option('', '--percentile', dest='percentile', default='95',  help='idle time percentile used as the threshold')
+    parser.add_option('', '--min',        dest='min',        default='50',  help='minimum number of checks for a pool or platform')
+    parser.add_option('', '--output',     dest='output',     default=None,  help='file to write the thresholds to, stdout if not given')
+    (options, args) = parser.parse_args()
+
+    store     = HistoryStore(options.db)
+    analytics = FleetAnalytics(percentile=float(options.percentile), minSamples=int(options.min))
+    analytics.load(store, time.time() - int(options.days) * 86400)
+    store.close()
+
+    data = json.dumps(analytics.thresholds(), indent=2, sort_keys=True)
+    if options.output is None:
+        print data
+    else:
+        h = open(options.output, 'w')
+        h.write(data)
+        h.close()
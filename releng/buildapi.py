@@ -8,6 +8,8 @@ import requests
 
 from multiprocessing import get_logger
 
+from releng.timing import timed
+
 log = get_logger()
 
 buildapi_url = "http://buildapi01.build.scl1.mozilla.com/buildapi/"
@@ -26,6 +28,7 @@ def recent_builds(slavename, limit=20):
     """
     return json_get("%s/recent/%s?format=json&numbuilds=%i" % (buildapi_url, slavename, limit))
 
+@timed('buildapi')
 def last_build_endtime(slavename):
     """ Returns a UNIX timestamp of when the most recent build finished
         for the given build slave.  Returns None if there are no builds. """
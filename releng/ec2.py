@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.ec2
+
+    Reconcile running EC2 slaves against the per type min/max counts
+    and drain the idle ones
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import time
+import threading
+
+from multiprocessing import get_logger
+from multiprocessing.pool import ThreadPool
+
+from boto.ec2 import connect_to_region
+
+from .masters import ShutdownBatch, masterURL, slaveDisconnected
+from .waiter import ShutdownWaiter
+
+
+log = get_logger()
+
+# used for instance types without a counts:<type> hash
+defaultLimits = { 'min': 2, 'max': 50 }
+
+
+def instanceType(instance):
+    """ Return the type of an instance as used in the counts:<type>
+        keys and in slavealloc's class, e.g. tests-ec2
+    """
+    return '%s-ec2' % instance.tags.get('moz-type', 'unknown')
+
+def isActive(instance):
+    return instance.state == 'running' and instance.tags.get('moz-state', None) == 'ready'
+
+def loadLimits(db):
+    """ Return a type -> { 'min': n, 'max': n } map from the counts:* hashes
+    """
+    keys   = db.keys('counts:*')
+    limits = {}
+    for key, values in zip(keys, db.hgetallMany(keys)):
+        entry = dict(defaultLimits)
+        for field in ('min', 'max'):
+            try:
+                entry[field] = int(values[field])
+            except:
+                pass
+        limits[key.replace('counts:', '')] = entry
+    return limits
+
+class EC2Reconciler(object):
+    """ One describe call per region, cached for cacheAge seconds, gives
+        the state of every instance; counts() derives the per type
+        running counts from it in a single pass and stop() sends one
+        stop_instances call per region (batchSize ids at a time), the
+        regions in parallel.
+
+        Connections are made once per region and reused. connect is
+        called as connect(region, aws_access_key_id=...,
+        aws_secret_access_key=...) so a stand-in such as moto's mocked
+        boto can be used without AWS.
+    """
+    def __init__(self, accessKey, secretKey, cacheAge=300, batchSize=50, workers=4, connect=connect_to_region):
+        self.accessKey   = accessKey
+        self.secretKey   = secretKey
+        self.cacheAge    = cacheAge
+        self.batchSize   = batchSize
+        self.workers     = workers
+        self.connect     = connect
+        self.connections = {}
+        self.cache       = {}
+        self.lock        = threading.Lock()
+
+    def connection(self, region):
+        self.lock.acquire()
+        try:
+            if region not in self.connections:
+                self.connections[region] = self.connect(region,
+                                                        aws_access_key_id=self.accessKey,
+                                                        aws_secret_access_key=self.secretKey)
+            return self.connections[region]
+        finally:
+            self.lock.release()
+
+    def describe(self, region, refresh=False):
+        """ Return the instances of region
+        """
+        cached = self.cache.get(region, None)
+        if cached is not None and not refresh and time.time() - cached[0] < self.cacheAge:
+            return cached[1]
+
+        instances = []
+        try:
+            for reservation in self.connection(region).get_all_instances():
+                instances += reservation.instances
+        except:
+            log.error('unable to describe ec2 instances in %s' % region, exc_info=True)
+            if cached is not None:
+                return cached[1]
+            return instances
+
+        self.cache[region] = (time.time(), instances)
+        return instances
+
+    def _map(self, func, items):
+        items = list(items)
+        if len(items) == 0:
+            return []
+        pool = ThreadPool(min(self.workers, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def instances(self, regions, refresh=False):
+        """ Return an instance id -> instance map for all regions
+        """
+        result = {}
+        for instances in self._map(lambda region: self.describe(region, refresh), regions):
+            for instance in instances:
+                result[instance.id] = instance
+        return result
+
+    def counts(self, instances, limits):
+        """ Return type -> { 'current', 'min', 'max' } where current is
+            the number of running and ready instances of that type
+        """
+        result = {}
+        for instance in instances.itervalues():
+            t = instanceType(instance)
+            if t not in result:
+                if t not in limits:
+                    log.error('instance type [%s] not found in our counts, assuming minimum of %d and max of %d' %
+                              (t, defaultLimits['min'], defaultLimits['max']))
+                entry = dict(limits.get(t, defaultLimits))
+                entry['current'] = 0
+                result[t] = entry
+            if isActive(instance):
+                result[t]['current'] += 1
+        return result
+
+    def plan(self, idle, instances, counts):
+        """ Pick which of the idle instance ids can be stopped without
+            going below the minimum count of their type, longest idle
+            first. idle is a list of (instance id, idle seconds).
+        """
+        spare  = dict([(t, max(0, counts[t]['current'] - counts[t]['min'])) for t in counts])
+        result = []
+        for instanceID, seconds in sorted(idle, key=lambda item: item[1], reverse=True):
+            instance = instances.get(instanceID, None)
+            if instance is None or not isActive(instance):
+                continue
+            t = instanceType(instance)
+            if spare.get(t, 0) > 0:
+                spare[t] -= 1
+                result.append(instanceID)
+            else:
+                log.info('%s: keeping %s, %s is at its minimum of %d' % (instance.tags.get('Name', instanceID), instanceID, t, counts[t]['min']))
+        return result
+
+    def _stop(self, item):
+        region, ids = item
+        try:
+            self.connection(region).stop_instances(instance_ids=ids)
+            return ids, True
+        except:
+            log.error('unable to stop ec2 instances %s in %s' % (', '.join(ids), region), exc_info=True)
+            return ids, False
+
+    def stop(self, instanceIDs, instances):
+        """ Stop the instances, returns an instance id -> bool map
+        """
+        regions = {}
+        for instanceID in instanceIDs:
+            regions.setdefault(instances[instanceID].region.name, []).append(instanceID)
+
+        batches = []
+        for region in regions:
+            ids = regions[region]
+            for n in range(0, len(ids), self.batchSize):
+                batches.append((region, ids[n:n + self.batchSize]))
+
+        result = {}
+        for ids, stopped in self._map(self._stop, batches):
+            for instanceID in ids:
+                result[instanceID] = stopped
+            if stopped:
+                log.info('stopped %s' % ', '.join(ids))
+
+        # the cached state is stale now
+        for region in regions:
+            self.cache.pop(region, None)
+
+        return result
+
+class EC2Drain(object):
+    """ Gracefully shut down buildbot on many idle instances at once and
+        stop each instance once buildbot has exited.
+
+        The shutdown targets are looked up concurrently, from the master
+        status when a master reports the slave as connected and over ssh
+        otherwise, and the shutdowns are requested through one
+        ShutdownBatch. The hosts are then parked in a ShutdownWaiter,
+        which tails twistd.log of the hosts it has an ssh channel to and
+        asks the master whether the slave disconnected for the others;
+        every flushDelay seconds the instances whose buildbot exited or
+        timed out are stopped with one stop_instances call per region.
+        Instances that can't be shut down gracefully (buildbot not
+        running, no master) are stopped in the first batch.
+
+        Which instances to drain, and so the minimum count of every
+        type, is decided beforehand by EC2Reconciler.plan().
+    """
+    def __init__(self, reconciler, remoteEnv, dryrun=False, timeout=300, flushDelay=10, workers=16):
+        self.reconciler = reconciler
+        self.remoteEnv  = remoteEnv
+        self.dryrun     = dryrun
+        self.timeout    = timeout
+        self.flushDelay = flushDelay
+        self.workers    = workers
+        self.ready      = []
+        self.condition  = threading.Condition()
+
+    def _target(self, host):
+        remoteEnv = self.remoteEnv
+        slave     = remoteEnv.slaveStatus(host.hostname)
+        if slave is not None and slave['connected'] and not remoteEnv.masterStatus.isStale(slave):
+            master = remoteEnv.findMaster(slave['master'])
+            if master is not None:
+                return host, (masterURL(master), host.hostname)
+        try:
+            if not host.probed:
+                host.connect()
+            return host, host.shutdown_target()
+        except:
+            log.error('unable to find the master of %s' % host.hostname, exc_info=True)
+            return host, None
+
+    def _disconnected(self, url, slavename):
+        def check(host):
+            return slaveDisconnected(url, slavename)
+        return check
+
+    def _shutdownDone(self, host, timedOut):
+        self.condition.acquire()
+        try:
+            self.ready.append(host.info['id'])
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def run(self, hosts, instances):
+        """ Drain and stop the instances of hosts, returns an
+            instance id -> bool map of the stop results
+        """
+        results = {}
+        if len(hosts) == 0:
+            return results
+
+        batch = ShutdownBatch(self.remoteEnv, dryrun=self.dryrun)
+        for host, target in self.reconciler._map(self._target, hosts):
+            if target is None or not batch.add(host, context=host.info['id'], target=target):
+                log.info('%s: no graceful shutdown possible' % host.hostname)
+                self.ready.append(host.info['id'])
+
+        shutdowns = batch.run()
+
+        if self.dryrun:
+            for host in hosts:
+                log.info('would have stopped %s [%s]' % (host.hostname, host.info['id']))
+            return results
+
+        waiter = ShutdownWaiter(timeout=self.timeout)
+        for entry in batch.entries:
+            host = entry['host']
+            if shutdowns.get(host.hostname, False):
+                check = None
+                if host.client is None:
+                    check = self._disconnected(entry['url'], entry['slavename'])
+                waiter.park(host, self._shutdownDone, check=check)
+            else:
+                self.ready.append(host.info['id'])
+
+        pending = len(hosts)
+        while pending > 0:
+            # collect what finishes within flushDelay into one batch
+            deadline = time.time() + self.flushDelay
+            self.condition.acquire()
+            try:
+                while len(self.ready) < pending and time.time() < deadline:
+                    self.condition.wait(max(0, deadline - time.time()))
+                ready      = self.ready
+                self.ready = []
+            finally:
+                self.condition.release()
+
+            if len(ready) > 0:
+                results.update(self.reconciler.stop(ready, instances))
+                pending -= len(ready)
+
+        waiter.join()
+        return results
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.events
+
+    Publish kittenherder events on a ZeroMQ PUB socket
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import time
+import json
+import threading
+
+from multiprocessing import get_logger
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+from .workqueue import workerID
+
+
+log = get_logger()
+
+# topics, the first frame of every message
+check  = 'check'
+state  = 'state'
+reboot = 'reboot'
+timing = 'timing'
+# build started/finished, from a Pulse bridge or a test replay
+build  = 'build'
+
+topics = (check, state, reboot, timing, build)
+
+
+def _context():
+    if zmq is None:
+        raise RuntimeError('pyzmq is needed for the event bus')
+    # one context per process so inproc:// endpoints can be shared
+    return zmq.Context.instance()
+
+def _open(socket, endpoint):
+    """ Endpoints follow the czmq convention: '@endpoint' binds,
+        '>endpoint' connects, plain endpoints bind
+    """
+    if endpoint.startswith('>'):
+        socket.connect(endpoint[1:])
+    else:
+        socket.bind(endpoint.lstrip('@'))
+
+def _setHWM(socket, option, hwm):
+    # zeromq 2.x has a single HWM option, 3.x+ one per direction
+    if hasattr(zmq, option):
+        socket.setsockopt(getattr(zmq, option), hwm)
+    else:
+        socket.setsockopt(zmq.HWM, hwm)
+
+class EventPublisher(object):
+    """ Messages are two frames, the topic and a json object holding
+        the event fields plus 'ts' (epoch seconds), 'host' and 'herder'
+        (the host:pid of the publishing kittenherder).
+
+        Sends never block: once hwm messages are queued for a slow
+        subscriber zeromq discards new ones for it, and with no
+        subscriber at all nothing is queued. Sends that fail outright
+        are counted in self.dropped. The socket is shared by the
+        worker, waiter and tracker threads so sends are serialized
+        with a lock.
+    """
+    def __init__(self, endpoint, hwm=1000):
+        self.endpoint  = endpoint
+        self.herder    = workerID()
+        self.published = 0
+        self.dropped   = 0
+        self.lock      = threading.Lock()
+        self.socket    = _context().socket(zmq.PUB)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        _setHWM(self.socket, 'SNDHWM', hwm)
+        _open(self.socket, endpoint)
+        log.info('publishing events on %s' % endpoint)
+
+    def publish(self, topic, hostname=None, **fields):
+        fields['ts']     = time.time()
+        fields['host']   = hostname
+        fields['herder'] = self.herder
+        try:
+            data = json.dumps(fields, default=str)
+        except:
+            log.error('unable to encode %s event for %s' % (topic, hostname), exc_info=True)
+            return False
+
+        self.lock.acquire()
+        try:
+            try:
+                self.socket.send_multipart([topic, data], flags=zmq.NOBLOCK)
+                self.published += 1
+                return True
+            except zmq.ZMQError:
+                self.dropped += 1
+                return False
+        finally:
+            self.lock.release()
+
+    def close(self):
+        if self.dropped > 0:
+            log.info('%d of %d events could not be sent on %s' % (self.dropped, self.published + self.dropped, self.endpoint))
+        self.socket.close()
+
+class EventSubscriber(object):
+    """ Receive (topic, event) pairs from one or more publishers
+    """
+    def __init__(self, endpoint, topics=('',), hwm=10000):
+        self.socket = _context().socket(zmq.SUB)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        _setHWM(self.socket, 'RCVHWM', hwm)
+        for topic in topics:
+            self.socket.setsockopt(zmq.SUBSCRIBE, topic)
+        if endpoint.startswith('@'):
+            _open(self.socket, endpoint)
+        else:
+            self.connect(endpoint)
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+
+    def connect(self, endpoint):
+        """ Also receive from the publisher at endpoint
+        """
+        self.socket.connect(endpoint.lstrip('>'))
+
+    def recv(self, timeout=None):
+        """ Return the next (topic, event) or None if nothing arrived
+            within timeout seconds
+        """
+        if timeout is not None:
+            if not self.poller.poll(timeout * 1000):
+                return None
+        topic, data = self.socket.recv_multipart()
+        try:
+            return topic, json.loads(data)
+        except:
+            log.error('bad %s event: %s' % (topic, data), exc_info=True)
+            return topic, None
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.history
+
+    Local SQLite store of kitten check results and reboot attempts
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+
+    Usage
+        python -m releng.history --db kittenherder.sqlite history talos-r3-w7-029
+        python -m releng.history --db kittenherder.sqlite reboots --days 30 --min 3
+        python -m releng.history --db kittenherder.sqlite methods --days 7
+"""
+
+import time
+import sqlite3
+import threading
+
+from datetime import datetime
+from optparse import OptionParser
+from multiprocessing import get_logger
+
+
+log = get_logger()
+
+_schema = """
+CREATE TABLE IF NOT EXISTS kittens (
+    host      TEXT NOT NULL,
+    time      INTEGER NOT NULL,
+    platform  TEXT,
+    farm      TEXT,
+    reachable INTEGER,
+    buildbot  TEXT,
+    tacfile   TEXT,
+    lastseen  INTEGER,
+    reboot    INTEGER,
+    recovery  INTEGER,
+    pdu       INTEGER,
+    ipmi      INTEGER
+);
+CREATE INDEX IF NOT EXISTS kittens_host_time     ON kittens (host, time);
+CREATE INDEX IF NOT EXISTS kittens_platform_time ON kittens (platform, time);
+
+CREATE TABLE IF NOT EXISTS reboots (
+    host     TEXT NOT NULL,
+    time     INTEGER NOT NULL,
+    platform TEXT,
+    method   TEXT,
+    result   INTEGER,
+    message  TEXT
+);
+CREATE INDEX IF NOT EXISTS reboots_host_time     ON reboots (host, time);
+CREATE INDEX IF NOT EXISTS reboots_platform_time ON reboots (platform, time);
+CREATE INDEX IF NOT EXISTS reboots_method_result ON reboots (method, result);
+"""
+
+
+def _seconds(td):
+    if td is None:
+        return None
+    if isinstance(td, dict):
+        # processKitten() has already turned it into its report form
+        return td.get('since', None)
+    return (td.days * 86400) + td.seconds
+
+class HistoryStore(object):
+    """ Rows are buffered and written with one executemany() per table
+        once batchSize rows are pending, on flush() and on close().
+
+        Reboot attempts are logged from worker threads so the buffers
+        and the connection are guarded by a lock.
+    """
+    def __init__(self, filename, batchSize=100):
+        self.filename  = filename
+        self.batchSize = batchSize
+        self.kittens   = []
+        self.reboots   = []
+        self.lock      = threading.Lock()
+        self.conn      = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.executescript(_schema)
+
+    def addKitten(self, host, status, platform=None, farm=None, ts=None):
+        if ts is None:
+            ts = time.time()
+        row = (host, int(ts), platform, farm,
+               status.get('reachable', False),
+               status.get('buildbot', ''),
+               status.get('tacfile', ''),
+               _seconds(status.get('lastseen', None)),
+               status.get('reboot', False),
+               status.get('recovery', False),
+               status.get('pdu', False),
+               status.get('ipmi', False))
+        self.lock.acquire()
+        try:
+            self.kittens.append(row)
+            if len(self.kittens) >= self.batchSize:
+                self._flush()
+        finally:
+            self.lock.release()
+
+    def addReboot(self, host, method, result, message, platform=None, ts=None):
+        if ts is None:
+            ts = time.time()
+        self.lock.acquire()
+        try:
+            self.reboots.append((host, int(ts), platform, method, result, message))
+            if len(self.reboots) >= self.batchSize:
+                self._flush()
+        finally:
+            self.lock.release()
+
+    def _flush(self):
+        try:
+            if len(self.kittens) > 0:
+                self.conn.executemany('INSERT INTO kittens VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.kittens)
+            if len(self.reboots) > 0:
+                self.conn.executemany('INSERT INTO reboots VALUES (?, ?, ?, ?, ?, ?)', self.reboots)
+            self.conn.commit()
+        except:
+            log.error('unable to write history to %s' % self.filename, exc_info=True)
+            self.conn.rollback()
+        self.kittens = []
+        self.reboots = []
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self._flush()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def _query(self, sql, params=()):
+        self.lock.acquire()
+        try:
+            self._flush()
+            return self.conn.execute(sql, params).fetchall()
+        finally:
+            self.lock.release()
+
+    def history(self, host, limit=10):
+        """ Return the last limit check results for host, newest first
+        """
+        return self._query('SELECT time, reachable, buildbot, tacfile, lastseen, reboot, recovery, pdu, ipmi '
+                           'FROM kittens WHERE host = ? ORDER BY time DESC LIMIT ?', (host, limit))
+
+    def lastReboots(self, host, limit=10):
+        return self._query('SELECT time, method, result, message FROM reboots '
+                           'WHERE host = ? ORDER BY time DESC LIMIT ?', (host, limit))
+
+    def rebootCounts(self, since, minCount=1, platform=None):
+        """ Return (host, reboots) for hosts rebooted at least minCount
+            times since the given epoch, most rebooted first
+        """
+        sql    = 'SELECT host, COUNT(*) AS n FROM reboots WHERE time >= ?'
+        params = [int(since)]
+        if platform is not None:
+            sql += ' AND platform = ?'
+            params.append(platform)
+        sql += ' GROUP BY host HAVING n >= ? ORDER BY n DESC'
+        params.append(minCount)
+        return self._query(sql, params)
+
+    def methodResults(self, since):
+        """ Return (method, result, count) for reboots since the given epoch
+        """
+        return self._query('SELECT method, result, COUNT(*) FROM reboots WHERE time >= ? '
+                           'GROUP BY method, result ORDER BY method, result', (int(since),))
+
+    def idleSamples(self, since):
+        """ Return (host, lastseen) for every check of a reachable
+            host with a known last activity since the given epoch
+        """
+        return self._query('SELECT host, lastseen FROM kittens WHERE time >= ? '
+                           'AND reachable AND lastseen IS NOT NULL', (int(since),))
+
+    def rebootResults(self, since):
+        """ Return (host, result) for every reboot attempt since the given epoch
+        """
+        return self._query('SELECT host, result FROM reboots WHERE time >= ?', (int(since),))
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog --db FILE history HOST | reboots | methods')
+    parser.add_option('', '--db',   dest='db',   default='kittenherder.sqlite', help='history database')
+    parser.add_option('', '--days', dest='days', default='30',  help='how many days back to look')
+    parser.add_option('', '--min',  dest='min',  default='1',   help='minimum number of reboots')
+    parser.add_option('-n', '',     dest='n',    default='10',  help='number of entries to show')
+    (options, args) = parser.parse_args()
+
+    if len(args) == 0:
+        parser.error('missing command')
+
+    store = HistoryStore(options.db)
+    since = time.time() - int(options.days) * 86400
+
+    if args[0] == 'history' and len(args) > 1:
+        for row in store.history(args[1], int(options.n)):
+            print datetime.fromtimestamp(row[0]).strftime('%Y-%m-%d %H:%M'), row[1:]
+        for row in store.lastReboots(args[1], int(options.n)):
+            print datetime.fromtimestamp(row[0]).strftime('%Y-%m-%d %H:%M'), row[1:]
+    elif args[0] == 'reboots':
+        for host, n in store.rebootCounts(since, int(options.min)):
+            print '%-30s %d' % (host, n)
+    elif args[0] == 'methods':
+        for method, result, n in store.methodResults(since):
+            print '%-6s %-5s %d' % (method, bool(result), n)
+    else:
+        parser.error('unknown command %s' % args[0])
+
+    store.close()
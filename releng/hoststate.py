@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.hoststate
+
+    Per host state kept in redis between kittenherder runs
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import time
+
+from multiprocessing import get_logger
+
+
+log        = get_logger()
+_keyExpire = 1209600 # 14 days in seconds
+
+healthy          = 'healthy'
+idle             = 'idle'
+draining         = 'draining'
+rebootingSoft    = 'rebooting-soft'
+rebootingHard    = 'rebooting-hard'
+awaitingRecovery = 'awaiting-recovery'
+disabled         = 'disabled'
+
+states = (healthy, idle, draining, rebootingSoft, rebootingHard, awaitingRecovery, disabled)
+
+# seconds a host is left alone after entering a state, nothing a check
+# finds before then would change what is done to it
+holdTimes = { draining:         900,
+              rebootingSoft:    900,
+              rebootingHard:    1800,
+              awaitingRecovery: 3600,
+            }
+
+
+class HostStates(object):
+    """ The kittenherder:state:<host> hash holds the current state, the
+        previous one, when (epoch seconds) the host entered it and why,
+        plus one field per state with the last time it was entered.
+
+        Actions taken on a host (set()) always move it; what a check
+        observes (observe()) never overrides an action taken during the
+        same run, e.g. a host rebooted a minute ago still looks hung to
+        the check that decided to reboot it.
+
+        Every state change is also published on events, an
+        EventPublisher from releng.events, when one is given.
+    """
+    def __init__(self, db, holdTimes=holdTimes, events=None):
+        self.db        = db
+        self.holdTimes = holdTimes
+        self.events    = events
+        self.moved     = set()
+
+    def key(self, hostname):
+        return 'kittenherder:state:%s' % hostname
+
+    def get(self, hostname):
+        """ Return the stored state of hostname as a dict or None
+        """
+        try:
+            d = self.db.hgetall(self.key(hostname))
+        except:
+            log.error('unable to read state of %s' % hostname, exc_info=True)
+            return None
+        if not d or d.get('state', None) not in states:
+            return None
+        for f in ['since'] + list(states):
+            if f in d:
+                d[f] = float(d[f])
+        return d
+
+    def set(self, hostname, state, reason=''):
+        self.moved.add(hostname)
+        self._set(hostname, state, reason)
+
+    def observe(self, hostname, state, reason=''):
+        if hostname not in self.moved:
+            self._set(hostname, state, reason)
+
+    def _set(self, hostname, state, reason):
+        if state not in states:
+            raise ValueError('unknown host state %s' % state)
+
+        now     = time.time()
+        key     = self.key(hostname)
+        current = self.get(hostname)
+        try:
+            if current is None or current['state'] != state:
+                if current is not None:
+                    self.db.hset(key, 'previous', current['state'])
+                    log.debug('%s: %s -> %s %s' % (hostname, current['state'], state, reason))
+                self.db.hset(key, 'state',  state)
+                self.db.hset(key, 'since',  now)
+                self.db.hset(key, state,    now)
+                if self.events is not None:
+                    previous = None
+                    if current is not None:
+                        previous = current['state']
+                    self.events.publish('state', hostname, state=state, previous=previous, reason=reason)
+            self.db.hset(key, 'reason', reason)
+            self.db.expire(key, _keyExpire)
+        except:
+            log.error('unable to store state of %s' % hostname, exc_info=True)
+
+    def nextAction(self, hostname, now=None):
+        """ Return ('skip', reason) while hostname is inside the hold
+            time of its state, ('check', None) otherwise
+        """
+        current = self.get(hostname)
+        if current is None:
+            return 'check', None
+
+        hold = self.holdTimes.get(current['state'], None)
+        if hold is not None:
+            if now is None:
+                now = time.time()
+            age = now - current['since']
+            if age < hold:
+                return 'skip', '%s for %dm, next check in %dm' % (current['state'], age / 60, (hold - age) / 60 + 1)
+
+        return 'check', None
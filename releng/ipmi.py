@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.ipmi
+
+    Power cycle hosts through the web CGI of their IPMI BMC
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import time
+import threading
+
+import requests
+
+from multiprocessing import get_logger
+from multiprocessing.pool import ThreadPool
+
+
+log = get_logger()
+
+
+class IPMIEngine(object):
+    """ Keeps one logged in requests.Session per BMC so the login
+        cookie is reused for every request made to it during a run,
+        and power cycles many hosts concurrently with at most
+        workers requests in flight.
+
+        self.stats holds, per BMC, the number of logins, power cycle
+        requests and failures and the total and maximum latency.
+    """
+    def __init__(self, user, password, timeout=10, workers=8):
+        self.user     = user
+        self.password = password
+        self.timeout  = timeout
+        self.workers  = workers
+        self.sessions = {}
+        self.locks    = {}
+        self.stats    = {}
+        self.lock     = threading.Lock()
+
+    def _bmc(self, bmc):
+        self.lock.acquire()
+        try:
+            if bmc not in self.locks:
+                self.locks[bmc] = threading.Lock()
+                self.stats[bmc] = { 'logins': 0, 'requests': 0, 'failures': 0, 'latency': 0.0, 'max': 0.0 }
+            return self.locks[bmc], self.stats[bmc]
+        finally:
+            self.lock.release()
+
+    def _login(self, bmc, stats):
+        log.debug('logging into ipmi at %s' % bmc)
+        session = requests.Session()
+        r = session.post("http://%s/cgi/login.cgi" % bmc,
+                         data={ 'name': self.user,
+                                'pwd':  self.password,
+                              },
+                         timeout=self.timeout)
+        stats['logins'] += 1
+        if r.status_code != 200:
+            log.error('error during ipmi login [%s] [%s]' % (bmc, r.status_code))
+            return None
+        self.sessions[bmc] = session
+        return session
+
+    def powerCycle(self, bmc):
+        """ Push the button! Returns True if the BMC accepted the request
+        """
+        lock, stats = self._bmc(bmc)
+        url         = "http://%s/cgi/ipmi.cgi" % bmc
+        result      = False
+        start       = time.time()
+
+        lock.acquire()
+        try:
+            # a cached session may have expired, so log in again once
+            for attempt in (1, 2):
+                try:
+                    session = self.sessions.get(bmc, None)
+                    if session is None:
+                        session = self._login(bmc, stats)
+                        if session is None:
+                            break
+                    # e.g.
+                    # http://10.12.48.105/cgi/ipmi.cgi?POWER_INFO.XML=(1%2C3)&time_stamp=Wed%20Mar%2021%202012%2010%3A26%3A57%20GMT-0400%20(EDT)
+                    log.debug("sending power cycle request via %s" % url)
+                    r = session.get(url,
+                                    params={ 'POWER_INFO.XML': "(1,3)",
+                                             'time_stamp': time.strftime("%a %b %d %Y %H:%M:%S"),
+                                           },
+                                    timeout=self.timeout)
+                    result = r.status_code == 200
+                    if not result:
+                        log.error('error during rebootIPMI request [%s] [%s]' % (url, r.status_code))
+                except:
+                    log.error('error connecting to IPMI at %s' % bmc, exc_info=True)
+                    result = False
+                if result:
+                    break
+                self.sessions.pop(bmc, None)
+            elapsed            = time.time() - start
+            stats['requests'] += 1
+            stats['latency']  += elapsed
+            stats['max']       = max(stats['max'], elapsed)
+            if not result:
+                stats['failures'] += 1
+        finally:
+            lock.release()
+
+        return result
+
+    def rebootHosts(self, hosts):
+        """ Call rebootIPMI() for every host concurrently,
+            returns a hostname -> bool map
+        """
+        results = {}
+        if len(hosts) == 0:
+            return results
+
+        pool = ThreadPool(min(self.workers, len(hosts)))
+        try:
+            for hostname, result in pool.map(lambda host: (host.hostname, host.rebootIPMI()), hosts):
+                results[hostname] = result
+        finally:
+            pool.close()
+            pool.join()
+
+        return results
+
+    def report(self):
+        for bmc in self.stats:
+            stats = self.stats[bmc]
+            if stats['requests'] > 0:
+                log.info('ipmi %s: %d requests, %d failures, %d logins, avg %0.2fs max %0.2fs' %
+                         (bmc, stats['requests'], stats['failures'], stats['logins'],
+                          stats['latency'] / stats['requests'], stats['max']))
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.lastseen
+
+    Last build activity of every slave, fed by build start/finish events
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import time
+import json
+
+from multiprocessing import get_logger
+
+
+log = get_logger()
+
+lastSeenKey = 'kittenherder:lastseen'
+updatedKey  = 'kittenherder:lastseen:updated'
+
+
+def buildProperty(build, name):
+    for item in build.get('properties', []):
+        if len(item) >= 2 and item[0] == name:
+            return item[1]
+    return None
+
+def parseBuildEvent(data):
+    """ Return (slavename, epoch seconds) for a build started or finished
+        event, None for anything else.
+
+        data is either the body of a Pulse build message, where the slave
+        is the slavename build property and the time is the start or end
+        of the build's times, or a plain { 'slavename': ..., 'ts': ... }
+        as used by replay files.
+    """
+    if 'slavename' in data:
+        return data['slavename'], float(data.get('ts', None) or time.time())
+
+    routingKey = data.get('_meta', {}).get('routing_key', '')
+    if routingKey.endswith('.started'):
+        n = 0
+    elif routingKey.endswith('.finished'):
+        n = 1
+    else:
+        return None
+
+    build     = data.get('payload', {}).get('build', {})
+    slavename = buildProperty(build, 'slavename')
+    if slavename is None:
+        return None
+
+    times = build.get('times', None) or []
+    if len(times) > n and times[n] is not None:
+        ts = float(times[n])
+    else:
+        ts = time.time()
+    return slavename, ts
+
+class LastSeen(object):
+    """ The kittenherder:lastseen sorted set scores every slave with the
+        epoch seconds of its latest build start or finish. Scores only
+        ever move forward so replays and out of order events are safe.
+
+        The ingest worker touches kittenherder:lastseen:updated whenever
+        it writes; readers only trust the set while that is less than
+        maxAge seconds old, otherwise a stalled ingest would make every
+        slave look idle.
+    """
+    def __init__(self, db, maxAge=900):
+        self.db     = db
+        self.maxAge = maxAge
+
+    def fresh(self):
+        try:
+            updated = self.db.get(updatedKey)
+        except:
+            log.error('unable to read %s' % updatedKey, exc_info=True)
+            return False
+        return updated is not None and time.time() - float(updated) < self.maxAge
+
+    def get(self, slavename):
+        """ Return the epoch seconds of the slave's last build activity,
+            None if it is unknown or the set is stale
+        """
+        if not self.fresh():
+            return None
+        score = self.db.zscore(lastSeenKey, slavename)
+        if score is None:
+            return None
+        return float(score)
+
+    def activeSince(self, since):
+        """ Return the slaves with build activity after since
+        """
+        return self.db.zrangebyscore(lastSeenKey, since, '+inf')
+
+    def candidates(self, now, hoursFor, minHours):
+        """ Return every slave whose last activity is past its idle
+            threshold at now.
+
+            hoursFor(slavename) gives the threshold of a slave and
+            minHours is the lowest of them, so a single range query over
+            the set returns every possible candidate.
+
+            Slaves stay candidates for as long as they do not build, a
+            reboot that failed or did not take is retried by the next
+            run; releng.hoststate and releng.negcache decide how often.
+        """
+        result = []
+        for slavename, score in self.db.zrangebyscore(lastSeenKey, '-inf', now - (minHours * 3600), withscores=True):
+            if score <= now - (hoursFor(slavename) * 3600):
+                result.append(slavename)
+        return result
+
+    def unseen(self, slavenames):
+        """ Return the slaves of slavenames with no build activity at all
+        """
+        slavenames = list(slavenames)
+        pipe       = self.db.pipeline()
+        for slavename in slavenames:
+            pipe.zscore(lastSeenKey, slavename)
+        return [slavename for slavename, score in zip(slavenames, pipe.execute()) if score is None]
+
+    def update(self, activity, touch=True):
+        """ Store a slavename -> epoch seconds map, keeping the newer
+            of the stored and given times. Returns how many moved.
+
+            Only the ingest worker touches updatedKey, times learned by
+            kittenherder's own checks are stored with touch=False.
+        """
+        slaves = list(activity)
+        if len(slaves) == 0:
+            return 0
+
+        pipe = self.db.pipeline()
+        for slavename in slaves:
+            pipe.zscore(lastSeenKey, slavename)
+        scores = pipe.execute()
+
+        pipe  = self.db.pipeline()
+        moved = 0
+        for slavename, score in zip(slaves, scores):
+            if score is None or activity[slavename] > float(score):
+                pipe.zadd(lastSeenKey, activity[slavename], slavename)
+                moved += 1
+        if touch:
+            pipe.set(updatedKey, time.time())
+        pipe.execute()
+        return moved
+
+class LastSeenIngest(object):
+    """ Buffer build events and write them to LastSeen at most every
+        flushInterval seconds or batchSize slaves
+    """
+    def __init__(self, lastSeen, flushInterval=5, batchSize=500):
+        self.lastSeen      = lastSeen
+        self.flushInterval = flushInterval
+        self.batchSize     = batchSize
+        self.pending       = {}
+        self.lastFlush     = time.time()
+        self.count         = 0
+
+    def handle(self, data):
+        try:
+            event = parseBuildEvent(data)
+        except:
+            log.error('unable to parse build event', exc_info=True)
+            event = None
+        if event is not None:
+            slavename, ts = event
+            if ts > self.pending.get(slavename, 0):
+                self.pending[slavename] = ts
+            self.count += 1
+        if len(self.pending) >= self.batchSize or time.time() - self.lastFlush >= self.flushInterval:
+            self.flush()
+
+    def flush(self):
+        pending      = self.pending
+        self.pending = {}
+        try:
+            moved = self.lastSeen.update(pending)
+            if moved > 0:
+                log.debug('%d events, %d slaves updated' % (self.count, moved))
+        except:
+            log.error('unable to store activity of %d slaves' % len(pending), exc_info=True)
+            for slavename in pending:
+                self.pending[slavename] = max(pending[slavename], self.pending.get(slavename, 0))
+        self.count     = 0
+        self.lastFlush = time.time()
+
+    def replay(self, filename):
+        """ Feed a file of json build events, one per line
+        """
+        for line in open(filename, 'r'):
+            line = line.strip()
+            if len(line) > 0:
+                try:
+                    self.handle(json.loads(line))
+                except ValueError:
+                    log.error('bad event in %s: %s' % (filename, line))
+        self.flush()
+
+    def subscribe(self, subscriber):
+        """ Feed events from an EventSubscriber until interrupted
+        """
+        while True:
+            item = subscriber.recv(timeout=self.flushInterval)
+            if item is None:
+                self.flush()
+            elif item[1] is not None:
+                self.handle(item[1])
+
+    def listen(self, applabel='briar-patch-lastseen'):
+        """ Feed Pulse build messages until interrupted
+        """
+        from mozillapulse.consumers import BuildConsumer
+
+        def callback(data, message):
+            self.handle(data)
+            message.ack()
+
+        pulse = BuildConsumer(applabel=applabel)
+        pulse.configure(topic=['#.started', '#.finished'], callback=callback, durable=False)
+        pulse.listen()
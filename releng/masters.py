@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.masters
+
+    Bulk buildslave status collected from the buildbot masters
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import time
+import json
+import threading
+
+from multiprocessing import get_logger
+from multiprocessing.pool import ThreadPool
+
+from . import fetchUrl
+
+
+log = get_logger()
+
+
+def masterURL(master):
+    """ Return the base url of the web status for a slavealloc master entry
+    """
+    return 'http://%s:%s' % (master['fqdn'], master['http_port'])
+
+def slaveDisconnected(url, slavename, timeout=30):
+    """ Return True once the master at url reports slavename as no
+        longer connected, False while it is or if the master can't be
+        asked
+    """
+    data = fetchUrl('%s/json/slaves/%s' % (url, slavename), timeout=timeout)
+    if data is None:
+        return False
+    try:
+        return not json.loads(data).get('connected', False)
+    except:
+        log.error('unable to parse status of %s from %s' % (slavename, url), exc_info=True)
+        return False
+
+class MasterStatus(object):
+    """ Fetch the /json/slaves document of every master once and build
+        a slavename -> status map from it
+
+        Each slave entry is a dictionary:
+            master      nickname of the master reporting the slave
+            connected   True if the slave is attached to that master
+            idle        True if the slave is not running any builds
+            lastjob     start time (epoch) of the newest running build or None
+            collected   epoch when the master was queried
+
+        A slave is configured on many masters but is only connected to
+        one of them, so a connected entry always wins over a disconnected one.
+    """
+    def __init__(self, masters, maxAge=900, workers=8, timeout=30):
+        self.masters   = masters
+        self.maxAge    = maxAge
+        self.workers   = workers
+        self.timeout   = timeout
+        self.slaves    = {}
+        self.latency   = {}
+        self.failed    = []
+        self.collected = None
+
+    def _fetch(self, nickname):
+        master = self.masters[nickname]
+        url    = '%s/json/slaves' % masterURL(master)
+        start  = time.time()
+        data   = fetchUrl(url, timeout=self.timeout)
+        return nickname, data, time.time() - start
+
+    def collect(self):
+        self.slaves  = {}
+        self.latency = {}
+        self.failed  = []
+
+        nicknames = []
+        for nickname in self.masters:
+            master = self.masters[nickname]
+            if master is not None and master.get('enabled', True) and master.get('fqdn') and master.get('http_port'):
+                nicknames.append(nickname)
+
+        if len(nicknames) == 0:
+            return self.slaves
+
+        pool = ThreadPool(min(self.workers, len(nicknames)))
+        try:
+            results = pool.map(self._fetch, nicknames)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.collected = time.time()
+
+        for nickname, data, elapsed in results:
+            self.latency[nickname] = elapsed
+            if data is None:
+                self.failed.append(nickname)
+                continue
+            try:
+                slaves = json.loads(data)
+            except:
+                log.error('unable to parse slave status from %s' % nickname, exc_info=True)
+                self.failed.append(nickname)
+                continue
+
+            for slavename in slaves:
+                self.add(nickname, slavename, slaves[slavename])
+
+        log.info('collected status for %d slaves from %d masters (%d failed)' % (len(self.slaves), len(nicknames), len(self.failed)))
+
+        return self.slaves
+
+    def add(self, nickname, slavename, info):
+        running = info.get('runningBuilds', []) or []
+        lastjob = None
+        for build in running:
+            times = build.get('times', None)
+            if times and times[0] is not None and (lastjob is None or times[0] > lastjob):
+                lastjob = times[0]
+
+        entry = { 'master':    nickname,
+                  'connected': bool(info.get('connected', False)),
+                  'idle':      len(running) == 0,
+                  'lastjob':   lastjob,
+                  'collected': self.collected,
+                }
+
+        current = self.slaves.get(slavename, None)
+        if current is None or (entry['connected'] and not current['connected']):
+            self.slaves[slavename] = entry
+
+    def get(self, slavename):
+        return self.slaves.get(slavename, None)
+
+    def isStale(self, entry):
+        return entry['collected'] is None or (time.time() - entry['collected']) > self.maxAge
+
+class ShutdownBatch(object):
+    """ Graceful shutdown of many buildslaves grouped by their master
+
+        Hosts are added with add() which reads buildbot.tac over the
+        existing ssh channel. run() then fetches the state of every
+        master involved once, reusing MasterStatus data when it is fresh,
+        and requests the shutdowns concurrently with no more than
+        perMaster requests in flight against any one master.
+
+        After run() self.latency holds, per master, the time spent
+        fetching its state, the number of shutdowns requested and
+        the total and maximum time those requests took.
+    """
+    def __init__(self, remoteEnv, dryrun=False, perMaster=4, workers=16, timeout=30):
+        self.remoteEnv = remoteEnv
+        self.dryrun    = dryrun
+        self.perMaster = perMaster
+        self.workers   = workers
+        self.timeout   = timeout
+        self.entries   = []
+        self.groups    = {}
+        self.results   = {}
+        self.latency   = {}
+        self.semaphores = {}
+
+    def add(self, host, indent='', context=None, target=None):
+        """ Queue host for a graceful shutdown, returns False if it
+            cannot be shut down through its master.
+
+            target is the (master url, slavename) pair when the caller
+            already knows it, otherwise it is read from the host.
+        """
+        if target is None:
+            target = host.shutdown_target(indent=indent)
+        if target is None:
+            self.results[host.hostname] = False
+            return False
+
+        url, slavename = target
+        entry = { 'host':      host,
+                  'indent':    indent,
+                  'context':   context,
+                  'url':       url,
+                  'slavename': slavename,
+                }
+        self.entries.append(entry)
+        self.groups.setdefault(url, []).append(entry)
+        return True
+
+    def _masterSlaves(self, url):
+        """ Return the slavename -> connected map for the master at url
+        """
+        masterStatus = self.remoteEnv.masterStatus
+        hostname     = url.split('://', 1)[-1].split(':', 1)[0]
+        master       = self.remoteEnv.findMaster(hostname)
+
+        if masterStatus is not None and master is not None and \
+           master['nickname'] not in masterStatus.failed and masterStatus.collected is not None and \
+           (time.time() - masterStatus.collected) <= masterStatus.maxAge:
+            result = {}
+            for slavename in masterStatus.slaves:
+                entry = masterStatus.slaves[slavename]
+                if entry['master'] == master['nickname']:
+                    result[slavename] = entry['connected']
+            return url, result, 0.0
+
+        start = time.time()
+        data  = fetchUrl('%s/json/slaves' % url, timeout=self.timeout)
+        if data is None:
+            return url, None, time.time() - start
+        try:
+            slaves = json.loads(data)
+        except:
+            log.error('unable to parse slave status from %s' % url, exc_info=True)
+            return url, None, time.time() - start
+
+        result = {}
+        for slavename in slaves:
+            result[slavename] = bool(slaves[slavename].get('connected', False))
+        return url, result, time.time() - start
+
+    def _shutdown(self, entry):
+        start = time.time()
+        with self.semaphores[entry['url']]:
+            shutdownURL = '%s/buildslaves/%s/shutdown' % (entry['url'], entry['slavename'])
+            log.info('%sSetting shutdown via %s' % (entry['indent'], shutdownURL))
+            result = fetchUrl(shutdownURL, timeout=self.timeout) is not None
+        return entry, result, time.time() - start
+
+    def run(self):
+        """ Request the queued shutdowns, returns a hostname -> bool map
+        """
+        if len(self.groups) == 0:
+            return self.results
+
+        pool = ThreadPool(min(self.workers, max(len(self.groups), len(self.entries))))
+        try:
+            masters = pool.map(self._masterSlaves, self.groups.keys())
+
+            pending = []
+            for url, slaves, elapsed in masters:
+                self.latency[url] = { 'state': elapsed, 'count': 0, 'total': 0.0, 'max': 0.0 }
+                for entry in self.groups[url]:
+                    if slaves is None:
+                        self.results[entry['host'].hostname] = False
+                    elif not slaves.get(entry['slavename'], False):
+                        log.error('%sno shutdown form for %s' % (entry['indent'], entry['host'].hostname))
+                        self.results[entry['host'].hostname] = False
+                    elif self.dryrun:
+                        log.info('%sShutdown deferred' % entry['indent'])
+                        self.results[entry['host'].hostname] = True
+                    else:
+                        pending.append(entry)
+
+            self.semaphores = {}
+            for url in self.groups:
+                self.semaphores[url] = threading.BoundedSemaphore(self.perMaster)
+
+            for entry, result, elapsed in pool.map(self._shutdown, pending):
+                latency = self.latency[entry['url']]
+                latency['count'] += 1
+                latency['total'] += elapsed
+                latency['max']    = max(latency['max'], elapsed)
+                self.results[entry['host'].hostname] = result
+        finally:
+            pool.close()
+            pool.join()
+
+        for url in self.latency:
+            latency = self.latency[url]
+            if latency['count'] > 0:
+                log.info('%s: state %0.2fs, %d shutdowns avg %0.2fs max %0.2fs' %
+                         (url, latency['state'], latency['count'], latency['total'] / latency['count'], latency['max']))
+
+        return self.results
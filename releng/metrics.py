@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.metrics
+
+    Roll kittenherder events into time bucketed counters in redis
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import time
+
+from multiprocessing import get_logger
+
+from . import getPlatform
+from . import events
+
+
+log = get_logger()
+
+# name, bucket size and how long the buckets are kept, in seconds
+minute = ('minute', 60,    172800)   # 2 days
+hour   = ('hour',   3600,  2592000)  # 30 days
+day    = ('day',    86400, 31536000) # 1 year
+
+resolutions = (minute, hour, day)
+
+# upper bounds of the check latency histogram, in seconds
+latencyBounds = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def bucketStart(ts, resolution):
+    return int(ts) - (int(ts) % resolution[1])
+
+def indexKey(resolution):
+    return 'metrics:%s:buckets' % resolution[0]
+
+def seriesKey(resolution, start):
+    return 'metrics:%s:%d:series' % (resolution[0], start)
+
+def bucketKey(resolution, start, series):
+    return 'metrics:%s:%d:%s' % (resolution[0], start, series)
+
+def latencyField(seconds):
+    for bound in latencyBounds:
+        if seconds <= bound:
+            return 'latency:%s' % bound
+    return 'latency:inf'
+
+def latencyPercentiles(values, percentiles=(50, 90, 99)):
+    """ Estimate check latency percentiles from the histogram fields of
+        a bucket, each one is the upper bound of the histogram bin the
+        percentile falls in (None for the open ended last bin)
+    """
+    bins  = []
+    total = 0
+    for bound in latencyBounds + (None,):
+        if bound is None:
+            n = int(values.get('latency:inf', 0))
+        else:
+            n = int(values.get('latency:%s' % bound, 0))
+        bins.append((bound, n))
+        total += n
+
+    result = {}
+    for p in percentiles:
+        result[p] = None
+        if total == 0:
+            continue
+        seen = 0
+        for bound, n in bins:
+            seen += n
+            if seen * 100.0 >= total * p:
+                result[p] = bound
+                break
+    return result
+
+def readSeries(db, resolution, series, start, end):
+    """ Return [(bucket start, { field: count })] of one series, e.g.
+        readSeries(db, hour, 'platform:linux', ...) for a dashboard
+    """
+    result = []
+    starts = range(bucketStart(start, resolution), int(end) + 1, resolution[1])
+    keys   = [bucketKey(resolution, n, series) for n in starts]
+    for n, values in zip(starts, db.hgetallMany(keys)):
+        result.append((n, dict([(f, int(v)) for f, v in values.items()])))
+    return result
+
+class MetricsAggregator(object):
+    """ Counts events per minute, hour and day for every series an
+        event belongs to: all:all, platform:<platform>, farm:<farm> and
+        master:<master>. Reboot and state events carry no farm or master
+        so the last check event of their host is used for those.
+
+        Counts are kept in memory and every flush() sends them with one
+        pipeline of HINCRBY into the metrics:<resolution>:<start>:<series>
+        hashes of the minute, hour and day holding the event, so late
+        events and several aggregators add up without any read back.
+        The buckets are listed in the metrics:<resolution>:buckets sorted
+        sets and their series in metrics:<resolution>:<start>:series.
+
+        Each resolution expires after its own retention, so older data
+        is downsampled: minutes are kept for 2 days, hours for 30 days
+        and days for a year. prune() drops the expired buckets from the
+        indexes.
+
+        Fields:
+            checked, idle, unreachable, recovery        check events
+            latency:<bound>, latency:count, latency:ms  check latency
+            timing:<phase>:count, timing:<phase>:ms      timing events
+            reboot:attempt                               reboots tried
+            reboot:<method>:ok, reboot:<method>:failed   by ssh/pdu/ipmi
+            state:<state>                                state changes
+    """
+    def __init__(self, db):
+        self.db      = db
+        self.hosts   = {}
+        self.pending = {}
+        self.events  = 0
+
+    def series(self, event):
+        hostname = event.get('host', None)
+        info     = self.hosts.get(hostname, {})
+        result   = ['all:all']
+        if hostname is not None:
+            platform = getPlatform(hostname)
+            if platform != 'unknown':
+                result.append('platform:%s' % platform)
+        for dimension in ('farm', 'master'):
+            value = event.get(dimension, None) or info.get(dimension, None)
+            if value:
+                result.append('%s:%s' % (dimension, value))
+        return result
+
+    def fields(self, topic, event):
+        result = {}
+        if topic == events.check:
+            result['checked'] = 1
+            if not event.get('reachable', False):
+                result['unreachable'] = 1
+            elif 'active' not in (event.get('buildbot', None) or ''):
+                result['idle'] = 1
+            if event.get('recovery', False):
+                result['recovery'] = 1
+            elapsed = event.get('elapsed', None)
+            if elapsed is not None:
+                result[latencyField(elapsed)] = 1
+                result['latency:count']       = 1
+                result['latency:ms']          = int(elapsed * 1000)
+        elif topic == events.reboot:
+            if event.get('outcome', None) == 'attempt':
+                result['reboot:attempt'] = 1
+            elif event.get('method', None) is not None:
+                result['reboot:%s:%s' % (event['method'], event.get('outcome', 'unknown'))] = 1
+        elif topic == events.state:
+            result['state:%s' % event.get('state', 'unknown')] = 1
+        elif topic == events.timing and event.get('seconds', None) is not None:
+            phase = event.get('phase', 'unknown')
+            result['timing:%s:count' % phase] = 1
+            result['timing:%s:ms' % phase]    = int(event['seconds'] * 1000)
+        return result
+
+    def handle(self, topic, event):
+        if event is None:
+            return
+        if topic == events.check and event.get('host', None) is not None:
+            self.hosts[event['host']] = { 'farm':   event.get('farm', None),
+                                          'master': event.get('master', None),
+                                        }
+        fields = self.fields(topic, event)
+        if len(fields) == 0:
+            return
+
+        ts = event.get('ts', None) or time.time()
+        for series in self.series(event):
+            for resolution in resolutions:
+                counts = self.pending.setdefault((resolution, bucketStart(ts, resolution), series), {})
+                for field in fields:
+                    counts[field] = counts.get(field, 0) + fields[field]
+        self.events += 1
+
+    def flush(self):
+        """ Write the pending counts, returns the number of hashes updated
+        """
+        pending      = self.pending
+        self.pending = {}
+        if len(pending) == 0:
+            return 0
+
+        pipe = self.db.pipeline()
+        for resolution, start, series in pending:
+            counts = pending[(resolution, start, series)]
+            key    = bucketKey(resolution, start, series)
+            for field in counts:
+                pipe.hincrby(key, field, counts[field])
+            pipe.expire(key, resolution[2])
+            pipe.sadd(seriesKey(resolution, start), series)
+            pipe.expire(seriesKey(resolution, start), resolution[2])
+            pipe.zadd(indexKey(resolution), start, start)
+        try:
+            pipe.execute()
+        except:
+            log.error('unable to write %d metric buckets' % len(pending), exc_info=True)
+            # keep them for the next flush
+            for item in pending:
+                counts = self.pending.setdefault(item, {})
+                for field in pending[item]:
+                    counts[field] = counts.get(field, 0) + pending[item][field]
+            return 0
+        return len(pending)
+
+    def prune(self, now=None):
+        """ Drop the buckets past their retention from the indexes
+        """
+        if now is None:
+            now = time.time()
+        for resolution in resolutions:
+            self.db.zremrangebyscore(indexKey(resolution), '-inf', now - resolution[2])
+
+    def run(self, subscriber, flushInterval=10, pruneInterval=3600):
+        """ Aggregate events from an EventSubscriber until interrupted
+        """
+        lastFlush = time.time()
+        lastPrune = 0
+        while True:
+            item = subscriber.recv(timeout=1)
+            if item is not None:
+                self.handle(*item)
+
+            now = time.time()
+            if now - lastFlush >= flushInterval:
+                n = self.flush()
+                if n > 0:
+                    log.debug('%d events, %d buckets written' % (self.events, n))
+                self.events = 0
+                lastFlush   = now
+            if now - lastPrune >= pruneInterval:
+                self.prune(now)
+                lastPrune = now
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.negcache
+
+    Back off from hosts that keep failing to resolve or respond
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import time
+import json
+import hashlib
+
+from multiprocessing import get_logger
+
+
+log        = get_logger()
+_keyExpire = 1209600 # 14 days in seconds
+
+unresolvable = 'unresolvable'
+unreachable  = 'unreachable'
+
+# seconds to wait after the first failure of each type, doubled
+# for every further failure in a row
+backoff = { unresolvable: 3600,
+            unreachable:  900,
+          }
+
+
+def fingerprint(info):
+    """ Return a digest of a host's slavealloc entry
+    """
+    if info is None:
+        return ''
+    return hashlib.md5(json.dumps(info, sort_keys=True, default=str)).hexdigest()
+
+class NegativeCache(object):
+    """ The kittenherder:negative:<host> hash holds the type of the last
+        failure, how many times in a row the host failed that way, when
+        it was first and last tried and when it may be tried again.
+
+        The delay before the next try starts at backoff[failure] and
+        doubles with every failure up to maxDelay. A different type of
+        failure starts over, a successful check clears the entry and a
+        change to the host's slavealloc entry (someone fixed DNS, moved
+        it, re-enabled it...) lets it be tried right away.
+    """
+    def __init__(self, db, backoff=backoff, maxDelay=86400):
+        self.db       = db
+        self.backoff  = backoff
+        self.maxDelay = maxDelay
+
+    def key(self, hostname):
+        return 'kittenherder:negative:%s' % hostname
+
+    def get(self, hostname):
+        try:
+            d = self.db.hgetall(self.key(hostname))
+        except:
+            log.error('unable to read negative cache entry for %s' % hostname, exc_info=True)
+            return None
+        if not d or 'failure' not in d:
+            return None
+        d['count'] = int(d['count'])
+        for f in ('first', 'last', 'next'):
+            d[f] = float(d[f])
+        return d
+
+    def skip(self, hostname, info, now=None):
+        """ Return the entry for hostname if it should not be tried
+            yet, None if it should be checked
+        """
+        entry = self.get(hostname)
+        if entry is None:
+            return None
+
+        if entry.get('fingerprint', '') != fingerprint(info):
+            log.info('%s: slavealloc entry changed since it was last %s, retrying' % (hostname, entry['failure']))
+            self.clear(hostname)
+            return None
+
+        if now is None:
+            now = time.time()
+        if now >= entry['next']:
+            return None
+        return entry
+
+    def fail(self, hostname, failure, info):
+        now   = time.time()
+        entry = self.get(hostname)
+        if entry is not None and entry['failure'] == failure:
+            count = entry['count'] + 1
+            first = entry['first']
+        else:
+            count = 1
+            first = now
+
+        delay = min(self.backoff[failure] * (2 ** (count - 1)), self.maxDelay)
+        key   = self.key(hostname)
+        try:
+            self.db.hset(key, 'failure',     failure)
+            self.db.hset(key, 'count',       count)
+            self.db.hset(key, 'first',       first)
+            self.db.hset(key, 'last',        now)
+            self.db.hset(key, 'next',        now + delay)
+            self.db.hset(key, 'fingerprint', fingerprint(info))
+            self.db.expire(key, _keyExpire)
+        except:
+            log.error('unable to store negative cache entry for %s' % hostname, exc_info=True)
+
+        log.debug('%s %s %d times, next try in %dm' % (hostname, failure, count, delay / 60))
+
+    def clear(self, hostname):
+        try:
+            self.db.delete(self.key(hostname))
+        except:
+            log.error('unable to clear negative cache entry for %s' % hostname, exc_info=True)
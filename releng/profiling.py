@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.profiling
+
+    cProfile a kittenherder run, all of it or only chosen phases
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+
+    The stats file written can be read with pstats, e.g.
+        python -c "import pstats; pstats.Stats('run.prof').sort_stats('cumulative').print_stats(30)"
+
+    Worker processes each write their own file, merge() adds them up;
+    kittenherder --profilemerge does that at the end of a run.
+"""
+
+import os
+import sys
+import pstats
+import cProfile
+import StringIO
+import threading
+
+from functools import wraps
+from multiprocessing import get_logger
+
+from . import timing
+
+
+log = get_logger()
+
+
+def resolve(spec):
+    """ Return (owner, name, function) for 'module:function' or
+        'module:Class.method'
+    """
+    moduleName, path = spec.split(':', 1)
+    __import__(moduleName)
+    owner = sys.modules[moduleName]
+    names = path.split('.')
+    for name in names[:-1]:
+        owner = getattr(owner, name)
+    name = names[-1]
+    if isinstance(owner, type) or hasattr(owner, '__bases__'):
+        # the plain function, not an unbound method
+        func = owner.__dict__[name]
+    else:
+        func = getattr(owner, name)
+    if not callable(func):
+        raise ValueError('%s is not a function' % spec)
+    return owner, name, func
+
+def merge(filename, sources):
+    """ Add the stats files sources up into filename, returns the
+        merged pstats.Stats or None if none could be read. filename
+        itself is skipped if it is one of the sources.
+    """
+    stats  = None
+    merged = 0
+    for source in sources:
+        if os.path.abspath(source) == os.path.abspath(filename):
+            continue
+        try:
+            if stats is None:
+                stats = pstats.Stats(source)
+            else:
+                stats.add(source)
+            merged += 1
+        except:
+            log.error('unable to read profile %s' % source, exc_info=True)
+    if stats is not None:
+        try:
+            stats.dump_stats(filename)
+            log.info('merged %d profiles into %s' % (merged, filename))
+        except:
+            log.error('unable to write profile to %s' % filename, exc_info=True)
+    return stats
+
+class Profiler(object):
+    """ One cProfile.Profile per thread, merged into a single stats
+        file by stop().
+
+        Without phases the whole run is profiled: the calling thread
+        from start() on, and every thread started afterwards (waiter,
+        tracker, shutdown and IPMI pools...) from its first call.
+
+        phases restricts profiling to the time spent inside them. A
+        phase is either a releng.timing phase name (check, ssh-wait,
+        rebootIfNeeded...) or a function given as module:function or
+        module:Class.method, e.g. releng.remote:Host._read or
+        __main__:sendEmail, which is wrapped for the run.
+    """
+    def __init__(self, filename, phases=None, top=25):
+        self.filename  = filename
+        self.top       = top
+        self.phases    = set()
+        self.functions = []
+        self.whole     = not phases
+        self.profiles  = []
+        self.wrapped   = []
+        self.local     = threading.local()
+        self.lock      = threading.Lock()
+
+        for item in phases or []:
+            if ':' in item:
+                self.functions.append(item)
+            else:
+                self.phases.add(item)
+
+    def _profile(self):
+        profile = getattr(self.local, 'profile', None)
+        if profile is None:
+            profile           = cProfile.Profile()
+            self.local.profile = profile
+            self.local.depth   = 0
+            self.lock.acquire()
+            try:
+                self.profiles.append(profile)
+            finally:
+                self.lock.release()
+        return profile
+
+    def enter(self):
+        profile = self._profile()
+        if self.local.depth == 0:
+            profile.enable()
+        self.local.depth += 1
+
+    def exit(self):
+        profile = self._profile()
+        self.local.depth -= 1
+        if self.local.depth == 0:
+            profile.disable()
+
+    def _threadStart(self, frame, event, arg):
+        # first profile event of a new thread, hand it over to cProfile
+        sys.setprofile(None)
+        self.enter()
+
+    def _wrap(self, spec):
+        owner, name, func = resolve(spec)
+        profiler = self
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler.enter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.exit()
+
+        setattr(owner, name, wrapper)
+        self.wrapped.append((owner, name, func))
+
+    def start(self):
+        if self.whole:
+            threading.setprofile(self._threadStart)
+            self.enter()
+        else:
+            for spec in self.functions:
+                try:
+                    self._wrap(spec)
+                except:
+                    log.error('unable to profile %s' % spec, exc_info=True)
+            timing.profiler = self
+        log.info('profiling %s' % (', '.join(sorted(self.phases) + self.functions) or 'the whole run'))
+
+    def stop(self):
+        """ Stop profiling, write the merged stats and return them
+        """
+        if self.whole:
+            threading.setprofile(None)
+            self.exit()
+        else:
+            timing.profiler = None
+            for owner, name, func in self.wrapped:
+                setattr(owner, name, func)
+            self.wrapped = []
+
+        stats = None
+        for profile in self.profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # a profile that never ran anything has no stats
+                pass
+
+        if stats is None:
+            log.info('nothing was profiled')
+            return None
+
+        try:
+            stats.dump_stats(self.filename)
+            log.info('profile of %d threads written to %s' % (len(self.profiles), self.filename))
+        except:
+            log.error('unable to write profile to %s' % self.filename, exc_info=True)
+        return stats
+
+    def report(self, stats):
+        """ Return the top cumulative hot spots as lines
+        """
+        out         = StringIO.StringIO()
+        stats.stream = out
+        stats.sort_stats('cumulative').print_stats(self.top)
+        return [line for line in out.getvalue().split('\n') if line.strip()]
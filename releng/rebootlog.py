@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.rebootlog
+
+    Append-only per host log of reboot attempts
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import os
+import json
+import fcntl
+
+from datetime import datetime
+from multiprocessing import get_logger
+
+
+log = get_logger()
+
+
+def _dthandler(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return None
+
+class RebootLog(object):
+    """ One JSON document per line in <path>/<hostname>.jsonl
+
+        Each append is a single write() to a file opened with O_APPEND
+        while holding an exclusive flock, so parallel herders never
+        interleave or lose entries.
+
+        A file is rotated to .1, .2, ... (keeping backupCount of them)
+        once it is larger than maxBytes or its oldest entry is older
+        than maxAge seconds.
+
+        The <hostname>.json files written before this format are still
+        read by last() after the rotated files.
+    """
+    def __init__(self, path, maxBytes=262144, maxAge=2592000, backupCount=4):
+        self.path        = path
+        self.maxBytes    = maxBytes
+        self.maxAge      = maxAge
+        self.backupCount = backupCount
+
+    def filename(self, hostname):
+        return os.path.join(self.path, '%s.jsonl' % hostname)
+
+    def append(self, hostname, entry):
+        logFile = self.filename(hostname)
+        line    = json.dumps(entry, sort_keys=True, default=_dthandler) + '\n'
+
+        fd = self._open(logFile)
+        try:
+            if self._needsRotation(logFile, fd):
+                self._rotate(logFile)
+                os.close(fd)
+                fd = self._open(logFile)
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def _open(self, logFile):
+        """ Open and lock logFile, retrying if another writer rotated
+            it while we were waiting for the lock
+        """
+        while True:
+            fd = os.open(logFile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(logFile).st_ino:
+                    return fd
+            except OSError:
+                pass
+            os.close(fd)
+
+    def _needsRotation(self, logFile, fd):
+        st = os.fstat(fd)
+        if st.st_size == 0:
+            return False
+        if st.st_size >= self.maxBytes:
+            return True
+        if self.maxAge is not None:
+            h = open(logFile, 'r')
+            try:
+                first = h.readline()
+            finally:
+                h.close()
+            try:
+                oldest = datetime.strptime(json.loads(first)['asctime'][:19], '%Y-%m-%dT%H:%M:%S')
+                age    = datetime.now() - oldest
+                return (age.days * 86400) + age.seconds > self.maxAge
+            except:
+                return False
+        return False
+
+    def _rotate(self, logFile):
+        for n in range(self.backupCount - 1, 0, -1):
+            src = '%s.%d' % (logFile, n)
+            if os.path.exists(src):
+                os.rename(src, '%s.%d' % (logFile, n + 1))
+        os.rename(logFile, '%s.1' % logFile)
+
+    def _tail(self, filename, n, blockSize=4096):
+        """ Return up to n decoded lines from the end of filename, newest first
+        """
+        result = []
+        if not os.path.exists(filename):
+            return result
+
+        h = open(filename, 'rb')
+        try:
+            h.seek(0, os.SEEK_END)
+            end  = h.tell()
+            data = ''
+            while end > 0 and data.count('\n') <= n:
+                size = min(blockSize, end)
+                end -= size
+                h.seek(end)
+                data = h.read(size) + data
+        finally:
+            h.close()
+
+        lines = data.splitlines()
+        if end > 0:
+            # the first line is most likely partial
+            lines = lines[1:]
+
+        for line in reversed(lines):
+            if len(result) >= n:
+                break
+            if line.strip():
+                try:
+                    result.append(json.loads(line))
+                except:
+                    log.error('bad reboot log entry in %s' % filename)
+        return result
+
+    def last(self, hostname, n=10):
+        """ Return the last n reboot attempts for hostname, newest first
+        """
+        logFile = self.filename(hostname)
+        result  = self._tail(logFile, n)
+
+        backup = 1
+        while len(result) < n and backup <= self.backupCount:
+            result += self._tail('%s.%d' % (logFile, backup), n - len(result))
+            backup += 1
+
+        if len(result) < n:
+            legacy = os.path.join(self.path, '%s.json' % hostname)
+            if os.path.exists(legacy) and os.path.getsize(legacy) > 0:
+                try:
+                    result += json.load(open(legacy))[:n - len(result)]
+                except:
+                    log.error('unable to read %s' % legacy, exc_info=True)
+
+        return result
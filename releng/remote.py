@@ -24,7 +24,7 @@ import time
 import json
 import socket
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from pytz import timezone
 import telnetlib
 import ssh
@@ -32,19 +32,30 @@ import requests
 import dns.resolver
 
 from multiprocessing import get_logger
-from . import fetchUrl, runCommand, getPassword, getSecrets, relative
+from . import fetchUrl, runCommand, getPassword, getSecrets, relative, getPlatform, getPool
 from releng.buildapi import last_build_endtime
+from releng.masters import MasterStatus, ShutdownBatch
+from releng.waiter import ShutdownWaiter, waitForShutdown
+from releng.tracker import RebootTracker, trackingTimes
+from releng.snmp import PDUBatch, snmpSet, outletOID, outletReboot
+from releng.ipmi import IPMIEngine
+from releng.rebootlog import RebootLog
+from releng.hoststate import draining, rebootingSoft, rebootingHard, awaitingRecovery
+import releng.events as events
+from releng.timing import phase, timed, count
 
 log = get_logger()
 
 urlSlaveAlloc = 'http://slavealloc.build.mozilla.org/api'
+rebootLogPath = '/home/buildduty/briar-patch/logs/slave_reboots'
 
 
 class Host(object):
     prompt = "$ "
     bbdir  = "/builds/slave"
 
-    def __init__(self, hostname, remoteEnv, verbose=False):
+    @timed('host')
+    def __init__(self, hostname, remoteEnv, verbose=False, connect=True):
         self.verbose   = verbose
         self.remoteEnv = remoteEnv
         self.hostname  = hostname
@@ -62,6 +73,7 @@ class Host(object):
         self.info      = None
         self.pinged    = False
         self.reachable = False
+        self.probed    = False
         self.pdu = {
             'pdu': None,
             'deviceID': None,
@@ -85,7 +97,8 @@ class Host(object):
                 self.info = remoteEnv.hosts[hostname]
 
             try:
-                dnsAnswer = dns.resolver.query(fullhostname)
+                with phase('dns', self):
+                    dnsAnswer = dns.resolver.query(fullhostname)
                 self.fqdn = '%s' % dnsAnswer.canonical_name
                 self.ip   = dnsAnswer[0]
             except:
@@ -95,7 +108,8 @@ class Host(object):
             if self.fqdn is not None:
                 try:
                     self.IPMIhost = "%s-mgmt.build.mozilla.org" % (hostname)
-                    dnsAnswer     = dns.resolver.query(self.IPMIhost)
+                    with phase('dns-ipmi', self):
+                        dnsAnswer = dns.resolver.query(self.IPMIhost)
                     self.IPMIip   = dnsAnswer[0]
                     self.hasIPMI  = True
                 except:
@@ -112,110 +126,115 @@ class Host(object):
             else:
                 self.farm = 'moz'
 
-        if self.fqdn is not None and not remoteEnv.passive:
-            if self.farm == 'ec2':
-                self.pinged = self.info['state'] == 'running'
-            else:
-                self.pinged, output = self.ping()
-            if self.pinged or self.isTegra:
-                if verbose:
-                    log.info('creating SSHClient')
-                self.client = ssh.SSHClient()
-                self.client.set_missing_host_key_policy(ssh.AutoAddPolicy())
-            else:
-                if verbose:
-                    log.info('unable to ping %s' % hostname)
+        self.shortname = hostname
+
+        if connect:
+            self.connect()
 
-            if self.isTegra:
-                self.bbdir = '/builds/%s' % hostname
+        if self.setPDUFromInventory():
+            self.hasPDU = True
 
-                if hostname in remoteEnv.tegras:
-                    self.foopy = remoteEnv.tegras[hostname]['foopy']
-                    log.info('foopy: %s' % self.foopy)
+    @timed('connect')
+    def connect(self):
+        """ Ping the host and open the remote shell used by run_cmd()
 
-                try:
-                    self.tegra = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            Called from __init__ unless the host was created with
+            connect=False, in which case the caller decides if the
+            ssh inspection is worth doing.
+        """
+        self.probed = True
+        remoteEnv   = self.remoteEnv
+        if self.fqdn is None or remoteEnv.passive:
+            return
 
-                    self.tegra.settimeout(float(120))
-                    self.tegra.connect((self.fqdn, 20700))
+        if self.farm == 'ec2':
+            self.pinged = self.info['state'] == 'running'
+        else:
+            self.pinged, output = self.ping()
+        if self.pinged or self.isTegra:
+            if self.verbose:
+                log.info('creating SSHClient')
+            self.client = ssh.SSHClient()
+            self.client.set_missing_host_key_policy(ssh.AutoAddPolicy())
+        else:
+            if self.verbose:
+                log.info('unable to ping %s' % self.shortname)
+
+        if self.isTegra:
+            self.bbdir = '/builds/%s' % self.shortname
+
+            if self.shortname in remoteEnv.tegras:
+                self.foopy = remoteEnv.tegras[self.shortname]['foopy']
+                log.info('foopy: %s' % self.foopy)
+
+            try:
+                self.tegra = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+                self.tegra.settimeout(float(120))
+                self.tegra.connect((self.fqdn, 20700))
+                self.reachable = True
+            except:
+                log.error('socket error establishing connection to tegra data port', exc_info=True)
+                self.tegra = None
+
+            if self.foopy is not None:
+                try:
+                    self.client.connect('%s.build.mtv1.mozilla.com' % self.foopy, username=remoteEnv.sshuser, password=remoteEnv.sshPassword, allow_agent=False, look_for_keys=False)
+                    self.transport = self.client.get_transport()
+                    self.channel   = self.transport.open_session()
+                    self.channel.get_pty()
+                    self.channel.invoke_shell()
+                except:
+                    log.error('socket error establishing ssh connection', exc_info=True)
+                    self.client = None
+        else:
+            if self.pinged:
+                try:
+                    if self.verbose:
+                        log.info('connecting to remote host')
+                    self.client.connect(self.fqdn, username=remoteEnv.sshuser, password=remoteEnv.sshPassword, allow_agent=False, look_for_keys=False)
+                    self.transport = self.client.get_transport()
+                    if self.verbose:
+                        log.info('opening session')
+                    self.channel   = self.transport.open_session()
+                    self.channel.get_pty()
+                    if self.verbose:
+                        log.info('invoking remote shell')
+                    self.channel.invoke_shell()
                     self.reachable = True
                 except:
-                    log.error('socket error establishing connection to tegra data port', exc_info=True)
-                    self.tegra = None
-
-                if self.foopy is not None:
-                    try:
-                        self.client.connect('%s.build.mtv1.mozilla.com' % self.foopy, username=remoteEnv.sshuser, password=remoteEnv.sshPassword, allow_agent=False, look_for_keys=False)
-                        self.transport = self.client.get_transport()
-                        self.channel   = self.transport.open_session()
-                        self.channel.get_pty()
-                        self.channel.invoke_shell()
-                    except:
-                        log.error('socket error establishing ssh connection', exc_info=True)
-                        self.client = None
-            else:
-                if self.pinged:
-                    try:
-                        if self.verbose:
-                            log.info('connecting to remote host')
-                        self.client.connect(self.fqdn, username=remoteEnv.sshuser, password=remoteEnv.sshPassword, allow_agent=False, look_for_keys=False)
-                        self.transport = self.client.get_transport()
-                        if self.verbose:
-                            log.info('opening session')
-                        self.channel   = self.transport.open_session()
-                        self.channel.get_pty()
-                        if self.verbose:
-                            log.info('invoking remote shell')
-                        self.channel.invoke_shell()
-                        self.reachable = True
-                    except:
-                        log.error('socket error establishing ssh connection', exc_info=True)
-                        self.client = None
-        if self.setPDUFromInventory():
-            self.hasPDU = True
+                    log.error('socket error establishing ssh connection', exc_info=True)
+                    self.client = None
 
-    def graceful_shutdown(self, indent='', dryrun=False):
+    def shutdown_target(self, indent=''):
+        """ Return the (master url, slavename) pair used to request a
+            graceful shutdown of buildbot, or None if it can't be done
+        """
         if not self.buildbot_active():
-            return False
+            return None
 
         tacinfo = self.get_tacinfo()
 
         if tacinfo is None:
             log.error("%sCouldn't get info from buildbot.tac; host is disabled?" % indent)
-            return False
+            return None
 
         host, port, hostname = tacinfo
 
         if 'staging' in host:
             log.warn("%sIgnoring staging host %s for host %s" % (indent, host, self.hostname))
-            return False
+            return None
 
         # HTTP port is host port - 1000
         port -= 1000
 
-        # Look at the host's page
-        url = "http://%s:%i/buildslaves/%s" % (host, port, hostname)
-        if self.verbose:
-            log.info("%sFetching host page %s" % (indent, url))
-        data = fetchUrl('%s?numbuilds=0' % url)
-
-        if data is None:
-            return False
+        return "http://%s:%i" % (host, port), hostname
 
-        if "Graceful Shutdown" not in data:
-            log.error("%sno shutdown form for %s" % (indent, self.hostname))
+    def graceful_shutdown(self, indent='', dryrun=False):
+        batch = ShutdownBatch(self.remoteEnv, dryrun=dryrun)
+        if not batch.add(self, indent=indent):
             return False
-
-        if self.verbose:
-            log.info("%sSetting shutdown" % indent)
-        if dryrun:
-            log.info("%sShutdown deferred" % indent)
-        else:
-            data = fetchUrl("%s/shutdown" % url)
-            if data is None:
-                return False
-
-        return True
+        return batch.run().get(self.hostname, False)
 
     def buildbot_active(self):
         cmd  = 'ls -l %s/twistd.pid' % self.bbdir
@@ -243,6 +262,7 @@ class Host(object):
         if master and port and host:
             return master.group(1), int(port.group(1)), host.group(1)
 
+    @timed('ssh-cmd', 0, 1)
     def run_cmd(self, cmd, fetch_output=True):
         log.debug("Running %s", cmd)
         if self.client is None:
@@ -270,10 +290,12 @@ class Host(object):
 
         # Strip out ANSI escape sequences
         # Setting position
-        buf = re.sub('\x1b\[\d+;\d+f', '', buf)
-        buf = re.sub('\x1b\[\d+m', '', buf)
+        with phase('ansi-strip', self):
+            buf = re.sub('\x1b\[\d+;\d+f', '', buf)
+            buf = re.sub('\x1b\[\d+m', '', buf)
         return buf
 
+    @timed('ssh-wait')
     def wait(self):
         log.debug('waiting for remote shell to respond')
         buf = []
@@ -290,6 +312,7 @@ class Host(object):
                     n += 1
                     if n > 15:
                         log.error('timeout waiting for shell')
+                        count('ssh-timeout', self)
                         break
                 except: # socket.error:
                     log.error('exception during wait()', exc_info=True)
@@ -297,6 +320,7 @@ class Host(object):
                     break
         return "".join(buf)
 
+    @timed('ping')
     def ping(self):
         # bash-3.2$ ping -c 2 -o tegra-056
         # PING tegra-056.build.mtv1.mozilla.com (10.250.49.43): 56 data bytes
@@ -316,6 +340,7 @@ class Host(object):
                 break
         return result, out
 
+    @timed('inventory')
     def setPDUFromInventory(self):
         remoteEnv = self.remoteEnv
         if None in [remoteEnv.inventoryURL, remoteEnv.inventoryUsername, remoteEnv.inventoryPassword]:
@@ -355,89 +380,53 @@ class Host(object):
         return False
 
     def logRebootAttempt(self, rebootMethod, result, message):
-        logFile = "/home/buildduty/briar-patch/logs/slave_reboots/%s.json" % self.hostname
         logMessage = {
             'asctime': datetime.now(),
             'reboot':  rebootMethod,
             'result':  result,
             'message': message,
             }
-        dthandler = lambda obj: obj.isoformat() if isinstance(obj, datetime) else None
-
-        rebootAttempts = []
-        if os.path.exists(logFile) and os.path.getsize(logFile) > 0:
-            json_data = open(logFile)
-            rebootAttempts = json.load(json_data)
-
-        rebootAttempts.insert(0, logMessage)
-
-        with open(logFile, 'w') as rebootLog:
-            rebootLog.write(json.dumps(rebootAttempts, sort_keys=True, indent=4, default=dthandler))
-            rebootLog.write("\n")
+        try:
+            self.remoteEnv.rebootLog.append(self.hostname, logMessage)
+        except:
+            log.error('unable to log reboot attempt for %s' % self.hostname, exc_info=True)
 
-    def rebootPDU(self):
-        result = False
+        if self.remoteEnv.history is not None:
+            self.remoteEnv.history.addReboot(self.hostname, rebootMethod, result, message, platform=getPlatform(self.hostname))
 
+    def pdu_target(self):
+        """ Return the (pdu, outlet oid) pair for this host or None
+        """
         if None in [self.pdu['pdu'], self.pdu['deviceID']]:
             log.warn('No pdu or deviceID available in rebootPDU')
-            return result
+            return None
 
-        pdu = self.pdu['pdu']
+        pdu      = self.pdu['pdu']
         deviceID = self.pdu['deviceID']
         log.debug("pdu='%s', deviceID='%s'" % (pdu, deviceID))
 
-        if deviceID[1] == 'B':
-            b = 2
-        else:
-            b = 1
+        return pdu, outletOID(deviceID)
 
-        log.debug('rebooting %s at %s %s' % (self.hostname, pdu, deviceID))
-        c   = int(deviceID[2:])
-        s   = '3.2.3.1.11.1.%d.%d' % (b, c)
-        oib = '1.3.6.1.4.1.1718.%s' % s
-        cmd = '/usr/bin/snmpset -v 1 -c private %s %s i 3' % (pdu, oib)
+    def rebootPDU(self):
+        result = False
+        target = self.pdu_target()
 
-        try:
-            log.info('Running: %s' % cmd)
-            result = os.system(cmd) == 0
-        except:
-            log.error('error running [%s]' % cmd, exc_info=True)
-            result = False
-        self.logRebootAttempt('PDU', result, cmd)
+        if target is None:
+            return result
+
+        pdu, oid = target
+        log.debug('rebooting %s at %s %s' % (self.hostname, pdu, oid))
+        result = snmpSet(pdu, [(oid, outletReboot)])
+        self.logRebootAttempt('PDU', result, 'snmpset %s %s i %d' % (pdu, oid, outletReboot))
         return result
 
     # code by Catlee, bugs by bear
-    def rebootIPMI(self, timeout=10):
+    def rebootIPMI(self):
         result = False
         if self.hasIPMI:
-            log.debug('logging into ipmi for %s at %s' % (self.hostname, self.IPMIip))
-            url = "http://%s/cgi/login.cgi" % self.IPMIip
-            try:
-                r = requests.post(url, data={ 'name': self.remoteEnv.ipmiUser,
-                                              'pwd':  self.remoteEnv.ipmiPassword,
-                                              },
-                                  timeout=timeout)
-                
-                if r.status_code == 200:
-                    # Push the button!
-                    # e.g.
-                    # http://10.12.48.105/cgi/ipmi.cgi?POWER_INFO.XML=(1%2C3)&time_stamp=Wed%20Mar%2021%202012%2010%3A26%3A57%20GMT-0400%20(EDT)
-                    url = "http://%s/cgi/ipmi.cgi" % self.IPMIip
-                    log.debug("logged in. sending power cycle request via %s" % url)
-                    r = requests.get(url,
-                                     params={ 'POWER_INFO.XML': "(1,3)",
-                                              'time_stamp': time.strftime("%a %b %d %Y %H:%M:%S"),
-                                            },
-                                     cookies = r.cookies,
-                                     timeout=timeout
-                                    )
-                else:
-                    log.error('error during rebootIPMI request [%s] [%s]' % (url, r.status_code))
-
-                result = r.status_code == 200
-            except:
-                log.error('error connecting to IPMI', exc_info=True)
-                result = False
+            log.debug('power cycling %s via ipmi at %s' % (self.hostname, self.IPMIip))
+            url    = "http://%s/cgi/ipmi.cgi" % self.IPMIip
+            result = self.remoteEnv.getIPMI().powerCycle('%s' % self.IPMIip)
             self.logRebootAttempt('IPMI', result, url)
         else:
             log.debug('IPMI not available')
@@ -509,9 +498,11 @@ class WinHost(Host):
 
             # Strip out ANSI escape sequences
             # Setting position
-            buf = re.sub('\x1b\[\d+;\d+f', '', buf)
+            with phase('ansi-strip', self):
+                buf = re.sub('\x1b\[\d+;\d+f', '', buf)
         return buf
 
+    @timed('ssh-wait')
     def wait(self):
         buf = []
         n   = 0
@@ -527,6 +518,7 @@ class WinHost(Host):
                     n += 1
                     if n > 15:
                         log.error('timeout waiting for shell')
+                        count('ssh-timeout', self)
                         break
                 except: # socket.error:
                     log.error('socket error', exc_info=True)
@@ -627,9 +619,9 @@ class TegraHost(UnixishHost):
         cmd = "rm -f %s/error.flg" % self.bbdir
         return self.run_cmd(cmd)
 
-    def rebootPDU(self):
+    def pdu_target(self):
         """
-        Try to reboot the given host, returning True if successful.
+        Return the (pdu, outlet oid) pair for the tegra or None.
 
         snmpset -c private pdu4.build.mozilla.org 1.3.6.1.4.1.1718.3.2.3.1.11.1.1.13 i 3
         1.3.6.1.4.1.1718.3.2.3.1.11.a.b.c
@@ -645,46 +637,28 @@ class TegraHost(UnixishHost):
         c   Outlet ID (1 - 16)
         y   command: 1 turn on, 2 turn off, 3 reboot
 
-        a and b are determined by the DeviceID we get from the devices.json file
+        a and b are determined by the DeviceID we get from the devices.json file,
+        see releng.snmp.outletOID()
 
            .AB14
               ^^ Outlet ID
              ^   InFeed code
             ^    Enclosure ID (we are assuming 1 (or A) below)
         """
-        result = False
-        cmd = ""
         if self.hostname in self.remoteEnv.tegras:
             pdu      = self.remoteEnv.tegras[self.hostname]['pdu']
             deviceID = self.remoteEnv.tegras[self.hostname]['pduid']
             if deviceID.startswith('.'):
-                if deviceID[2] == 'B':
-                    b = 2
-                else:
-                    b = 1
-
-                log.debug('rebooting %s at %s %s' % (self.hostname, pdu, deviceID))
-                c   = int(deviceID[3:])
-                s   = '3.2.3.1.11.1.%d.%d' % (b, c)
-                oib = '1.3.6.1.4.1.1718.%s' % s
-                cmd = '/usr/bin/snmpset -v 1 -c private %s %s i 3' % (pdu, oib)
-
-                try:
-                    log.info('Running: %s' % cmd)
-                    result = os.system(cmd) == 0
-                except:
-                    log.error('error running [%s]' % cmd, exc_info=True)
-                    result = False
+                return pdu, outletOID(deviceID)
         else:
             log.info("Cannot PDU reboot tegra: No match for '%s' in '%s'" % (self.hostname, self.remoteEnv.tegras))
-
-        self.logRebootAttempt('PDU', result, cmd)
-        return result
+        return None
 
 class AWSHost(UnixishHost):
     prompt = "]$ "
     bbdir  = "/builds/slave"
 
+    @timed('ssh-wait')
     def wait(self):
         log.debug('waiting for remote shell to respond')
         buf = []
@@ -700,6 +674,7 @@ class AWSHost(UnixishHost):
                     n += 1
                     if n > 30:
                         log.error('timeout waiting for shell')
+                        count('ssh-timeout', self)
                         break
                 except: # socket.error:
                     log.error('exception during wait()', exc_info=True)
@@ -734,6 +709,24 @@ class RemoteEnvironment():
         self.tegras    = {}
         self.hosts     = {}
         self.masters   = {}
+        self._masterIndex   = {}
+        self._masterPartial = {}
+        self.masterStatus   = None
+        self.shutdowns      = None
+        self.shutdownFlush  = 20
+        self.waiter         = None
+        self.pduBatch       = None
+        self.hardQueue      = []
+        self.ipmi           = None
+        self.rebooted       = []
+        self.tracker        = None
+        self.rebootHours    = 6
+        self.rebootThresholds = {}
+        self.rebootLog      = RebootLog(rebootLogPath)
+        self.history        = None
+        self.states         = None
+        self.events         = None
+        self.lastSeen       = None
         self.inventoryURL = None
         self.inventoryUsername = None
         self.inventoryPassword = None
@@ -759,13 +752,181 @@ class RemoteEnvironment():
         self.getHostInfo()
 
     def findMaster(self, masterName):
+        """ Return the slavealloc master entry for masterName.
+
+            masterName can be the master's nickname, FQDN, short hostname
+            or a partial dotted name such as 'buildbot-master10.build' or
+            'master10.build.scl1.mozilla.com'. Names the indexes do not
+            resolve, partial names shared by several masters or not on
+            label boundaries, fall back to the substring scan of the FQDNs.
+        """
         if masterName is not None:
+            key = masterName.lower()
+            if key.endswith('.'):
+                key = key[:-1]
+            if key in self._masterIndex:
+                return self._masterIndex[key]
+            if key in self._masterPartial:
+                return self._masterPartial[key]
             for m in self.masters:
                 master = self.masters[m]
-                if master is not None and ((master['nickname'] == masterName) or (masterName in master['fqdn'])):
+                if master is not None and masterName in (master.get('fqdn', None) or ''):
                     return master
         return None
 
+    def masterNickname(self, master):
+        """ Return the nickname of the master a check reported, which
+            is either a nickname from the master status or the
+            (master host, port, slavename) of get_tacinfo(). The master
+            host is returned for masters slavealloc does not know.
+        """
+        if isinstance(master, (tuple, list)):
+            if len(master) == 0:
+                return None
+            master = master[0]
+        if not master:
+            return None
+        entry = self.findMaster(master)
+        if entry is not None:
+            return entry['nickname']
+        return master
+
+    def indexMasters(self):
+        """ Rebuild the findMaster() lookup tables from self.masters
+
+            Exact keys (nickname, FQDN and short hostname) go into
+            _masterIndex, every other run of dotted labels of the FQDN,
+            leading ('buildbot-master10.build'), trailing
+            ('build.scl1.mozilla.com') or in between, goes into
+            _masterPartial. A partial name shared by more than one master
+            is ambiguous and is dropped, findMaster() scans for those.
+        """
+        self._masterIndex   = {}
+        self._masterPartial = {}
+        ambiguous           = set()
+
+        for nickname in self.masters:
+            master = self.masters[nickname]
+            if master is None:
+                continue
+
+            self._masterIndex[nickname.lower()] = master
+
+            fqdn = master.get('fqdn', None)
+            if not fqdn:
+                continue
+            fqdn = fqdn.lower()
+            if fqdn.endswith('.'):
+                fqdn = fqdn[:-1]
+
+            labels = fqdn.split('.')
+            self._masterIndex.setdefault(fqdn, master)
+            self._masterIndex.setdefault(labels[0], master)
+
+            for start in range(len(labels)):
+                for end in range(start + 1, len(labels) + 1):
+                    if start == 0 and end in (1, len(labels)):
+                        # short hostname and FQDN are exact keys
+                        continue
+                    partial = '.'.join(labels[start:end])
+                    if partial in self._masterPartial and self._masterPartial[partial] is not master:
+                        ambiguous.add(partial)
+                    else:
+                        self._masterPartial[partial] = master
+
+        for partial in ambiguous:
+            del self._masterPartial[partial]
+
+    def collectMasterStatus(self, maxAge=900):
+        """ Query every slavealloc master once for the state of its
+            buildslaves so check() can skip the ssh inspection of slaves
+            the masters already vouch for.
+        """
+        self.masterStatus = MasterStatus(self.masters, maxAge=maxAge)
+        self.masterStatus.collect()
+        return self.masterStatus
+
+    def slaveStatus(self, hostname):
+        if self.masterStatus is None:
+            return None
+        return self.masterStatus.get(hostname)
+
+    def needsInspection(self, host, lastSeen):
+        """ Return True unless a master reports the slave as connected
+            and either running a job or idle for less than rebootHours
+        """
+        slave = self.slaveStatus(host.hostname)
+        if slave is None or not slave['connected'] or self.masterStatus.isStale(slave):
+            return True
+        if not slave['idle']:
+            return False
+        if lastSeen is None:
+            return True
+        hours = (lastSeen.days * 24) + (lastSeen.seconds / 3600)
+        return hours >= self.getRebootHours(host)
+
+    def loadRebootThresholds(self, filename):
+        """ Load the per pool and per platform reboot thresholds
+            written by releng.analytics
+        """
+        try:
+            self.rebootThresholds = json.load(open(filename, 'r'))
+            log.info('loaded reboot thresholds for %d pools and %d platforms from %s' %
+                     (len(self.rebootThresholds.get('pools', {})), len(self.rebootThresholds.get('platforms', {})), filename))
+            return True
+        except:
+            log.error('unable to load reboot thresholds from %s' % filename, exc_info=True)
+            self.rebootThresholds = {}
+            return False
+
+    def getRebootHours(self, host):
+        """ Return how many idle hours host is allowed before it is
+            rebooted: the threshold of its pool, else of its platform,
+            else self.rebootHours
+        """
+        return self._rebootHours(host.hostname)
+
+    def _rebootHours(self, hostname):
+        for section, key in (('pools', getPool(hostname)), ('platforms', getPlatform(hostname))):
+            entry = self.rebootThresholds.get(section, {}).get(key, None)
+            if entry is not None:
+                return entry['hours']
+        return self.rebootHours
+
+    def rebootHoursRange(self):
+        """ Return the lowest and highest reboot threshold in hours
+        """
+        hours = [self.rebootHours]
+        for section in ('pools', 'platforms'):
+            for entry in self.rebootThresholds.get(section, {}).values():
+                hours.append(entry['hours'])
+        return min(hours), max(hours)
+
+    def lastActivity(self, hostname):
+        """ Return the epoch seconds of the last build started or
+            finished by hostname according to self.lastSeen, or None
+        """
+        if self.lastSeen is None:
+            return None
+        try:
+            return self.lastSeen.get(hostname)
+        except:
+            log.error('unable to read last activity of %s' % hostname, exc_info=True)
+            return None
+
+    def recentActivity(self, hostname):
+        """ Return how long ago hostname last started or finished a
+            build if that is within its reboot threshold, else None.
+            Needs no network I/O beyond redis.
+        """
+        ts = self.lastActivity(hostname)
+        if ts is None:
+            return None
+        td = datetime.now() - datetime.fromtimestamp(ts)
+        if (td.days * 24) + (td.seconds / 3600) < self._rebootHours(hostname):
+            return td
+        return None
+
     def getHostInfo(self):
         self.hosts = {}
         # grab and process slavealloc list into a simple dictionary
@@ -781,6 +942,7 @@ class RemoteEnvironment():
             m = json.loads(j)
             for item in m:
                 self.masters[item['nickname']] = item
+        self.indexMasters()
 
         environments = {}
         j = fetchUrl('%s/environments' % urlSlaveAlloc)
@@ -817,60 +979,60 @@ class RemoteEnvironment():
                         self.hosts[hostname]['enabled'] = instance['moz-state'] == 'ready'
                         self.hosts[hostname]['ip']      = instance['ipPrivate']
 
-    def getHost(self, hostname, verbose=False):
+    def getHost(self, hostname, verbose=False, connect=True):
         if 'w32-ix' in hostname or 'mw32-ix' in hostname or \
            'moz2-win32' in hostname or 'try-w32-' in hostname or \
            'win32-' in hostname:
-            result = Win32BuildHost(hostname, self, verbose=verbose)
+            result = Win32BuildHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 'w64-ix' in hostname:
-            result = Win64BuildHost(hostname, self, verbose=verbose)
+            result = Win64BuildHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 'talos-r3-fed' in hostname:
-            result = LinuxTalosHost(hostname, self, verbose=verbose)
+            result = LinuxTalosHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 'talos-r3-snow' in hostname or 'talos-r4' in hostname or \
              'talos-r3-leopard' in hostname:
-            result = OSXTalosHost(hostname, self, verbose=verbose)
+            result = OSXTalosHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 'talos-mtnlion-r5-' in hostname:
-            result = OSXTalosHost(hostname, self, verbose=verbose)
+            result = OSXTalosHost(hostname, self, verbose=verbose, connect=connect)
             result.bbdir = '/builds/slave/talos-slave'
 
         elif 'talos-r3-xp' in hostname or 'w764' in hostname or \
              'talos-r3-w7' in hostname:
-            result = Win32TalosHost(hostname, self, verbose=verbose)
+            result = Win32TalosHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 't-xp32-ix-' in hostname:
-            result = WinXP32TalosHost(hostname, self, verbose=verbose)
+            result = WinXP32TalosHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 't-w864' in hostname:
-            result = Win864TalosHost(hostname, self, verbose=verbose)
+            result = Win864TalosHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 't-w732-ix' in hostname:
-            result = Win732TalosHost(hostname, self, verbose=verbose)
+            result = Win732TalosHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 'talos-linux32-ix' in hostname or 'talos-linux64-ix' in hostname:
-            result = LinuxIXTalosHost(hostname, self, verbose=verbose)
+            result = LinuxIXTalosHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 'moz2-linux' in hostname or 'linux-ix' in hostname or \
              'try-linux' in hostname or 'linux64-ix-' in hostname or \
              'bld-centos' in hostname:
-            result = LinuxBuildHost(hostname, self, verbose=verbose)
+            result = LinuxBuildHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 'try-mac' in hostname or 'xserve' in hostname or \
              'moz2-darwin' in hostname:
-            result = OSXBuildHost(hostname, self, verbose=verbose)
+            result = OSXBuildHost(hostname, self, verbose=verbose, connect=connect)
 
         elif  '-r5-' in hostname or \
               '-r4-' in hostname:
-            result = OSXPDUHost(hostname, self, verbose=verbose)
+            result = OSXPDUHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 'tegra' in hostname:
-            result = TegraHost(hostname, self, verbose=verbose)
+            result = TegraHost(hostname, self, verbose=verbose, connect=connect)
 
         elif 'ec2-' in hostname:
-            result = AWSHost(hostname, self, verbose=verbose)
+            result = AWSHost(hostname, self, verbose=verbose, connect=connect)
 
         else:
             log.error("Unknown host type for %s", hostname)
@@ -894,27 +1056,25 @@ class RemoteEnvironment():
 
         return result
 
+    @timed('rebootIfNeeded', 1)
     def rebootIfNeeded(self, host, lastSeen=None, indent='', dryrun=True, verbose=False):
         """ Reboot a host if needed. if lastSeen is None we will
-            not attempt to reboot the host. """
+            not attempt to reboot the host.
+
+            If self.shutdowns holds a ShutdownBatch, reachable hosts are
+            queued on it instead of being shut down and rebooted here and
+            the result is flagged 'pending'. Once buildbot has stopped the
+            reboot is done in the background, see flushShutdowns().
+            Likewise unreachable hosts with a PDU or IPMI are queued for
+            flushHardReboots() so outlets sharing a PDU go out in one
+            request and IPMI power cycles run concurrently.
+        """
 
         def graceful_shutdown_buildbot(host, indent, dryrun):
             failed = False
             if host.graceful_shutdown(indent=indent, dryrun=dryrun):
                 if not dryrun:
-                    log.info("%sWaiting for shutdown" % indent)
-                    count = 0
-
-                    while True:
-                        count += 1
-                        if count >= 30:
-                            failed = True
-                            log.info("%sTook too long to shut down; giving up" % indent)
-                            break
-
-                        data = host.tail_twistd_log(10)
-                        if not data or "Main loop terminated" in data or "ProcessExitedAlready" in data:
-                            break
+                    failed = waitForShutdown(host, indent)
             else:
                 # failed graceful shutdown of buildbot client process
                 failed = True
@@ -926,10 +1086,8 @@ class RemoteEnvironment():
         reachable   = False # is the host pingable
         ipmi        = False # does the host have an IPMI interface
         pdu         = False # does the host have a PDU interface
-        failed      = False # set to True if a reboot succeeds
         should_reboot = False
         output      = []
-        rebootHours = 6
 
         if host is None:
             self.debug('Host is None, returning')
@@ -940,6 +1098,7 @@ class RemoteEnvironment():
         ipmi = host.hasIPMI
         pdu  = host.hasPDU
         reachable = host.reachable
+        rebootHours = self.getRebootHours(host)
 
         if not reachable:
             output.append(msg('adding to recovery list because host is not reachable', indent, verbose))
@@ -956,51 +1115,265 @@ class RemoteEnvironment():
             recovery = should_reboot
             output.append(msg('last activity %0.2d hours' % hours, indent, verbose))
 
+        result = { 'reboot': reboot, 'recovery': recovery, 'output': output, 'ipmi': ipmi, 'pdu': pdu, 'dryrun': dryrun }
+
         # if we can ssh to host, then try and do normal shutdowns
         log.debug("recovery=%s, should_reboot=%s, reachable=%s" % (recovery, should_reboot, reachable))
         if recovery and should_reboot:
-            if reachable:
+            if not dryrun:
+                self.publish(events.reboot, host.hostname, outcome='attempt', reachable=reachable, pdu=pdu, ipmi=ipmi)
+            if reachable and self.shutdowns is not None:
+                if self.shutdowns.add(host, indent=indent, context=result):
+                    result['pending'] = True
+                    if not dryrun:
+                        self.setState(host.hostname, draining, 'graceful shutdown requested')
+                    output.append(msg('graceful shutdown queued', indent, verbose))
+                    if len(self.shutdowns.entries) >= self.shutdownFlush:
+                        self.flushShutdowns()
+                    return result
+                log.info("%sgraceful_shutdown failed" % indent)
+            elif reachable:
                 # attempt gracefull shutdown of buildbot client process
                 graceful_shutdown_buildbot(host, indent, dryrun)
-                if dryrun:
-                    log.debug("would have soft-rebooted but dryrun is True")
+            elif self.pduBatch is not None and (host.hasPDU or host.hasIPMI) and not dryrun:
+                target = None
+                if host.hasPDU:
+                    target = host.pdu_target()
+                    if target is not None:
+                        pdu, oid = target
+                        self.pduBatch.add(host.hostname, pdu, oid)
+                self.hardQueue.append((host, result, indent, target))
+                result['pending'] = True
+                output.append(msg('hard reboot queued', indent, verbose))
+                return result
+            self.reboot(host, result, indent=indent)
+
+        return result
+
+    @timed('reboot', 1)
+    def reboot(self, host, result, indent=''):
+        """ Soft reboot the host if it is reachable, falling back to
+            PDU and then IPMI. Updates the rebootIfNeeded() result.
+        """
+        dryrun    = result['dryrun']
+        reachable = host.reachable
+        failed    = False # set to True if a reboot fails
+
+        if reachable:
+            if dryrun:
+                log.debug("would have soft-rebooted but dryrun is True")
+            else:
+                failed = not host.reboot()
+                self.publish(events.reboot, host.hostname, method='ssh', outcome='failed' if failed else 'ok')
+                if failed:
+                    log.info("soft reboot failed")
                 else:
-                    failed = not host.reboot()
-                    if failed:
-                        log.info("soft reboot failed")
-                    else:
-                        log.info("soft reboot successful")
-            if not reachable or failed:
-                # not reachable; resort to stronger measures
-                if dryrun:
-                    log.debug("would have hard-rebooted but dryrun is True")
+                    log.info("soft reboot successful")
+                    self.track(host, 'ssh')
+        if not reachable or failed:
+            # not reachable; resort to stronger measures
+            if dryrun:
+                log.debug("would have hard-rebooted but dryrun is True")
+            else:
+                self.hardReboot(host, result, indent=indent)
+        return result
+
+    def hardReboot(self, host, result, indent='', pduResult=None, ipmiResult=None):
+        """ PDU then IPMI reboot. pduResult and ipmiResult are given
+            when the reboots were already sent by flushHardReboots(),
+            a None pduResult with no PDU outlet known means no PDU
+            reboot was attempted.
+        """
+        output = result['output']
+
+        if not (host.hasPDU or host.hasIPMI):
+            log.info("unreachable host does not have PDU or IPMI support")
+            self.setState(host.hostname, awaitingRecovery, 'no PDU or IPMI')
+        else:
+            if host.hasPDU:
+                if pduResult is None and host.pdu_target() is not None:
+                    pduResult = host.rebootPDU()
+                if pduResult is None:
+                    log.info("no PDU outlet known, PDU reboot not attempted")
                 else:
-                    if not (host.hasPDU or host.hasIPMI):
-                        log.info("unreachable host does not have PDU or IPMI support")
+                    result['pdu'] = pduResult
+                    self.publish(events.reboot, host.hostname, method='pdu', outcome='ok' if result['pdu'] == True else 'failed')
+                    if result['pdu'] == True:
+                        log.info("PDU reboot successful")
+                        result['reboot'] = True
+                        self.track(host, 'pdu')
                     else:
-                        if host.hasPDU:
-                            pdu = host.rebootPDU()
-                            if pdu == True:
-                                log.info("PDU reboot successful")
-                                failed = False
-                                reboot = True
-                            else:
-                                log.info("PDU reboot not successful")
-                                failed = True
-                                output.append(msg('should be restarting but not reachable PDU reboot failed', indent, True))
-                        if host.hasIPMI and not reboot:
-                            ipmi = host.rebootIPMI()
-                            if ipmi == True:
-                                log.info("IPMI reboot successful")
-                                failed = False
-                                reboot = True
-                            else:
-                                log.info("IPMI reboot not successful")
-                                failed = True
-                                output.append(msg('should be restarting but not reachable and IPMI reboot failed', indent, True))
-
-        return { 'reboot': reboot, 'recovery': recovery, 'output': output, 'ipmi': ipmi, 'pdu': pdu, 'dryrun': dryrun }
+                        log.info("PDU reboot not successful")
+                        output.append(msg('should be restarting but not reachable PDU reboot failed', indent, True))
+            if host.hasIPMI and not result['reboot']:
+                if ipmiResult is None:
+                    result['ipmi'] = host.rebootIPMI()
+                else:
+                    result['ipmi'] = ipmiResult
+                self.publish(events.reboot, host.hostname, method='ipmi', outcome='ok' if result['ipmi'] == True else 'failed')
+                if result['ipmi'] == True:
+                    log.info("IPMI reboot successful")
+                    result['reboot'] = True
+                    self.track(host, 'ipmi')
+                else:
+                    log.info("IPMI reboot not successful")
+                    output.append(msg('should be restarting but not reachable and IPMI reboot failed', indent, True))
+            if not result['reboot']:
+                self.setState(host.hostname, awaitingRecovery, 'hard reboot failed')
+        return result
+
+    @timed('reboot', 1)
+    def escalateReboot(self, host, method):
+        """ Hard reboot a tracked host again with method, pdu or ipmi,
+            publishing the same events and moving it through the same
+            states as a reboot done by rebootIfNeeded().
+            Returns True if the reboot was sent.
+        """
+        self.publish(events.reboot, host.hostname, outcome='attempt', reachable=False, pdu=host.hasPDU, ipmi=host.hasIPMI)
+        if method == 'pdu':
+            result = host.rebootPDU()
+        else:
+            result = host.rebootIPMI()
+        self.publish(events.reboot, host.hostname, method=method, outcome='ok' if result == True else 'failed')
+        if result == True:
+            self.track(host, method)
+        return result == True
+
+    def startTracking(self, wait):
+        """ Verify in the background that hosts come back after reboot(),
+            with deadlines short enough for a host to go through every
+            escalation step within wait seconds. Hosts the last run was
+            still tracking are picked up again.
+        """
+        deadline, settle, interval = trackingTimes(wait)
+        self.tracker = RebootTracker(self, deadline=deadline, settle=settle, interval=interval, db=self.db)
+        self.tracker.resume()
+
+    def track(self, host, method):
+        if method == 'ssh':
+            self.setState(host.hostname, rebootingSoft, 'ssh reboot')
+        else:
+            self.setState(host.hostname, rebootingHard, '%s reboot' % method)
+        if self.tracker is not None:
+            self.tracker.track(host, method)
+
+    def setState(self, hostname, state, reason=''):
+        if self.states is not None:
+            self.states.set(hostname, state, reason)
+
+    def publish(self, topic, hostname, **fields):
+        if self.events is not None:
+            self.events.publish(topic, hostname, **fields)
+
+    def finishTracking(self, timeout=None):
+        """ Wait up to timeout seconds for the rebooted hosts to recover,
+            returns the hostnames that are still pending
+        """
+        if self.tracker is None:
+            return []
+        return self.tracker.join(timeout)
 
+    def startReboots(self, dryrun=False, perMaster=4, flushSize=20):
+        """ Queue graceful shutdowns from rebootIfNeeded() so they can be
+            issued per master in batches of flushSize hosts
+        """
+        self.shutdowns     = ShutdownBatch(self, dryrun=dryrun, perMaster=perMaster)
+        self.shutdownFlush = flushSize
+        self.waiter        = ShutdownWaiter()
+        self.pduBatch      = PDUBatch()
+        self.hardQueue     = []
+        self.rebooted      = []
+
+    def flushShutdowns(self):
+        """ Request the queued graceful shutdowns and park the hosts in
+            the waiter, which reboots each one as soon as buildbot has
+            stopped (or took too long) while the run carries on.
+        """
+        batch          = self.shutdowns
+        self.shutdowns = ShutdownBatch(self, dryrun=batch.dryrun, perMaster=batch.perMaster)
+
+        shutdowns = batch.run()
+        for entry in batch.entries:
+            host   = entry['host']
+            result = entry['context']
+            indent = entry['indent']
+
+            if shutdowns.get(host.hostname, False):
+                if not result['dryrun']:
+                    def shutdownDone(host, timedOut, result=result, indent=indent):
+                        self._completeReboot(host, result, indent)
+                    self.waiter.park(host, shutdownDone, indent=indent)
+                    continue
+            else:
+                log.info("%sgraceful_shutdown failed" % indent)
+
+            self._completeReboot(host, result, indent)
+
+    def getIPMI(self):
+        if self.ipmi is None:
+            self.ipmi = IPMIEngine(self.ipmiUser, self.ipmiPassword)
+        return self.ipmi
+
+    def flushHardReboots(self):
+        """ Send the queued PDU reboots, one request per PDU, then power
+            cycle the hosts whose outlet failed or that only have IPMI,
+            all BMCs concurrently.
+        """
+        queue          = self.hardQueue
+        self.hardQueue = []
+        pduResults     = self.pduBatch.run()
+        ipmiHosts      = []
+
+        for host, result, indent, target in queue:
+            if target is not None:
+                pdu, oid = target
+                host.logRebootAttempt('PDU', pduResults.get(host.hostname, False), 'snmpset %s %s i %d' % (pdu, oid, outletReboot))
+            if host.hasIPMI and not pduResults.get(host.hostname, False):
+                ipmiHosts.append(host)
+
+        ipmiResults = {}
+        if len(ipmiHosts) > 0:
+            ipmiResults = self.getIPMI().rebootHosts(ipmiHosts)
+
+        for host, result, indent, target in queue:
+            pduResult = None
+            if target is not None:
+                pduResult = pduResults.get(host.hostname, False)
+            self.hardReboot(host, result, indent=indent,
+                            pduResult=pduResult,
+                            ipmiResult=ipmiResults.get(host.hostname, False))
+            result['pending'] = False
+            self.rebooted.append((host.hostname, result))
+
+    def _completeReboot(self, host, result, indent):
+        self.reboot(host, result, indent=indent)
+        result['pending'] = False
+        self.rebooted.append((host.hostname, result))
+
+    def finishReboots(self):
+        """ Flush the remaining graceful shutdowns and wait for every
+            parked host to be rebooted.
+
+            Returns a list of (hostname, result) for the queued hosts,
+            result being the dictionary rebootIfNeeded() returned.
+        """
+        if self.shutdowns is None:
+            return []
+
+        self.flushShutdowns()
+        self.flushHardReboots()
+        self.shutdowns = None
+        self.pduBatch  = None
+        self.waiter.join()
+
+        if self.ipmi is not None:
+            self.ipmi.report()
+
+        results       = self.rebooted
+        self.rebooted = []
+        return results
+
+    @timed('check', 1)
     def check(self, host, indent='', dryrun=True, verbose=False, reboot=False):
         status = { 'buildbot':  '',
                    'tacfile':   '',
@@ -1011,23 +1384,54 @@ class RemoteEnvironment():
                    'output':    [],
                  }
 
-        try:
-            # default lastseen to buildapi's latest completed build time
-            # it may be overridden by the date/time retrieved from twistd.log 
-            status['lastseen'] = last_build_endtime(host.hostname)
-            if status['lastseen'] != None:
-                status['lastseen'] = datetime.now() - \
-                    datetime.fromtimestamp(status['lastseen']).replace(
-                    tzinfo=timezone('UTC')).astimezone( \
-                    timezone('US/Pacific')).replace(tzinfo=None)
-                log.debug('defaulting lastseen to %s' % status['lastseen'])
-        except requests.exceptions.HTTPError:
-            pass
+        activity = self.lastActivity(host.hostname)
+        if activity is not None:
+            # build events are pushed as they happen, no need to ask buildapi
+            status['lastseen'] = datetime.now() - datetime.fromtimestamp(activity)
+            log.debug('lastseen from build events %s' % status['lastseen'])
+        else:
+            try:
+                # default lastseen to buildapi's latest completed build time
+                # it may be overridden by the date/time retrieved from twistd.log 
+                status['lastseen'] = last_build_endtime(host.hostname)
+                if status['lastseen'] != None:
+                    status['lastseen'] = datetime.now() - \
+                        datetime.fromtimestamp(status['lastseen']).replace(
+                        tzinfo=timezone('UTC')).astimezone( \
+                        timezone('US/Pacific')).replace(tzinfo=None)
+                    log.debug('defaulting lastseen to %s' % status['lastseen'])
+            except requests.exceptions.HTTPError:
+                pass
 
         if host and host.fqdn:
             status['fqdn'] = host.fqdn
 
-        if host is not None and host.reachable:
+        if host is not None and not host.probed:
+            if self.needsInspection(host, status['lastseen']):
+                host.connect()
+
+        slave = None
+        if host is not None and not host.probed:
+            slave = self.slaveStatus(host.hostname)
+
+        if slave is not None:
+            # the master has a live connection from the slave, trust it
+            # instead of logging in and reading twistd.log
+            host.reachable      = True
+            status['reachable'] = True
+            status['tacfile']   = 'found'
+            status['master']    = slave['master']
+            status['buildbot']  = '; connected to %s' % slave['master']
+            if slave['idle']:
+                status['buildbot'] += '; no running builds'
+            else:
+                status['lastseen']  = timedelta(0)
+                status['buildbot'] += '; active'
+                if slave['lastjob'] is not None:
+                    status['buildbot'] += '; job %s' % relative(datetime.now() - datetime.fromtimestamp(slave['lastjob']))
+            if verbose:
+                log.info('%susing slave status reported by %s' % (indent, slave['master']))
+        elif host is not None and host.reachable:
             status['reachable'] = host.reachable
 
             host.wait()
@@ -1058,31 +1462,32 @@ class RemoteEnvironment():
 
             data = host.tail_twistd_log(200)
             if len(data) > 0:
-                lines = data.split('\n')
-                logTD = None
-                jobFound = None
-                idleNote = None
-                for line in reversed(lines):
-                    if '[Broker,client]' in line:
-                        if logTD is None:
-                            logTD = getLogTimeDelta(line)
-                        if not idleNote and (('commandComplete' in line) or ('startCommand' in line)):
-                            jobFound = getLogTimeDelta(line)
-                            break
-                        if "rebooting NOW, since the master won't talk to us" in line:
-                            idleNote = getLogTimeDelta(line)
-                            break
-
-                if logTD is None:
-                    logTD = jobFound
-                if logTD is not None:
-                    status['lastseen'] = logTD
-                    if (logTD.days == 0) and (logTD.seconds <= 3600):
-                        status['buildbot'] += '; active'
-                    if idleNote is not None:
-                        status['buildbot'] += '; idle rebooted %s' % relative(idleNote)
-                    if jobFound is not None:
-                        status['buildbot'] += '; job %s' % relative(jobFound)
+                with phase('logparse', host):
+                    lines = data.split('\n')
+                    logTD = None
+                    jobFound = None
+                    idleNote = None
+                    for line in reversed(lines):
+                        if '[Broker,client]' in line:
+                            if logTD is None:
+                                logTD = getLogTimeDelta(line)
+                            if not idleNote and (('commandComplete' in line) or ('startCommand' in line)):
+                                jobFound = getLogTimeDelta(line)
+                                break
+                            if "rebooting NOW, since the master won't talk to us" in line:
+                                idleNote = getLogTimeDelta(line)
+                                break
+
+                    if logTD is None:
+                        logTD = jobFound
+                    if logTD is not None:
+                        status['lastseen'] = logTD
+                        if (logTD.days == 0) and (logTD.seconds <= 3600):
+                            status['buildbot'] += '; active'
+                        if idleNote is not None:
+                            status['buildbot'] += '; idle rebooted %s' % relative(idleNote)
+                        if jobFound is not None:
+                            status['buildbot'] += '; job %s' % relative(jobFound)
 
             data = host.tail_twistd_log(10)
             if "Stopping factory" in data:
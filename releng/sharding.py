@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.sharding
+
+    Split the fleet between herder instances with a consistent hash ring
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import time
+import bisect
+import hashlib
+import threading
+
+from multiprocessing import get_logger
+
+from .workqueue import workerID
+
+
+log = get_logger()
+
+
+def _hash(key):
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+def parseShard(spec):
+    """ Return (index, count) for 'i/N' and (None, None) for 'auto'
+    """
+    if spec == 'auto':
+        return None, None
+    try:
+        index, count = [int(n) for n in spec.split('/')]
+    except:
+        raise ValueError('shard must be i/N or auto, not %s' % spec)
+    if count < 1 or index < 0 or index >= count:
+        raise ValueError('shard index must be between 0 and %d' % (count - 1))
+    return index, count
+
+class HashRing(object):
+    """ Every member gets replicas points on the ring, a key belongs
+        to the member owning the first point at or after its hash.
+        Adding or removing a member only moves the keys of its points.
+    """
+    def __init__(self, members, replicas=100):
+        points = []
+        for member in members:
+            for n in range(replicas):
+                points.append((_hash('%s-%d' % (member, n)), member))
+        points.sort()
+        self.members = list(members)
+        self.points  = [point for point, member in points]
+        self.owners  = [member for point, member in points]
+
+    def owner(self, key):
+        if len(self.points) == 0:
+            return None
+        n = bisect.bisect(self.points, _hash(key)) % len(self.points)
+        return self.owners[n]
+
+class ShardMember(object):
+    """ One herder instance's membership in a shard group.
+
+        With a fixed shard (index i of count) the member id is i and its
+        lease key makes sure only one instance runs as shard i, which is
+        what the lockfile in run_kittenherder.sh used to do. In auto mode
+        the member id is host:pid.
+
+        While joined a heartbeat thread renews the lease every ttl/3
+        seconds and keeps the member's score in the
+        kittenherder:shards:<group> sorted set current. The ring is built
+        from the members seen within the last ttl seconds, so the slice
+        of an instance that died is spread over the live ones once its
+        heartbeat is missed. Fixed shards count all of 0..count-1 as
+        live for the first ttl seconds while the others start up.
+
+        A member that finished its slice leaves cleanly through leave(),
+        which moves it to kittenherder:shards:<group>:left. Members that
+        left after this one joined stay in its ring, their kittens were
+        already handled in this sweep and must not be taken over.
+    """
+    def __init__(self, db, group, index=None, count=None, ttl=60, refresh=30):
+        self.db       = db
+        self.group    = group
+        self.count    = count
+        self.ttl      = ttl
+        self.interval = refresh
+        self.worker   = workerID()
+        if index is None:
+            self.member = self.worker
+        else:
+            self.member = '%d' % index
+        self.members  = 'kittenherder:shards:%s' % group
+        self.left     = 'kittenherder:shards:%s:left' % group
+        self.lease    = 'kittenherder:shard:%s:%s' % (group, self.member)
+        self.ring     = None
+        self.lastRing = 0
+        self.joined   = 0
+        self.lost     = False
+        self.running  = False
+        self.thread   = None
+        self.event    = threading.Event()
+
+    def join(self):
+        """ Take the lease for this member, returns False if another
+            live instance holds it
+        """
+        if not self.db.setnx(self.lease, self.worker):
+            holder = self.db.get(self.lease)
+            if holder is not None and holder != self.worker:
+                log.error('shard %s of %s is held by %s' % (self.member, self.group, holder))
+                return False
+            # the holder went away between setnx() and get()
+            self.db.set(self.lease, self.worker)
+        self.db.expire(self.lease, self.ttl)
+        self.db.zrem(self.left, self.member)
+        self._heartbeat()
+        self.joined = time.time()
+
+        self.running = True
+        self.thread  = threading.Thread(target=self._run, name='ShardHeartbeat')
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.refresh()
+        log.info('joined shard group %s as %s with %d members' % (self.group, self.member, len(self.ring.members)))
+        return True
+
+    def leave(self):
+        self.running = False
+        self.event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.db.get(self.lease) == self.worker:
+            self.db.delete(self.lease)
+        self.db.zadd(self.left, time.time(), self.member)
+        self.db.zrem(self.members, self.member)
+
+    def _heartbeat(self):
+        self.db.zadd(self.members, time.time(), self.member)
+
+    def _run(self):
+        while self.running:
+            self.event.wait(self.ttl / 3.0)
+            if not self.running:
+                break
+            try:
+                if self.db.get(self.lease) != self.worker:
+                    log.error('lost the lease for shard %s of %s' % (self.member, self.group))
+                    self.lost    = True
+                    self.running = False
+                    break
+                self.db.expire(self.lease, self.ttl)
+                self._heartbeat()
+            except:
+                log.error('unable to renew the shard lease', exc_info=True)
+
+    def live(self):
+        now = time.time()
+        self.db.zremrangebyscore(self.members, '-inf', now - (self.ttl * 10))
+        members = set(self.db.zrangebyscore(self.members, now - self.ttl, '+inf'))
+        self.db.zremrangebyscore(self.left, '-inf', now - 86400)
+        members.update(self.db.zrangebyscore(self.left, self.joined - self.ttl, '+inf'))
+        if self.count is not None:
+            shards = set(['%d' % n for n in range(self.count)])
+            if now - self.joined < self.ttl:
+                # the other shards may still be starting up
+                members = shards
+            else:
+                members = members & shards
+        members.add(self.member)
+        return sorted(members)
+
+    def refresh(self):
+        members = self.live()
+        if self.ring is None or members != self.ring.members:
+            if self.ring is not None:
+                log.info('shard group %s now has %d members' % (self.group, len(members)))
+            self.ring = HashRing(members)
+        self.lastRing = time.time()
+
+    def owns(self, hostname):
+        if self.lost:
+            return False
+        if time.time() - self.lastRing >= self.interval:
+            self.refresh()
+        return self.ring.owner(hostname) == self.member
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.snmp
+
+    Minimal SNMP v1 SetRequest client used to power cycle PDU outlets
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import random
+import socket
+
+from multiprocessing import get_logger
+from multiprocessing.pool import ThreadPool
+
+
+log = get_logger()
+
+# ServerTech Sentry outlet control, see TegraHost.rebootPDU()
+sentryOutletControl = '1.3.6.1.4.1.1718.3.2.3.1.11.1'
+outletReboot        = 3
+
+_INTEGER      = 0x02
+_OCTET_STRING = 0x04
+_OID          = 0x06
+_SEQUENCE     = 0x30
+_GET_RESPONSE = 0xa2
+_SET_REQUEST  = 0xa3
+
+_errors = { 1: 'tooBig', 2: 'noSuchName', 3: 'badValue', 4: 'readOnly', 5: 'genErr' }
+
+
+class SNMPError(Exception):
+    pass
+
+def outletOID(deviceID):
+    """ Return the outlet control OID for a PDU device id such as
+        'AB14' or '.AB14' (enclosure, infeed, outlet number)
+    """
+    if deviceID.startswith('.'):
+        deviceID = deviceID[1:]
+    if deviceID[1] == 'B':
+        b = 2
+    else:
+        b = 1
+    c = int(deviceID[2:])
+    return '%s.%d.%d' % (sentryOutletControl, b, c)
+
+def _length(n):
+    if n < 0x80:
+        return chr(n)
+    s = ''
+    while n > 0:
+        s = chr(n & 0xff) + s
+        n >>= 8
+    return chr(0x80 | len(s)) + s
+
+def _tlv(tag, value):
+    return chr(tag) + _length(len(value)) + value
+
+def encodeInteger(n, tag=_INTEGER):
+    s = ''
+    while True:
+        s = chr(n & 0xff) + s
+        n >>= 8
+        if (n == 0 and not ord(s[0]) & 0x80) or (n == -1 and ord(s[0]) & 0x80):
+            break
+    return _tlv(tag, s)
+
+def encodeOID(oid):
+    parts = [int(p) for p in oid.strip('.').split('.')]
+    s     = chr(parts[0] * 40 + parts[1])
+    for n in parts[2:]:
+        b = chr(n & 0x7f)
+        n >>= 7
+        while n > 0:
+            b = chr(0x80 | (n & 0x7f)) + b
+            n >>= 7
+        s += b
+    return _tlv(_OID, s)
+
+def encodeSetRequest(community, requestID, varbinds):
+    """ varbinds is a list of (oid, integer value) pairs
+    """
+    vbs = ''
+    for oid, value in varbinds:
+        vbs += _tlv(_SEQUENCE, encodeOID(oid) + encodeInteger(value))
+
+    pdu = encodeInteger(requestID) + encodeInteger(0) + encodeInteger(0) + _tlv(_SEQUENCE, vbs)
+
+    return _tlv(_SEQUENCE, encodeInteger(0) + _tlv(_OCTET_STRING, community) + _tlv(_SET_REQUEST, pdu))
+
+def _decode(data, offset=0):
+    """ Return (tag, value, next offset) for the TLV at offset
+    """
+    tag    = ord(data[offset])
+    n      = ord(data[offset + 1])
+    offset += 2
+    if n & 0x80:
+        count = n & 0x7f
+        n     = 0
+        for c in data[offset:offset + count]:
+            n = (n << 8) | ord(c)
+        offset += count
+    return tag, data[offset:offset + n], offset + n
+
+def _decodeInteger(value):
+    n = 0
+    for c in value:
+        n = (n << 8) | ord(c)
+    if len(value) > 0 and ord(value[0]) & 0x80:
+        n -= 1 << (8 * len(value))
+    return n
+
+def decodeResponse(data):
+    """ Return (requestID, errorStatus, errorIndex) from a GetResponse
+    """
+    tag, message, _ = _decode(data)
+    if tag != _SEQUENCE:
+        raise SNMPError('response is not an SNMP message')
+    tag, version, offset   = _decode(message)
+    tag, community, offset = _decode(message, offset)
+    tag, pdu, offset       = _decode(message, offset)
+    if tag != _GET_RESPONSE:
+        raise SNMPError('unexpected PDU type 0x%02x' % tag)
+    tag, requestID, offset   = _decode(pdu)
+    tag, errorStatus, offset = _decode(pdu, offset)
+    tag, errorIndex, offset  = _decode(pdu, offset)
+    return _decodeInteger(requestID), _decodeInteger(errorStatus), _decodeInteger(errorIndex)
+
+def snmpSetStatus(agent, varbinds, community='private', port=161, timeout=5, retries=2):
+    """ Send one SetRequest holding all varbinds to agent, retrying on
+        timeout. Returns the error status the agent answered with, 0
+        for success, or None if it never answered.
+    """
+    requestID = random.randint(1, 0x7fffffff)
+    request   = encodeSetRequest(community, requestID, varbinds)
+    sock      = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+
+    try:
+        address = (socket.gethostbyname(agent), port)
+        for attempt in range(retries + 1):
+            sock.sendto(request, address)
+            try:
+                while True:
+                    data, _ = sock.recvfrom(65535)
+                    responseID, errorStatus, errorIndex = decodeResponse(data)
+                    if responseID == requestID:
+                        break
+            except socket.timeout:
+                log.debug('snmp set to %s timed out (attempt %d)' % (agent, attempt + 1))
+                continue
+
+            if errorStatus != 0:
+                log.error('snmp set to %s failed: %s at varbind %d' % (agent, _errors.get(errorStatus, errorStatus), errorIndex))
+            return errorStatus
+    except:
+        log.error('error during snmp set to %s' % agent, exc_info=True)
+        return None
+    finally:
+        sock.close()
+
+    log.error('no response from %s after %d attempts' % (agent, retries + 1))
+    return None
+
+def snmpSet(agent, varbinds, community='private', port=161, timeout=5, retries=2):
+    """ Returns True if agent answered the SetRequest without error
+    """
+    return snmpSetStatus(agent, varbinds, community=community, port=port, timeout=timeout, retries=retries) == 0
+
+class PDUBatch(object):
+    """ Collect outlet reboots and send them as one SetRequest per PDU,
+        with the PDUs handled concurrently.
+
+        run() returns a key -> bool map for the keys given to add().
+
+        Only a PDU that rejects the request is retried outlet by outlet.
+        One that does not answer may still have applied the set and lost
+        the reply, so its outlets are not cycled a second time.
+    """
+    def __init__(self, community='private', port=161, timeout=5, retries=2, workers=8):
+        self.community = community
+        self.port      = port
+        self.timeout   = timeout
+        self.retries   = retries
+        self.workers   = workers
+        self.pdus      = {}
+
+    def add(self, key, pdu, oid, value=outletReboot):
+        self.pdus.setdefault(pdu, []).append((key, oid, value))
+
+    def _set(self, pdu):
+        items  = self.pdus[pdu]
+        log.info('snmpset %s %s' % (pdu, ' '.join(['%s i %d' % (oid, value) for key, oid, value in items])))
+        status = snmpSetStatus(pdu, [(oid, value) for key, oid, value in items], community=self.community,
+                               port=self.port, timeout=self.timeout, retries=self.retries)
+        if status is None or status == 0 or len(items) == 1:
+            return [(key, status == 0) for key, oid, value in items]
+
+        # a set is atomic, so one bad outlet fails them all - retry one by one
+        return [(key, snmpSet(pdu, [(oid, value)], community=self.community,
+                              port=self.port, timeout=self.timeout, retries=self.retries))
+                for key, oid, value in items]
+
+    def run(self):
+        results = {}
+        if len(self.pdus) == 0:
+            return results
+
+        pool = ThreadPool(min(self.workers, len(self.pdus)))
+        try:
+            for items in pool.map(self._set, self.pdus.keys()):
+                for key, result in items:
+                    results[key] = result
+        finally:
+            pool.close()
+            pool.join()
+
+        self.pdus = {}
+        return results
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.timing
+
+    Per phase timers and histograms for a kittenherder run
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+
+    Usage
+        with timing.phase('dns', hostname):
+            ...
+
+        @timing.timed('check', 1)
+        def check(self, host, ...):
+"""
+
+import time
+import threading
+
+from functools import wraps
+from multiprocessing import get_logger
+
+from . import events
+
+
+log        = get_logger()
+_keyExpire = 1209600 # 14 days in seconds
+
+# upper bounds of the histogram bins, in seconds
+bounds = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# the Timings of this run, None while timing is disabled
+current = None
+
+# a releng.tracing.Tracer that also gets every phase as a span
+tracer = None
+
+# a releng.profiling.Profiler run around the phases it lists
+profiler = None
+
+# a releng.events.EventPublisher every phase is published on as a
+# timing event
+publisher = None
+
+
+def hostClass(host):
+    """ Return the class timings of host are grouped by: the Host
+        subclass (WinHost, OSXTalosHost, AWSHost...) when a Host is
+        given, tegra, ec2 or moz like Host.farm for a bare hostname,
+        or run for phases of the whole run.
+    """
+    if hasattr(host, 'hostname'):
+        return type(host).__name__
+    hostname = host
+    if hostname is None:
+        return 'run'
+    if hostname.startswith('tegra'):
+        return 'tegra'
+    if 'ec2' in hostname:
+        return 'ec2'
+    return 'moz'
+
+def binLabel(n):
+    if n < len(bounds):
+        return '%s' % bounds[n]
+    return 'inf'
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_null = _NullTimer()
+
+class _Timer(object):
+    def __init__(self, name, host, detail=None):
+        self.name   = name
+        self.host   = host
+        self.detail = detail
+
+    def __enter__(self):
+        self.profiler = profiler
+        if self.profiler is not None and self.name in self.profiler.phases:
+            self.profiler.enter()
+        else:
+            self.profiler = None
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        _record(self.name, self.host, self.start, time.time(), self.detail)
+        if self.profiler is not None:
+            self.profiler.exit()
+        return False
+
+def _record(name, host, start, end, detail=None):
+    timings = current
+    if timings is not None:
+        timings.record(name, hostClass(host), end - start)
+    spans = tracer
+    if spans is not None:
+        spans.span(name, host, start, end, detail)
+    pub = publisher
+    if pub is not None:
+        pub.publish(events.timing, getattr(host, 'hostname', host),
+                    phase=name, hostclass=hostClass(host), seconds=end - start)
+
+def _disabled():
+    return current is None and tracer is None and profiler is None and publisher is None
+
+def phase(name, host=None, detail=None):
+    """ Return a context manager timing the block as phase name of the
+        class of host, a no-op while timing, tracing, profiling and
+        publishing are all disabled
+    """
+    if _disabled():
+        return _null
+    return _Timer(name, host, detail)
+
+def timed(name, hostArg=0, detailArg=None):
+    """ Decorator timing every call of a function as phase name, the
+        host (or hostname) being positional argument hostArg. The
+        positional argument detailArg, if given, is added to the span
+        when tracing.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _disabled():
+                return func(*args, **kwargs)
+            host   = None
+            detail = None
+            if len(args) > hostArg:
+                host = args[hostArg]
+            if detailArg is not None and len(args) > detailArg:
+                detail = args[detailArg]
+            with _Timer(name, host, detail):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, host=None, n=1):
+    if current is not None:
+        current.count(name, hostClass(host), n)
+
+def enable():
+    global current
+    current = Timings()
+    return current
+
+def disable():
+    global current
+    timings = current
+    current = None
+    return timings
+
+class Timings(object):
+    """ Count, total, max and a histogram of the durations of every
+        (phase, host class), plus plain counters. Worker, waiter and
+        tracker threads all record here so updates take a lock.
+    """
+    def __init__(self):
+        self.phases   = {}
+        self.counters = {}
+        self.lock     = threading.Lock()
+
+    def record(self, name, cls, seconds):
+        n = 0
+        while n < len(bounds) and seconds > bounds[n]:
+            n += 1
+        self.lock.acquire()
+        try:
+            entry = self.phases.get((name, cls), None)
+            if entry is None:
+                entry = { 'count': 0, 'total': 0.0, 'max': 0.0, 'bins': [0] * (len(bounds) + 1) }
+                self.phases[(name, cls)] = entry
+            entry['count']   += 1
+            entry['total']   += seconds
+            entry['bins'][n] += 1
+            if seconds > entry['max']:
+                entry['max'] = seconds
+        finally:
+            self.lock.release()
+
+    def count(self, name, cls, n=1):
+        self.lock.acquire()
+        try:
+            self.counters[(name, cls)] = self.counters.get((name, cls), 0) + n
+        finally:
+            self.lock.release()
+
+    def percentile(self, entry, p):
+        """ Return the upper bound of the bin holding percentile p
+        """
+        seen = 0
+        for n, items in enumerate(entry['bins']):
+            seen += items
+            if seen * 100.0 >= entry['count'] * p:
+                if n < len(bounds):
+                    return min(bounds[n], entry['max'])
+                return entry['max']
+        return entry['max']
+
+    def save(self, db, run):
+        """ Write the histograms of this run to the
+            kittenherder:timing:<run> hash, one field per
+            <phase>:<class>:<count|ms|max|le:<bound>>
+        """
+        key  = 'kittenherder:timing:%s' % run
+        pipe = db.pipeline()
+        for (name, cls), entry in self.phases.items():
+            prefix = '%s:%s' % (name, cls)
+            pipe.hincrby(key, '%s:count' % prefix, entry['count'])
+            pipe.hincrby(key, '%s:ms' % prefix, int(entry['total'] * 1000))
+            pipe.hset(key, '%s:max' % prefix, '%0.3f' % entry['max'])
+            for n, items in enumerate(entry['bins']):
+                if items > 0:
+                    pipe.hincrby(key, '%s:le:%s' % (prefix, binLabel(n)), items)
+        for (name, cls), n in self.counters.items():
+            pipe.hincrby(key, '%s:%s:count' % (name, cls), n)
+        pipe.expire(key, _keyExpire)
+        try:
+            pipe.execute()
+        except:
+            log.error('unable to store timings in %s' % key, exc_info=True)
+
+    def report(self):
+        """ Return the summary lines, slowest phases (by total) first
+        """
+        lines = ['%-20s %-16s %7s %9s %8s %8s %8s %8s' % ('phase', 'class', 'count', 'total', 'mean', 'p50', 'p90', 'max')]
+        for (name, cls), entry in sorted(self.phases.items(), key=lambda item: item[1]['total'], reverse=True):
+            lines.append('%-20s %-16s %7d %8.1fs %7.2fs %7.2fs %7.2fs %7.2fs' %
+                         (name, cls, entry['count'], entry['total'], entry['total'] / entry['count'],
+                          self.percentile(entry, 50), self.percentile(entry, 90), entry['max']))
+        for (name, cls), n in sorted(self.counters.items()):
+            lines.append('%-20s %-16s %7d' % (name, cls, n))
+        return lines
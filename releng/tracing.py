@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.tracing
+
+    Trace event timeline of a kittenherder run
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+
+    The file written is in the Trace Event Format and can be loaded in
+    chrome://tracing or any viewer reading it.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+
+from multiprocessing import get_logger
+
+from . import timing
+
+
+log = get_logger()
+
+
+def spanCategory(host):
+    """ Return the category of a span, the class its timing is
+        grouped by (the Host subclass when a Host is known)
+    """
+    return timing.hostClass(host)
+
+class Tracer(object):
+    """ Every phase timed through releng.timing becomes one complete
+        ('X') event on the track of the thread that ran it, named after
+        the phase with the host class as category and the hostname (and
+        the remote command etc.) as args.
+
+        Spans are kept in memory and written once by save(), which
+        enable() registers to run at exit.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.pid      = os.getpid()
+        self.start    = time.time()
+        self.events   = []
+        self.threads  = {}
+        self.saved    = False
+        self.lock     = threading.Lock()
+
+    def span(self, name, host, start, end, detail=None):
+        thread   = threading.current_thread()
+        hostname = getattr(host, 'hostname', host)
+        args     = {}
+        if hostname is not None:
+            args['host'] = hostname
+        if detail is not None:
+            args['detail'] = '%s' % detail
+        event = { 'name': name,
+                  'cat':  spanCategory(host),
+                  'ph':   'X',
+                  'ts':   int((start - self.start) * 1000000),
+                  'dur':  int((end - start) * 1000000),
+                  'pid':  self.pid,
+                  'tid':  thread.ident,
+                  'args': args,
+                }
+        self.lock.acquire()
+        try:
+            self.events.append(event)
+            if thread.ident not in self.threads:
+                self.threads[thread.ident] = thread.name
+        finally:
+            self.lock.release()
+
+    def save(self):
+        if self.saved:
+            return
+        self.saved = True
+
+        self.lock.acquire()
+        try:
+            events = [{ 'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+                        'args': { 'name': 'kittenherder %d' % self.pid } }]
+            for tid, name in self.threads.items():
+                events.append({ 'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                                'args': { 'name': name } })
+            events += self.events
+        finally:
+            self.lock.release()
+
+        try:
+            h = open(self.filename, 'w')
+            json.dump({ 'traceEvents': events, 'displayTimeUnit': 'ms' }, h)
+            h.close()
+            log.info('wrote %d trace events to %s' % (len(events), self.filename))
+        except:
+            log.error('unable to write trace to %s' % self.filename, exc_info=True)
+
+def enable(filename):
+    """ Trace every timed phase until the process exits
+    """
+    tracer = Tracer(filename)
+    timing.tracer = tracer
+    atexit.register(tracer.save)
+    return tracer
+
+def disable():
+    """ Stop tracing and write the trace file
+    """
+    tracer = timing.tracer
+    timing.tracer = None
+    if tracer is not None:
+        tracer.save()
+    return tracer
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.tracker
+
+    Verify that rebooted hosts come back and escalate when they don't
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import time
+import json
+import socket
+import threading
+
+from multiprocessing import get_logger
+from multiprocessing.pool import ThreadPool
+
+from . import fetchUrl
+from .masters import masterURL
+from .hoststate import healthy, awaitingRecovery
+
+
+log        = get_logger()
+_keyExpire = 1209600 # 14 days in seconds
+
+# reboot methods in the order they are escalated through
+escalation = ('ssh', 'pdu', 'ipmi')
+
+# hostname -> json of the hosts a run stopped tracking before they
+# recovered or failed, for the next run to pick up
+pendingKey     = 'kittenherder:tracking'
+_pendingExpire = 86400
+
+
+def probePort(host, timeout=5):
+    """ Return True if a tcp connection to the host's ssh port
+        (the data port for tegras) can be opened
+    """
+    if host.fqdn is None:
+        return False
+    if host.isTegra:
+        port = 20700
+    else:
+        port = 22
+    try:
+        s = socket.create_connection(('%s' % host.fqdn, port), timeout)
+        s.close()
+        return True
+    except:
+        return False
+
+def trackingTimes(wait, interval=30):
+    """ Return (deadline, settle, interval) for a tracker that should
+        take a host that never comes back through every step of
+        escalation within wait seconds
+    """
+    deadline = max(1, int(wait) / len(escalation))
+    settle   = min(120, deadline / 2)
+    interval = max(1, min(interval, deadline / 4))
+    return deadline, settle, interval
+
+class RebootTracker(object):
+    """ Track rebooted hosts until buildbot reconnects to a master
+
+        Hosts are left alone for settle seconds after a reboot so one
+        that has not gone down yet isn't mistaken for one that came back.
+        After that, every interval seconds the tracked hosts are probed
+        in one concurrent batch; the reachable ones are then looked up in
+        the /json/slaves document of their master, fetched once per master.
+        A host with no known master counts as recovered once reachable.
+
+        A host that has not recovered by its deadline is rebooted again
+        with the next method in escalation that it supports, through
+        RemoteEnvironment.escalateReboot(), and is reported as failed
+        once none is left.
+
+        The time from the first reboot to recovery is kept in
+        self.recovered and written to the kittenherder:recovery:<host>
+        hash when a db is given.
+
+        With a db, join() also stores the hosts it gives up on in the
+        kittenherder:tracking hash and resume() tracks them again, so a
+        reboot that did not take is escalated by the next run instead of
+        being dropped.
+    """
+    def __init__(self, remoteEnv, deadline=600, settle=120, interval=30, timeout=5, workers=16, db=None):
+        self.remoteEnv = remoteEnv
+        self.deadline  = deadline
+        self.settle    = settle
+        self.interval  = interval
+        self.timeout   = timeout
+        self.workers   = workers
+        self.db        = db
+        self.entries   = {}
+        self.recovered = {}
+        self.failed    = {}
+        self.condition = threading.Condition()
+        self.thread    = None
+        self.running   = False
+
+    def track(self, host, method):
+        now = time.time()
+        self.condition.acquire()
+        try:
+            if host.hostname in self.entries:
+                entry = self.entries[host.hostname]
+            else:
+                entry = { 'host':     host,
+                          'started':  now,
+                          'attempts': [],
+                        }
+                self.entries[host.hostname] = entry
+            entry['method']   = method
+            entry['rebooted'] = now
+            entry['deadline'] = now + self.deadline
+            entry['attempts'].append(method)
+            self._start()
+        finally:
+            self.condition.release()
+
+        log.debug('tracking %s reboot of %s' % (method, host.hostname))
+
+    def _start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread  = threading.Thread(target=self._run, name='RebootTracker')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def resume(self):
+        """ Track the hosts a previous run left pending again, keeping
+            their deadlines. Returns the hostnames resumed.
+        """
+        if self.db is None:
+            return []
+        try:
+            pending = self.db.hgetall(pendingKey)
+        except:
+            log.error('unable to read %s' % pendingKey, exc_info=True)
+            return []
+
+        now     = time.time()
+        resumed = []
+        for hostname, value in pending.items():
+            try:
+                saved = json.loads(value)
+                if now - saved['started'] > _pendingExpire:
+                    self.db.hdel(pendingKey, hostname)
+                    continue
+                host = self.remoteEnv.getHost(hostname, connect=False)
+            except:
+                log.error('unable to resume tracking of %s' % hostname, exc_info=True)
+                continue
+            if host is None:
+                continue
+
+            self.condition.acquire()
+            try:
+                if hostname not in self.entries:
+                    saved['host'] = host
+                    self.entries[hostname] = saved
+                    resumed.append(hostname)
+                    self._start()
+            finally:
+                self.condition.release()
+
+        if len(resumed) > 0:
+            log.info('resumed tracking of %d hosts from the last run' % len(resumed))
+        return resumed
+
+    def save(self, entries):
+        """ Store entries in kittenherder:tracking for resume()
+        """
+        for entry in entries:
+            saved = dict([(key, entry[key]) for key in ('started', 'method', 'rebooted', 'deadline', 'attempts')])
+            self.db.hset(pendingKey, entry['host'].hostname, json.dumps(saved))
+        self.db.expire(pendingKey, _pendingExpire)
+
+    def _run(self):
+        while True:
+            self.condition.acquire()
+            try:
+                if self.running:
+                    self.condition.wait(self.interval)
+                if not self.running:
+                    break
+                entries = self.entries.values()
+            finally:
+                self.condition.release()
+
+            if len(entries) > 0:
+                try:
+                    self.poll(entries)
+                except:
+                    log.error('error polling rebooted hosts', exc_info=True)
+
+    def _probe(self, entry):
+        return entry['host'].hostname, probePort(entry['host'], self.timeout)
+
+    def _fetchMaster(self, url):
+        data = fetchUrl('%s/json/slaves' % url, timeout=self.timeout)
+        if data is not None:
+            try:
+                return url, json.loads(data)
+            except:
+                log.error('unable to parse slave status from %s' % url, exc_info=True)
+        return url, None
+
+    def _master(self, hostname):
+        remoteEnv = self.remoteEnv
+        slave     = remoteEnv.slaveStatus(hostname)
+        if slave is not None:
+            return remoteEnv.findMaster(slave['master'])
+        info = remoteEnv.hosts.get(hostname, None)
+        if info is not None:
+            return remoteEnv.findMaster(info.get('current_master', None))
+        return None
+
+    def poll(self, entries):
+        now     = time.time()
+        entries = [entry for entry in entries if now - entry['rebooted'] >= self.settle]
+        if len(entries) == 0:
+            return
+
+        pool = ThreadPool(min(self.workers, len(entries)))
+        try:
+            reachable = dict(pool.map(self._probe, entries))
+
+            masters    = {}
+            withMaster = set()
+            for entry in entries:
+                hostname = entry['host'].hostname
+                if reachable[hostname]:
+                    master = self._master(hostname)
+                    if master is not None:
+                        masters.setdefault(masterURL(master), []).append(hostname)
+                        withMaster.add(hostname)
+
+            connected = {}
+            for url, slaves in pool.map(self._fetchMaster, masters.keys()):
+                if slaves is not None:
+                    for hostname in masters[url]:
+                        if hostname in slaves and slaves[hostname].get('connected', False):
+                            connected[hostname] = True
+        finally:
+            pool.close()
+            pool.join()
+
+        now = time.time()
+        for entry in entries:
+            hostname = entry['host'].hostname
+            if reachable[hostname] and (connected.get(hostname, False) or hostname not in withMaster):
+                self._done(entry, True)
+            elif now >= entry['deadline']:
+                self.escalate(entry)
+
+    def escalate(self, entry):
+        host = entry['host']
+        n    = escalation.index(entry['method']) + 1 if entry['method'] in escalation else 0
+
+        for method in escalation[n:]:
+            if method == 'pdu' and host.hasPDU:
+                log.info('%s did not come back after %s reboot, trying PDU' % (host.hostname, entry['method']))
+            elif method == 'ipmi' and host.hasIPMI:
+                log.info('%s did not come back after %s reboot, trying IPMI' % (host.hostname, entry['method']))
+            else:
+                continue
+            if self.remoteEnv.escalateReboot(host, method):
+                return True
+
+        log.error('%s did not come back after reboot (%s)' % (host.hostname, ', '.join(entry['attempts'])))
+        self._done(entry, False)
+        return False
+
+    def _done(self, entry, recovered):
+        host    = entry['host']
+        elapsed = time.time() - entry['started']
+
+        self.condition.acquire()
+        try:
+            self.entries.pop(host.hostname, None)
+            if recovered:
+                self.recovered[host.hostname] = elapsed
+            else:
+                self.failed[host.hostname] = elapsed
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+        if recovered:
+            log.info('%s recovered %ds after %s reboot' % (host.hostname, elapsed, entry['method']))
+            self.remoteEnv.setState(host.hostname, healthy, 'reconnected after %s reboot' % entry['method'])
+        else:
+            self.remoteEnv.setState(host.hostname, awaitingRecovery, 'no recovery after %s' % ', '.join(entry['attempts']))
+
+        if self.db is not None:
+            self.db.hdel(pendingKey, host.hostname)
+
+            key = 'kittenherder:recovery:%s' % host.hostname
+            self.db.hset(key, 'started',   int(entry['started']))
+            self.db.hset(key, 'method',    entry['method'])
+            self.db.hset(key, 'attempts',  ','.join(entry['attempts']))
+            self.db.hset(key, 'recovered', recovered)
+            self.db.hset(key, 'seconds',   int(elapsed))
+            self.db.expire(key, _keyExpire)
+
+    def join(self, timeout=None):
+        """ Wait until every tracked host recovered or failed, or until
+            timeout seconds have passed. Returns the hosts still pending,
+            which are stored for resume() when a db is given.
+        """
+        if timeout is not None:
+            until = time.time() + timeout
+
+        self.condition.acquire()
+        try:
+            while len(self.entries) > 0:
+                if timeout is None:
+                    self.condition.wait(self.interval)
+                else:
+                    remaining = until - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(min(remaining, self.interval))
+            self.running = False
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        # a poll still running when we gave up may have finished some
+        pending = self.entries.values()
+        if self.db is not None and len(pending) > 0:
+            try:
+                self.save(pending)
+            except:
+                log.error('unable to store the hosts still tracked', exc_info=True)
+
+        pending = [entry['host'].hostname for entry in pending]
+        for hostname in pending:
+            log.info('%s has not recovered yet' % hostname)
+
+        return pending
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.waiter
+
+    Background wait for buildbot to exit after a graceful shutdown
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import time
+import heapq
+import threading
+
+from multiprocessing import get_logger
+
+
+log = get_logger()
+
+
+def shutdownComplete(host):
+    """ Return True if twistd.log shows buildbot has stopped, no
+        output (no ssh channel, a failed tail) proves nothing
+    """
+    data = host.tail_twistd_log(10)
+    if not data:
+        return False
+    return "Main loop terminated" in data or "ProcessExitedAlready" in data
+
+class ShutdownWaiter(object):
+    """ Hosts parked here are polled from a background thread until
+        buildbot has stopped or their timeout expires, then their
+        callback is run from that thread as callback(host, timedOut).
+        check(host) tells whether buildbot has stopped, shutdownComplete
+        unless park() is given another one.
+
+        Polls start delay seconds after park() and the delay doubles
+        after every poll up to maxDelay, so a host finishing a long job
+        costs a handful of tail commands instead of a tight loop.
+    """
+    def __init__(self, delay=5, maxDelay=60, timeout=300):
+        self.delay     = delay
+        self.maxDelay  = maxDelay
+        self.timeout   = timeout
+        self.entries   = []
+        self.active    = 0
+        self.condition = threading.Condition()
+        self.thread    = None
+        self.running   = False
+
+    def park(self, host, callback, indent='', check=None):
+        now   = time.time()
+        entry = { 'host':     host,
+                  'callback': callback,
+                  'check':    check or shutdownComplete,
+                  'indent':   indent,
+                  'delay':    self.delay,
+                  'deadline': now + self.timeout,
+                  'polls':    0,
+                }
+        log.info("%sWaiting for shutdown" % indent)
+
+        self.condition.acquire()
+        try:
+            heapq.heappush(self.entries, (now + self.delay, id(entry), entry))
+            self.active += 1
+            if self.thread is None:
+                self.running = True
+                self.thread  = threading.Thread(target=self._run, name='ShutdownWaiter')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def _next(self):
+        """ Block until the next entry is due, returns None once stopped
+        """
+        self.condition.acquire()
+        try:
+            while self.running:
+                if len(self.entries) == 0:
+                    self.condition.wait()
+                    continue
+                due = self.entries[0][0] - time.time()
+                if due <= 0:
+                    return heapq.heappop(self.entries)[2]
+                self.condition.wait(due)
+            return None
+        finally:
+            self.condition.release()
+
+    def _run(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                break
+
+            host   = entry['host']
+            indent = entry['indent']
+            entry['polls'] += 1
+            try:
+                done = entry['check'](host)
+            except:
+                log.error('%serror polling shutdown of %s' % (indent, host.hostname), exc_info=True)
+                done = False
+
+            now      = time.time()
+            timedOut = not done and now >= entry['deadline']
+
+            if done or timedOut:
+                if timedOut:
+                    log.info("%sTook too long to shut down; giving up" % indent)
+                else:
+                    log.debug('%s%s stopped after %d polls' % (indent, host.hostname, entry['polls']))
+                try:
+                    entry['callback'](host, timedOut)
+                except:
+                    log.error('%serror completing shutdown of %s' % (indent, host.hostname), exc_info=True)
+
+                self.condition.acquire()
+                try:
+                    self.active -= 1
+                    self.condition.notifyAll()
+                finally:
+                    self.condition.release()
+            else:
+                entry['delay'] = min(entry['delay'] * 2, self.maxDelay)
+                pollAt         = min(now + entry['delay'], entry['deadline'])
+
+                self.condition.acquire()
+                try:
+                    heapq.heappush(self.entries, (pollAt, id(entry), entry))
+                finally:
+                    self.condition.release()
+
+    def join(self):
+        """ Wait for every parked host to finish, then stop the thread
+        """
+        self.condition.acquire()
+        try:
+            while self.active > 0:
+                self.condition.wait(1)
+            self.running = False
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+def waitForShutdown(host, indent='', delay=5, maxDelay=60, timeout=300):
+    """ Blocking variant of ShutdownWaiter for a single host,
+        returns True if buildbot did not stop before the timeout
+    """
+    log.info("%sWaiting for shutdown" % indent)
+    deadline = time.time() + timeout
+
+    while True:
+        if shutdownComplete(host):
+            return False
+        now = time.time()
+        if now >= deadline:
+            log.info("%sTook too long to shut down; giving up" % indent)
+            return True
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, maxDelay)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.workqueue
+
+    Redis work queue shared by kittenherder processes on any number of hosts
+
+    :copyright: (c) 2012 by Mozilla
+    :license: MPLv2
+
+    Assumes Python v2.6+
+"""
+
+import os
+import time
+import json
+import socket
+import threading
+
+from multiprocessing import get_logger
+
+
+log        = get_logger()
+_keyExpire = 86400
+
+
+def workerID():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+class WorkQueue(object):
+    """ Items wait in the kittenherder:queue:<name>:pending list.
+
+        claim() moves an item to the :processing list with RPOPLPUSH, so
+        exactly one worker gets it, and sets a :lease:<item> key that
+        expires after visibility seconds. ack() stores the item's result
+        in the :results hash, then drops the lease and the item from
+        :processing.
+
+        A worker that dies leaves its items in :processing with their
+        leases running out. reap() puts any item whose lease is gone back
+        at the head of :pending. An item is only reaped once it was seen
+        without a lease for grace seconds, so one claimed a moment ago
+        (lease not yet written) is left alone. claims() keeps the other
+        workers around until :processing is empty too, so they pick the
+        reaped items up.
+
+        While a worker holds items a heartbeat thread renews their leases
+        every visibility/3 seconds, so an item that takes longer than
+        visibility to process (graceful shutdown waits, ssh timeouts) is
+        not handed to a second worker. close() stops the heartbeat.
+    """
+    def __init__(self, db, name, visibility=900, grace=30, worker=None):
+        self.db         = db
+        self.name       = name
+        self.visibility = visibility
+        self.grace      = grace
+        self.pending    = 'kittenherder:queue:%s:pending' % name
+        self.processing = 'kittenherder:queue:%s:processing' % name
+        self.results    = 'kittenherder:queue:%s:results' % name
+        self.orphans    = {}
+        self.lastReap   = 0
+        self.held       = set()
+        self.lock       = threading.Lock()
+        self.event      = threading.Event()
+        self.thread     = None
+        if worker is None:
+            worker = workerID()
+        self.worker = worker
+
+    def leaseKey(self, item):
+        return 'kittenherder:queue:%s:lease:%s' % (self.name, item)
+
+    def put(self, items):
+        """ Start a new sweep: forget the results of the last one and
+            queue items in order. Returns the number queued.
+        """
+        self.db.delete(self.results)
+        n = 0
+        for item in items:
+            self.db.lpush(self.pending, item)
+            n += 1
+        self.db.expire(self.pending, _keyExpire)
+        log.info('queued %d items on %s' % (n, self.name))
+        return n
+
+    def claim(self):
+        """ Return the next item or None once nothing is pending
+        """
+        if time.time() - self.lastReap >= self.grace:
+            self.reap()
+
+        item = self.db.rpoplpush(self.pending, self.processing)
+        if item is not None:
+            self.db.set(self.leaseKey(item), self.worker, expires=self.visibility)
+            self.lock.acquire()
+            try:
+                self.held.add(item)
+                if self.thread is None:
+                    self.event.clear()
+                    self.thread = threading.Thread(target=self._run, name='WorkQueueHeartbeat')
+                    self.thread.daemon = True
+                    self.thread.start()
+            finally:
+                self.lock.release()
+        return item
+
+    def claims(self, interval=10, timeout=None):
+        """ Yield claimed items until every item of the sweep was acked.
+
+            While nothing is pending but other workers still hold items,
+            wait interval seconds at a time for claim() to reap and hand
+            out the ones whose worker died. Gives up after timeout
+            seconds without anything to claim.
+        """
+        waiting = None
+        while True:
+            item = self.claim()
+            if item is not None:
+                waiting = None
+                yield item
+            elif self.size() == 0:
+                break
+            else:
+                now = time.time()
+                if waiting is None:
+                    waiting = now
+                elif timeout is not None and now - waiting >= timeout:
+                    log.info('%s: gave up waiting for the items other workers hold' % self.name)
+                    break
+                time.sleep(interval)
+
+    def renew(self, item):
+        """ Extend the lease of item, returns False if it was lost
+        """
+        if self.db.get(self.leaseKey(item)) != self.worker:
+            log.error('%s: lease lost, another worker may process it' % item)
+            return False
+        self.db.expire(self.leaseKey(item), self.visibility)
+        return True
+
+    def _run(self):
+        while True:
+            self.event.wait(self.visibility / 3.0)
+            if self.event.isSet():
+                break
+            self.lock.acquire()
+            try:
+                held = list(self.held)
+            finally:
+                self.lock.release()
+            for item in held:
+                try:
+                    if not self.renew(item):
+                        self._release(item)
+                except:
+                    log.error('unable to renew the lease of %s' % item, exc_info=True)
+
+    def _release(self, item):
+        self.lock.acquire()
+        try:
+            self.held.discard(item)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """ Stop renewing leases
+        """
+        self.event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def record(self, item, result):
+        self.db.hset(self.results, item, json.dumps(result))
+        self.db.expire(self.results, _keyExpire)
+
+    def ack(self, item, result=None):
+        self._release(item)
+        if result is not None:
+            self.record(item, result)
+        self.db.delete(self.leaseKey(item))
+        self.db.lrem(self.processing, 1, item)
+
+    def reap(self):
+        """ Requeue items whose worker let the lease expire,
+            returns the number requeued
+        """
+        now           = time.time()
+        self.lastReap = now
+        orphans       = {}
+        requeued      = 0
+
+        for item in self.db.lrange(self.processing, 0, -1):
+            if self.db.exists(self.leaseKey(item)):
+                continue
+            since = self.orphans.get(item, now)
+            if now - since < self.grace:
+                orphans[item] = since
+            elif self.db.lrem(self.processing, 1, item) > 0:
+                # only the reaper that removed it requeues it
+                log.info('%s: lease expired, requeueing' % item)
+                self.db.rpush(self.pending, item)
+                requeued += 1
+
+        self.orphans = orphans
+        return requeued
+
+    def size(self):
+        return self.db.llen(self.pending) + self.db.llen(self.processing)
+
+    def join(self, timeout=None, interval=10):
+        """ Wait until every item was acked, reaping abandoned ones so
+            other workers pick them up. Returns True if the queue drained.
+        """
+        if timeout is not None:
+            until = time.time() + timeout
+        while self.size() > 0:
+            if timeout is not None and time.time() >= until:
+                return False
+            self.reap()
+            time.sleep(interval)
+        return True
+
+    def collect(self):
+        """ Return an item -> result map of the current sweep
+        """
+        result = {}
+        for item, value in self.db.hgetall(self.results).items():
+            try:
+                result[item] = json.loads(value)
+            except:
+                log.error('bad result for %s in %s' % (item, self.results), exc_info=True)
+        return result
@@ -3,9 +3,10 @@
 set -e
 FILTER=$1
 FILTERBASE=$2
+SHARD=$3
 
 if [ "${FILTER}" == "" ]; then
-    print "Usage: run_kittenherder.sh filter [filterbase]"
+    print "Usage: run_kittenherder.sh filter [filterbase] [shard i/N|auto]"
     exit
 fi
 
@@ -13,12 +14,22 @@ if [ "${FILTERBASE}" == "" ]; then
   FILTERBASE="^%s"
 fi
 
+# the redis lease of the shard keeps a second run of the same
+# filter and shard from starting while one is still going
+if [ "${SHARD}" == "" ]; then
+  SHARD="0/1"
+fi
+
 KITTEN=/home/buildduty/briar-patch
-LOCK=${KITTEN}/lockfile_kittenherder_${FILTER}.cron
-lockfile -5 -r 1 ${LOCK} || exit
-trap "rm -f $LOCK" EXIT
+LOG=${KITTEN}/logs/lastrun_kittenherder_${FILTER}_${SHARD//\//_}.log
 
 cd ${KITTEN}
 . bin/activate
-nice python kittenherder.py --force --debug --filterbase ${FILTERBASE} -f ${FILTER} -v -l ${KITTEN}/logs > ${KITTEN}/logs/lastrun_kittenherder_${FILTER}.log 2>&1
+# write to a temporary file so a run that finds the shard taken
+# doesn't truncate the log of the one holding it
+if nice python kittenherder.py --force --debug --filterbase ${FILTERBASE} -f ${FILTER} --shard ${SHARD} -v -l ${KITTEN}/logs > ${LOG}.$$ 2>&1; then
+  mv ${LOG}.$$ ${LOG}
+else
+  mv ${LOG}.$$ ${LOG}.failed
+fi
 
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.ec2 reconciliation tests against fake EC2 connections
+"""
+
+import threading
+import unittest
+
+from releng import ec2
+
+
+class Region(object):
+    def __init__(self, name):
+        self.name = name
+
+class Instance(object):
+    def __init__(self, id, region, mozType='tests', state='running', mozState='ready'):
+        self.id     = id
+        self.region = Region(region)
+        self.state  = state
+        self.tags   = { 'Name': 'tst-%s' % id, 'moz-type': mozType, 'moz-state': mozState }
+
+class Reservation(object):
+    def __init__(self, instances):
+        self.instances = instances
+
+class FakeEC2(object):
+    """ Stands in for connect_to_region, keeping what every region's
+        connection was asked
+    """
+    def __init__(self, instances):
+        self.instances   = instances
+        self.connections = []
+        self.describes   = []
+        self.stops       = []
+        self.lock        = threading.Lock()
+
+    def __call__(self, region, aws_access_key_id=None, aws_secret_access_key=None):
+        self.connections.append(region)
+        return FakeConnection(self, region)
+
+class FakeConnection(object):
+    def __init__(self, ec2, region):
+        self.ec2    = ec2
+        self.region = region
+
+    def get_all_instances(self):
+        self.ec2.lock.acquire()
+        try:
+            self.ec2.describes.append(self.region)
+        finally:
+            self.ec2.lock.release()
+        return [Reservation([i for i in self.ec2.instances if i.region.name == self.region])]
+
+    def stop_instances(self, instance_ids=None):
+        self.ec2.lock.acquire()
+        try:
+            self.ec2.stops.append((self.region, list(instance_ids)))
+        finally:
+            self.ec2.lock.release()
+
+class FakeDB(object):
+    def __init__(self, hashes):
+        self.hashes = hashes
+
+    def keys(self, search):
+        return [key for key in self.hashes if key.startswith(search.rstrip('*'))]
+
+    def hgetallMany(self, keys):
+        return [self.hashes[key] for key in keys]
+
+class TestEC2Reconciler(unittest.TestCase):
+    def setUp(self):
+        self.instances = [Instance('i-1', 'us-east-1'),
+                          Instance('i-2', 'us-east-1'),
+                          Instance('i-3', 'us-east-1', mozType='build'),
+                          Instance('i-4', 'us-west-2'),
+                          Instance('i-5', 'us-west-2', state='stopped'),
+                          Instance('i-6', 'us-west-2', mozState='new'),
+                         ]
+        self.ec2        = FakeEC2(self.instances)
+        self.reconciler = ec2.EC2Reconciler('key', 'secret', batchSize=2, connect=self.ec2)
+
+    def test_one_describe_per_region(self):
+        instances = self.reconciler.instances(['us-east-1', 'us-west-2'])
+        self.assertEqual(sorted(instances.keys()), ['i-1', 'i-2', 'i-3', 'i-4', 'i-5', 'i-6'])
+
+        self.reconciler.instances(['us-east-1', 'us-west-2'])
+        self.assertEqual(sorted(self.ec2.describes), ['us-east-1', 'us-west-2'])
+        self.assertEqual(sorted(self.ec2.connections), ['us-east-1', 'us-west-2'])
+
+        self.reconciler.instances(['us-east-1'], refresh=True)
+        self.assertEqual(len(self.ec2.describes), 3)
+        self.assertEqual(len(self.ec2.connections), 2)
+
+    def test_counts(self):
+        instances = self.reconciler.instances(['us-east-1', 'us-west-2'])
+        counts    = self.reconciler.counts(instances, { 'tests-ec2': { 'min': 1, 'max': 10 } })
+
+        self.assertEqual(counts['tests-ec2'], { 'current': 3, 'min': 1, 'max': 10 })
+        self.assertEqual(counts['build-ec2']['current'], 1)
+        self.assertEqual(counts['build-ec2']['min'], ec2.defaultLimits['min'])
+
+    def test_plan_keeps_minimum(self):
+        instances = self.reconciler.instances(['us-east-1', 'us-west-2'])
+        counts    = self.reconciler.counts(instances, { 'tests-ec2': { 'min': 1, 'max': 10 },
+                                                        'build-ec2': { 'min': 0, 'max': 10 } })
+        idle      = [('i-1', 3600), ('i-2', 7200), ('i-4', 5400), ('i-3', 4000), ('i-5', 9000)]
+
+        self.assertEqual(self.reconciler.plan(idle, instances, counts), ['i-2', 'i-4', 'i-3'])
+
+    def test_stop_batches_per_region(self):
+        instances = self.reconciler.instances(['us-east-1', 'us-west-2'])
+        results   = self.reconciler.stop(['i-1', 'i-2', 'i-3', 'i-4'], instances)
+
+        self.assertEqual(results, { 'i-1': True, 'i-2': True, 'i-3': True, 'i-4': True })
+        self.assertEqual(sorted(self.ec2.stops), [('us-east-1', ['i-1', 'i-2']),
+                                                  ('us-east-1', ['i-3']),
+                                                  ('us-west-2', ['i-4'])])
+
+        # stopping invalidates the cached describe
+        self.reconciler.instances(['us-east-1', 'us-west-2'])
+        self.assertEqual(len(self.ec2.describes), 4)
+
+class TestLoadLimits(unittest.TestCase):
+    def test_limits(self):
+        db = FakeDB({ 'counts:tests-ec2': { 'min': '4', 'max': '20' },
+                      'counts:build-ec2': { 'max': 'x' },
+                    })
+        limits = ec2.loadLimits(db)
+
+        self.assertEqual(limits['tests-ec2'], { 'min': 4, 'max': 20 })
+        self.assertEqual(limits['build-ec2'], ec2.defaultLimits)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.events publish/subscribe tests over inproc:// endpoints
+"""
+
+import time
+import unittest
+
+from releng import events
+
+
+class EventsTest(unittest.TestCase):
+    endpoint = 'inproc://kittenherder-test-%d'
+    n        = 0
+
+    def setUp(self):
+        if events.zmq is None:
+            self.skipTest('pyzmq is not installed')
+        EventsTest.n += 1
+        self.endpoint = EventsTest.endpoint % EventsTest.n
+        self.sockets  = []
+
+    def tearDown(self):
+        for socket in self.sockets:
+            socket.close()
+
+    def publisher(self, endpoint=None, hwm=1000):
+        publisher = events.EventPublisher(endpoint or self.endpoint, hwm=hwm)
+        self.sockets.append(publisher)
+        return publisher
+
+    def subscriber(self, endpoint=None, topics=('',), hwm=10000):
+        subscriber = events.EventSubscriber(endpoint or self.endpoint, topics=topics, hwm=hwm)
+        self.sockets.append(subscriber)
+        return subscriber
+
+    def join(self, publisher, subscriber, topic=events.check):
+        """ Publish on topic until the subscriber gets one, a new
+            subscription takes a moment to reach the publisher
+        """
+        for n in range(100):
+            publisher.publish(topic, 'ping')
+            if subscriber.recv(timeout=0.05) is not None:
+                break
+        else:
+            self.fail('subscriber never joined')
+        while subscriber.recv(timeout=0.05) is not None:
+            pass
+
+class TestPubSub(EventsTest):
+    def test_event(self):
+        publisher  = self.publisher()
+        subscriber = self.subscriber()
+        self.join(publisher, subscriber)
+
+        before = time.time()
+        self.assertTrue(publisher.publish(events.reboot, 'tegra-001', method='pdu', outcome='ok'))
+        topic, event = subscriber.recv(timeout=1)
+
+        self.assertEqual(topic, events.reboot)
+        self.assertEqual(event['host'], 'tegra-001')
+        self.assertEqual((event['method'], event['outcome']), ('pdu', 'ok'))
+        self.assertEqual(event['herder'], publisher.herder)
+        self.assertTrue(event['ts'] >= before)
+
+    def test_topics(self):
+        publisher  = self.publisher()
+        subscriber = self.subscriber(topics=(events.state, events.reboot))
+        self.join(publisher, subscriber, events.state)
+
+        publisher.publish(events.check, 'tegra-001')
+        publisher.publish(events.state, 'tegra-001', state='idle')
+        publisher.publish(events.reboot, 'tegra-001', method='ssh')
+
+        received = []
+        while True:
+            item = subscriber.recv(timeout=0.2)
+            if item is None:
+                break
+            received.append(item[0])
+        self.assertEqual(received, [events.state, events.reboot])
+
+    def test_subscriber_binds(self):
+        subscriber = self.subscriber('@%s' % self.endpoint)
+        publisher  = self.publisher('>%s' % self.endpoint)
+        self.join(publisher, subscriber)
+
+        publisher.publish(events.check, 'tegra-001', reachable=True)
+        topic, event = subscriber.recv(timeout=1)
+        self.assertEqual((topic, event['reachable']), (events.check, True))
+
+    def test_several_publishers(self):
+        other      = 'inproc://kittenherder-test-other-%d' % EventsTest.n
+        first      = self.publisher()
+        second     = self.publisher(other)
+        subscriber = self.subscriber()
+        subscriber.connect(other)
+        self.join(first, subscriber)
+        self.join(second, subscriber)
+
+        first.publish(events.check, 'tegra-001')
+        second.publish(events.check, 'tegra-002')
+        hosts = sorted([subscriber.recv(timeout=1)[1]['host'] for n in range(2)])
+        self.assertEqual(hosts, ['tegra-001', 'tegra-002'])
+
+    def test_recv_timeout(self):
+        subscriber = self.subscriber('@%s' % self.endpoint)
+        self.assertEqual(subscriber.recv(timeout=0.05), None)
+
+class TestNeverBlocks(EventsTest):
+    def test_no_subscriber(self):
+        publisher = self.publisher()
+        for n in range(100):
+            self.assertTrue(publisher.publish(events.check, 'tegra-%03d' % n))
+        self.assertEqual(publisher.published, 100)
+
+    def test_slow_subscriber(self):
+        publisher  = self.publisher(hwm=10)
+        subscriber = self.subscriber(hwm=10)
+        self.join(publisher, subscriber)
+
+        start = time.time()
+        for n in range(10000):
+            publisher.publish(events.check, 'tegra-%03d' % n)
+        self.assertTrue(time.time() - start < 5)
+
+        received = 0
+        while subscriber.recv(timeout=0.1) is not None:
+            received += 1
+        self.assertTrue(0 < received < 10000)
+
+if __name__ == '__main__':
+    unittest.main()
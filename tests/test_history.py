@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.history tests against an in memory SQLite database
+"""
+
+import datetime
+import threading
+import unittest
+
+from releng.history import HistoryStore
+
+
+class TestHistoryStore(unittest.TestCase):
+    def setUp(self):
+        self.store = HistoryStore(':memory:', batchSize=3)
+
+    def tearDown(self):
+        self.store.close()
+
+    def count(self, table):
+        return self.store.conn.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+
+    def test_batched_writes(self):
+        self.store.addKitten('tegra-001', { 'reachable': True }, ts=1)
+        self.store.addKitten('tegra-002', { 'reachable': True }, ts=1)
+        self.assertEqual(self.count('kittens'), 0)
+
+        self.store.addKitten('tegra-003', { 'reachable': True }, ts=1)
+        self.assertEqual(self.count('kittens'), 3)
+
+        self.store.addReboot('tegra-001', 'pdu', True, 'ok', ts=1)
+        self.store.flush()
+        self.assertEqual(self.count('reboots'), 1)
+
+    def test_history(self):
+        self.store.addKitten('talos-r3-fed-001', { 'reachable': False, 'reboot': True, 'pdu': True }, ts=100)
+        self.store.addKitten('talos-r3-fed-001', { 'reachable': True, 'buildbot': 'running',
+                                                   'lastseen': datetime.timedelta(hours=2, seconds=5) }, ts=200)
+        self.store.addKitten('talos-r3-fed-001', { 'reachable': True, 'lastseen': { 'since': 60 } }, ts=300)
+        self.store.addKitten('talos-r3-fed-002', { 'reachable': True }, ts=400)
+
+        rows = self.store.history('talos-r3-fed-001')
+        self.assertEqual([row[0] for row in rows], [300, 200, 100])
+        self.assertEqual(rows[0][4], 60)
+        self.assertEqual(rows[1][1:5], (1, 'running', '', 7205))
+        self.assertEqual((rows[2][1], rows[2][5], rows[2][7]), (0, 1, 1))
+        self.assertEqual(len(self.store.history('talos-r3-fed-001', limit=1)), 1)
+
+    def test_reboots(self):
+        for ts, host, method, result in ((100, 'tegra-001', 'pdu', True),
+                                         (200, 'tegra-001', 'pdu', False),
+                                         (300, 'tegra-001', 'ssh', True),
+                                         (300, 'tegra-002', 'pdu', True),
+                                         (50,  'tegra-003', 'ipmi', True)):
+            self.store.addReboot(host, method, result, 'rebooted', platform='tegra', ts=ts)
+
+        self.assertEqual([row[:3] for row in self.store.lastReboots('tegra-001')],
+                         [(300, 'ssh', 1), (200, 'pdu', 0), (100, 'pdu', 1)])
+        self.assertEqual(self.store.rebootCounts(100), [('tegra-001', 3), ('tegra-002', 1)])
+        self.assertEqual(self.store.rebootCounts(100, minCount=2), [('tegra-001', 3)])
+        self.assertEqual(self.store.rebootCounts(0, platform='linux'), [])
+        self.assertEqual(self.store.methodResults(100), [('pdu', 0, 1), ('pdu', 1, 2), ('ssh', 1, 1)])
+
+    def test_threads(self):
+        def worker(n):
+            for i in range(50):
+                self.store.addReboot('tegra-%03d' % n, 'pdu', True, 'ok', ts=i)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.store.rebootCounts(0)), 4)
+        self.assertEqual(self.count('reboots'), 200)
+
+if __name__ == '__main__':
+    unittest.main()
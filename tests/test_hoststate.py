@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.hoststate tests against an in memory hash store
+"""
+
+import unittest
+
+from releng import hoststate
+
+
+class FakeDB(object):
+    def __init__(self):
+        self.hashes = {}
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hset(self, key, field, value):
+        # redis hands every field back as a string
+        self.hashes.setdefault(key, {})[field] = str(value)
+
+    def expire(self, key, seconds):
+        pass
+
+class TestHostStates(unittest.TestCase):
+    def setUp(self):
+        self.db     = FakeDB()
+        self.states = hoststate.HostStates(self.db)
+
+    def test_unknown_host(self):
+        self.assertEqual(self.states.get('tegra-001'), None)
+        self.assertEqual(self.states.nextAction('tegra-001'), ('check', None))
+
+    def test_transitions(self):
+        self.states.set('tegra-001', hoststate.rebootingSoft, 'ssh reboot')
+        self.states.set('tegra-001', hoststate.healthy, 'reconnected')
+
+        state = self.states.get('tegra-001')
+        self.assertEqual((state['state'], state['previous'], state['reason']), (hoststate.healthy, hoststate.rebootingSoft, 'reconnected'))
+        self.assertTrue(isinstance(state['since'], float))
+        self.assertTrue(hoststate.rebootingSoft in state)
+        self.assertRaises(ValueError, self.states.set, 'tegra-001', 'sleeping')
+
+    def test_hold_times(self):
+        self.states.set('tegra-001', hoststate.rebootingHard, 'pdu reboot')
+        since = self.states.get('tegra-001')['since']
+
+        action, reason = self.states.nextAction('tegra-001', now=since + 600)
+        self.assertEqual(action, 'skip')
+        self.assertTrue(reason.startswith(hoststate.rebootingHard))
+        self.assertEqual(self.states.nextAction('tegra-001', now=since + 1800), ('check', None))
+
+    def test_states_without_hold_time(self):
+        self.states.set('tegra-001', hoststate.healthy)
+        since = self.states.get('tegra-001')['since']
+
+        self.assertEqual(self.states.nextAction('tegra-001', now=since), ('check', None))
+
+    def test_observe_does_not_override_actions(self):
+        self.states.set('tegra-001', hoststate.rebootingSoft, 'ssh reboot')
+        self.states.observe('tegra-001', hoststate.healthy, 'check')
+        self.states.observe('tegra-002', hoststate.idle, 'check')
+
+        self.assertEqual(self.states.get('tegra-001')['state'], hoststate.rebootingSoft)
+        self.assertEqual(self.states.get('tegra-002')['state'], hoststate.idle)
+        self.assertEqual(self.states.moved, set(['tegra-001']))
+
+    def test_bad_state_is_ignored(self):
+        self.db.hashes[self.states.key('tegra-001')] = { 'state': 'sleeping', 'since': '1' }
+
+        self.assertEqual(self.states.get('tegra-001'), None)
+        self.assertEqual(self.states.nextAction('tegra-001'), ('check', None))
+
+if __name__ == '__main__':
+    unittest.main()
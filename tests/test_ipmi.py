@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.ipmi tests against local http stand-ins for the BMC CGI
+"""
+
+import time
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+
+from releng.ipmi import IPMIEngine
+
+
+class State(object):
+    def __init__(self, delay=0):
+        self.delay    = delay
+        self.logins   = 0
+        self.cycles   = 0
+        self.sessions = set()
+        self.lock     = threading.Lock()
+
+# shared by every BMC so concurrency across them can be measured
+inflight     = { 'now': 0, 'max': 0 }
+inflightLock = threading.Lock()
+
+def handlerFor(state):
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.getheader('content-length', 0)))
+            if self.path.startswith('/cgi/login.cgi'):
+                state.lock.acquire()
+                try:
+                    state.logins += 1
+                    sid = 'sid%d' % state.logins
+                    state.sessions.add(sid)
+                finally:
+                    state.lock.release()
+                self.send_response(200)
+                self.send_header('Set-Cookie', 'SID=%s; path=/' % sid)
+                self.end_headers()
+            else:
+                self.send_response(404)
+                self.end_headers()
+
+        def do_GET(self):
+            if not self.path.startswith('/cgi/ipmi.cgi'):
+                self.send_response(404)
+                self.end_headers()
+                return
+            cookie = self.headers.getheader('cookie', '') or ''
+            sid    = cookie.replace('SID=', '').strip()
+            if sid not in state.sessions:
+                self.send_response(401)
+                self.end_headers()
+                return
+
+            inflightLock.acquire()
+            inflight['now'] += 1
+            inflight['max']  = max(inflight['max'], inflight['now'])
+            inflightLock.release()
+            time.sleep(state.delay)
+            inflightLock.acquire()
+            inflight['now'] -= 1
+            inflightLock.release()
+
+            state.cycles += 1
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write('<POWER_INFO/>')
+    return Handler
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class FakeBMC(object):
+    def __init__(self, delay=0):
+        self.state  = State(delay)
+        self.server = Server(('127.0.0.1', 0), handlerFor(self.state))
+        self.bmc    = '127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FakeHost(object):
+    def __init__(self, hostname, engine, bmc):
+        self.hostname = hostname
+        self.engine   = engine
+        self.bmc      = bmc
+
+    def rebootIPMI(self):
+        return self.engine.powerCycle(self.bmc)
+
+class TestIPMIEngine(unittest.TestCase):
+    def setUp(self):
+        self.bmcs = []
+
+    def tearDown(self):
+        for bmc in self.bmcs:
+            bmc.close()
+
+    def fakeBMC(self, delay=0):
+        bmc = FakeBMC(delay)
+        self.bmcs.append(bmc)
+        return bmc
+
+    def test_session_reuse(self):
+        bmc    = self.fakeBMC()
+        engine = IPMIEngine('admin', 'secret', timeout=5)
+        for n in range(3):
+            self.assertTrue(engine.powerCycle(bmc.bmc))
+
+        self.assertEqual(bmc.state.logins, 1)
+        self.assertEqual(bmc.state.cycles, 3)
+        stats = engine.stats[bmc.bmc]
+        self.assertEqual((stats['logins'], stats['requests'], stats['failures']), (1, 3, 0))
+
+    def test_expired_session(self):
+        bmc    = self.fakeBMC()
+        engine = IPMIEngine('admin', 'secret', timeout=5)
+        self.assertTrue(engine.powerCycle(bmc.bmc))
+        bmc.state.sessions.clear()
+        self.assertTrue(engine.powerCycle(bmc.bmc))
+        self.assertEqual(bmc.state.logins, 2)
+
+    def test_unreachable(self):
+        engine = IPMIEngine('admin', 'secret', timeout=1)
+        self.assertFalse(engine.powerCycle('127.0.0.1:1'))
+        self.assertEqual(engine.stats['127.0.0.1:1']['failures'], 1)
+
+    def test_concurrent_hosts(self):
+        inflight['max'] = 0
+        bmcs   = [self.fakeBMC(delay=0.2) for n in range(4)]
+        engine = IPMIEngine('admin', 'secret', timeout=5, workers=2)
+        hosts  = [FakeHost('host%d' % n, engine, bmc.bmc) for n, bmc in enumerate(bmcs)]
+
+        results = engine.rebootHosts(hosts)
+
+        self.assertEqual(results, dict([(host.hostname, True) for host in hosts]))
+        self.assertEqual(inflight['max'], 2)
+
+    def test_one_request_per_bmc_at_a_time(self):
+        inflight['max'] = 0
+        bmc    = self.fakeBMC(delay=0.1)
+        engine = IPMIEngine('admin', 'secret', timeout=5, workers=4)
+        hosts  = [FakeHost('host%d' % n, engine, bmc.bmc) for n in range(4)]
+
+        results = engine.rebootHosts(hosts)
+
+        self.assertEqual(len([r for r in results.values() if r]), 4)
+        self.assertEqual(inflight['max'], 1)
+        self.assertEqual(engine.stats[bmc.bmc]['requests'], 4)
+
+if __name__ == '__main__':
+    unittest.main()
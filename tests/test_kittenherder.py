@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" kittenherder tests, without redis or the network
+"""
+
+import re
+import threading
+import unittest
+
+import kittenherder
+from releng import dbRedis
+
+
+class FakeNegativeCache(object):
+    def __init__(self):
+        self.calls = []
+
+    def fail(self, hostname, failure, info):
+        self.calls.append((hostname, failure))
+
+    def clear(self, hostname):
+        self.calls.append((hostname, None))
+
+class FakeHost(object):
+    def __init__(self, hostname, fqdn, farm='moz'):
+        self.hostname = hostname
+        self.fqdn     = fqdn
+        self.farm     = farm
+
+class TestObserveFailure(unittest.TestCase):
+    def setUp(self):
+        self.negativeCache = kittenherder.negativeCache
+        kittenherder.negativeCache = FakeNegativeCache()
+
+    def tearDown(self):
+        kittenherder.negativeCache = self.negativeCache
+
+    def observe(self, host, reachable, dryrun=False):
+        kittenherder.observeFailure(host.hostname, host, { 'reachable': reachable }, {}, dryrun=dryrun)
+
+    def test_failures(self):
+        self.observe(FakeHost('tegra-001', None), False)
+        self.observe(FakeHost('tegra-002', 'tegra-002.build.mtv1.mozilla.com'), False)
+        self.observe(FakeHost('tegra-003', 'tegra-003.build.mtv1.mozilla.com'), True)
+        self.observe(FakeHost('tst-linux64-ec2-001', None, farm='ec2'), False)
+
+        self.assertEqual(kittenherder.negativeCache.calls, [('tegra-001', 'unresolvable'),
+                                                            ('tegra-002', 'unreachable'),
+                                                            ('tegra-003', None)])
+
+    def test_dryrun(self):
+        self.observe(FakeHost('tegra-001', None), False, dryrun=True)
+        self.observe(FakeHost('tegra-003', 'tegra-003.build.mtv1.mozilla.com'), True, dryrun=True)
+
+        self.assertEqual(kittenherder.negativeCache.calls, [])
+
+class FakeRedis(object):
+    """ The string commands of a StrictRedis client, each one atomic
+    """
+    def __init__(self):
+        self.strings = {}
+        self.expires = {}
+        self.lock    = threading.Lock()
+
+    def set(self, key, value, ex=None, nx=False):
+        self.lock.acquire()
+        try:
+            if nx and key in self.strings:
+                return None
+            self.strings[key] = value
+            self.expires[key] = ex
+            return True
+        finally:
+            self.lock.release()
+
+    def setex(self, key, seconds, value):
+        return self.set(key, value, ex=seconds)
+
+    def exists(self, key):
+        return key in self.strings
+
+class Options(object):
+    redis   = 'localhost:6379'
+    redisdb = '10'
+
+class TestClaimSeen(unittest.TestCase):
+    def setUp(self):
+        self.db = dbRedis(Options())
+        self.db._redis = FakeRedis()
+        kittenherder.db = self.db
+
+    def tearDown(self):
+        del kittenherder.db
+
+    def test_claim(self):
+        self.assertTrue(kittenherder.claimSeen('tegra-001', 3600))
+        self.assertFalse(kittenherder.claimSeen('tegra-001', 3600))
+        self.assertTrue(kittenherder.claimSeen('tegra-002', 3600))
+        self.assertEqual(self.db._redis.expires[kittenherder.seenKey('tegra-001')], 3600)
+
+    def test_concurrent_claims(self):
+        claims = []
+
+        def claim():
+            claims.append(kittenherder.claimSeen('tegra-001', 3600))
+
+        threads = [threading.Thread(target=claim) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(claims), [False] * 7 + [True])
+
+    def test_mark(self):
+        kittenherder.markSeen('tegra-001', 60)
+        self.assertFalse(kittenherder.claimSeen('tegra-001', 3600))
+        self.assertEqual(self.db._redis.expires[kittenherder.seenKey('tegra-001')], 60)
+
+    def test_seen_does_not_claim(self):
+        self.assertFalse(kittenherder.isSeen('tegra-001'))
+        self.assertTrue(kittenherder.claimSeen('tegra-001', 3600))
+        self.assertTrue(kittenherder.isSeen('tegra-001'))
+
+class FakeLastSeen(object):
+    def __init__(self, fresh, activity):
+        self.isFresh  = fresh
+        self.activity = activity
+
+    def fresh(self):
+        return self.isFresh
+
+    def candidates(self, now, hoursFor, minHours):
+        return sorted([name for name, ts in self.activity.items() if ts <= now - hoursFor(name) * 3600])
+
+    def unseen(self, slavenames):
+        return sorted([name for name in slavenames if name not in self.activity])
+
+class FakeRemoteEnv(object):
+    hosts = { 'tegra-001':        { 'enabled': True },
+              'tegra-002':        { 'enabled': True },
+              'tegra-003':        { 'enabled': True },
+              'talos-r3-fed-001': { 'enabled': False },
+            }
+
+    def rebootHoursRange(self):
+        return 1, 1
+
+    def _rebootHours(self, hostname):
+        return 1
+
+class TestLastSeenCandidates(unittest.TestCase):
+    def setUp(self):
+        self.streamUrl = kittenherder.streamUrl
+        kittenherder.streamUrl = lambda url: ['%s\n' % url]
+
+    def tearDown(self):
+        kittenherder.streamUrl = self.streamUrl
+
+    def test_candidates_and_unseen(self):
+        lastSeen = FakeLastSeen(True, { 'tegra-001': 0, 'tegra-002': 7200 })
+
+        self.assertEqual(kittenherder.lastSeenCandidates(FakeRemoteEnv(), lastSeen, 7200),
+                         ['tegra-001', 'tegra-003'])
+
+    def test_stale_index(self):
+        lastSeen = FakeLastSeen(False, { 'tegra-001': 0 })
+
+        self.assertEqual(list(kittenherder.lastSeenCandidates(FakeRemoteEnv(), lastSeen, 7200)),
+                         ['%s\n' % kittenherder.urlNeedingReboot])
+
+class TestParseKittens(unittest.TestCase):
+    def test_names(self):
+        kittens = ['  Talos-R4-Snow-078\n', 'tegra-050', 'tegra-050 ', '', '   ', '# tegra-051', 'TEGRA-050']
+
+        self.assertEqual(list(kittenherder.parseKittens(kittens, None)), ['talos-r4-snow-078', 'tegra-050'])
+
+    def test_enabled_column(self):
+        kittens = ['talos-r4-snow-078,Yes', 'tegra-050, No', ' ,Yes']
+
+        self.assertEqual(list(kittenherder.parseKittens(kittens, None)), ['talos-r4-snow-078', 'tegra-050'])
+
+    def test_filter(self):
+        kittens  = ['tegra-050', 'talos-r4-snow-078', 'tegra-051', 'tegra-050']
+        reFilter = re.compile('^tegra')
+
+        self.assertEqual(list(kittenherder.parseKittens(kittens, reFilter)), ['tegra-050', 'tegra-051'])
+
+    def test_bad_lines(self):
+        self.assertEqual(list(kittenherder.parseKittens([None, 'tegra-050'], None)), ['tegra-050'])
+
+class FakeShard(object):
+    """ Owns the kittens in mine, and after refresh() also the ones in
+        takeover
+    """
+    def __init__(self, mine, takeover=(), lost=False):
+        self.mine      = set(mine)
+        self.takeover  = set(takeover)
+        self.lost      = lost
+        self.refreshes = 0
+
+    def owns(self, kitten):
+        return kitten in self.mine
+
+    def refresh(self):
+        self.refreshes += 1
+        self.mine |= self.takeover
+
+class TestShardKittens(unittest.TestCase):
+    kittens = ['tegra-001', 'tegra-002', 'tegra-003', 'tegra-004']
+
+    def test_owned(self):
+        shard = FakeShard(['tegra-001', 'tegra-003'])
+
+        self.assertEqual(list(kittenherder.shardKittens(shard, self.kittens)), ['tegra-001', 'tegra-003'])
+        self.assertEqual(shard.refreshes, 1)
+
+    def test_takeover_comes_last(self):
+        shard = FakeShard(['tegra-003'], takeover=['tegra-001', 'tegra-004'])
+
+        self.assertEqual(list(kittenherder.shardKittens(shard, self.kittens)), ['tegra-003', 'tegra-001', 'tegra-004'])
+
+    def test_lost_membership_takes_nothing_over(self):
+        shard = FakeShard(['tegra-002'], takeover=['tegra-001'], lost=True)
+
+        self.assertEqual(list(kittenherder.shardKittens(shard, self.kittens)), ['tegra-002'])
+        self.assertEqual(shard.refreshes, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.lastseen tests against an in memory sorted set
+"""
+
+import unittest
+
+from releng import lastseen
+
+
+def _bound(value, default):
+    if value == '-inf':
+        return float('-inf')
+    if value == '+inf':
+        return float('inf')
+    if value is None:
+        return default
+    return float(value)
+
+class FakeDB(object):
+    """ The few dbRedis sorted set calls LastSeen makes
+    """
+    def __init__(self):
+        self.zsets   = {}
+        self.strings = {}
+        self.ranges  = 0
+
+    def get(self, key):
+        return self.strings.get(key, None)
+
+    def zscore(self, key, member):
+        return self.zsets.get(key, {}).get(member, None)
+
+    def zrangebyscore(self, key, low, high, withscores=False):
+        self.ranges += 1
+        low   = _bound(low, float('-inf'))
+        high  = _bound(high, float('inf'))
+        items = sorted([(score, member) for member, score in self.zsets.get(key, {}).items()
+                        if low <= score <= high])
+        if withscores:
+            return [(member, score) for score, member in items]
+        return [member for score, member in items]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+class FakePipeline(object):
+    def __init__(self, db):
+        self.db       = db
+        self.commands = []
+
+    def zscore(self, key, member):
+        self.commands.append((key, member))
+
+    def execute(self):
+        commands      = self.commands
+        self.commands = []
+        return [self.db.zscore(key, member) for key, member in commands]
+
+class TestCandidates(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000000.0
+        self.db  = FakeDB()
+        self.db.zsets[lastseen.lastSeenKey] = {
+            'talos-r3-fed-001': self.now - 3 * 3600,
+            'talos-r3-fed-002': self.now - 5 * 3600,
+            'tegra-001':        self.now - 1.5 * 3600,
+            'tegra-002':        self.now - 0.5 * 3600,
+            'w64-ix-slave01':   self.now - 7 * 3600,
+        }
+        self.lastSeen = lastseen.LastSeen(self.db)
+
+    def hoursFor(self, slavename):
+        if slavename.startswith('tegra'):
+            return 1
+        if slavename.startswith('w64'):
+            return 6
+        return 4
+
+    def test_every_slave_past_its_threshold(self):
+        result = self.lastSeen.candidates(self.now, self.hoursFor, 1)
+
+        self.assertEqual(sorted(result), ['talos-r3-fed-002', 'tegra-001', 'w64-ix-slave01'])
+        self.assertEqual(self.db.ranges, 1)
+
+    def test_candidates_are_returned_again(self):
+        first  = self.lastSeen.candidates(self.now, self.hoursFor, 1)
+        second = self.lastSeen.candidates(self.now + 60, self.hoursFor, 1)
+
+        self.assertEqual(sorted(first), sorted(second))
+
+    def test_minimum_limits_the_range(self):
+        result = self.lastSeen.candidates(self.now, self.hoursFor, 6)
+
+        self.assertEqual(result, ['w64-ix-slave01'])
+
+    def test_exact_threshold(self):
+        self.db.zsets[lastseen.lastSeenKey] = { 'tegra-003': self.now - 3600 }
+
+        self.assertEqual(self.lastSeen.candidates(self.now, self.hoursFor, 1), ['tegra-003'])
+
+    def test_unseen(self):
+        self.assertEqual(self.lastSeen.unseen(['tegra-001', 'tegra-009', 'talos-r3-fed-003']),
+                         ['tegra-009', 'talos-r3-fed-003'])
+        self.assertEqual(self.lastSeen.unseen([]), [])
+
+class TestParseBuildEvent(unittest.TestCase):
+    def test_plain(self):
+        self.assertEqual(lastseen.parseBuildEvent({ 'slavename': 'tegra-001', 'ts': 1234 }), ('tegra-001', 1234.0))
+
+    def test_pulse(self):
+        data = { '_meta':   { 'routing_key': 'build.mozilla-central.finished' },
+                 'payload': { 'build': { 'properties': [['slavename', 'tegra-001', 'BuildSlave']],
+                                         'times':      [100, 200] } },
+               }
+        self.assertEqual(lastseen.parseBuildEvent(data), ('tegra-001', 200.0))
+
+    def test_other_events(self):
+        data = { '_meta': { 'routing_key': 'build.mozilla-central.log_uploaded' } }
+        self.assertEqual(lastseen.parseBuildEvent(data), None)
+
+if __name__ == '__main__':
+    unittest.main()
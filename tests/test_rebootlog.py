@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.rebootlog tests in a temporary directory
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+from releng.rebootlog import RebootLog
+
+
+def entry(n, asctime='2012-10-01T12:00:00'):
+    return { 'asctime': asctime, 'hostname': 'talos-r3-fed-001', 'n': n }
+
+class TestRebootLog(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def lines(self, filename):
+        return [json.loads(line) for line in open(os.path.join(self.path, filename))]
+
+    def test_append(self):
+        rebootLog = RebootLog(self.path, maxAge=None)
+        for n in range(3):
+            rebootLog.append('talos-r3-fed-001', entry(n))
+
+        self.assertEqual([item['n'] for item in self.lines('talos-r3-fed-001.jsonl')], [0, 1, 2])
+        self.assertEqual([item['n'] for item in rebootLog.last('talos-r3-fed-001')], [2, 1, 0])
+        self.assertEqual([item['n'] for item in rebootLog.last('talos-r3-fed-001', 2)], [2, 1])
+        self.assertEqual(rebootLog.last('talos-r3-fed-002'), [])
+
+    def test_concurrent_appends(self):
+        rebootLog = RebootLog(self.path, maxAge=None)
+
+        def writer(first):
+            for n in range(first, first + 50):
+                rebootLog.append('talos-r3-fed-001', entry(n))
+
+        threads = [threading.Thread(target=writer, args=(first,)) for first in (0, 100, 200, 300)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.lines('talos-r3-fed-001.jsonl')), 200)
+
+    def test_rotation_by_size(self):
+        rebootLog = RebootLog(self.path, maxBytes=200, maxAge=None, backupCount=2)
+        for n in range(20):
+            rebootLog.append('talos-r3-fed-001', entry(n))
+
+        names = sorted(os.listdir(self.path))
+        self.assertEqual(names, ['talos-r3-fed-001.jsonl', 'talos-r3-fed-001.jsonl.1', 'talos-r3-fed-001.jsonl.2'])
+        for name in names:
+            self.assertTrue(os.path.getsize(os.path.join(self.path, name)) < 200 + 100)
+
+        # last() reads on into the rotated files, newest first
+        last = [item['n'] for item in rebootLog.last('talos-r3-fed-001', 5)]
+        self.assertEqual(last, [19, 18, 17, 16, 15])
+
+    def test_rotation_by_age(self):
+        rebootLog = RebootLog(self.path, maxAge=3600)
+        rebootLog.append('talos-r3-fed-001', entry(0, '2012-10-01T12:00:00'))
+        rebootLog.append('talos-r3-fed-001', entry(1))
+
+        self.assertEqual([item['n'] for item in self.lines('talos-r3-fed-001.jsonl')], [1])
+        self.assertEqual([item['n'] for item in self.lines('talos-r3-fed-001.jsonl.1')], [0])
+
+    def test_legacy_file(self):
+        json.dump([entry(0), entry(-1)], open(os.path.join(self.path, 'talos-r3-fed-001.json'), 'w'))
+        rebootLog = RebootLog(self.path, maxAge=None)
+        rebootLog.append('talos-r3-fed-001', entry(1))
+
+        self.assertEqual([item['n'] for item in rebootLog.last('talos-r3-fed-001', 3)], [1, 0, -1])
+
+    def test_long_tail(self):
+        rebootLog = RebootLog(self.path, maxBytes=1 << 20, maxAge=None)
+        for n in range(500):
+            rebootLog.append('talos-r3-fed-001', entry(n))
+
+        self.assertEqual([item['n'] for item in rebootLog._tail(rebootLog.filename('talos-r3-fed-001'), 150, blockSize=512)],
+                         range(499, 349, -1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.remote RemoteEnvironment tests, without slavealloc or ssh
+"""
+
+import unittest
+
+from releng.remote import RemoteEnvironment
+
+
+masters = [{ 'nickname': 'bm10-tests1-linux', 'fqdn': 'buildbot-master10.build.scl1.mozilla.com' },
+           { 'nickname': 'bm11-tests1-linux', 'fqdn': 'buildbot-master11.build.scl1.mozilla.com' },
+           { 'nickname': 'bm30-build1',       'fqdn': 'buildbot-master30.srv.releng.usw2.mozilla.com' },
+          ]
+
+class MastersOnly(RemoteEnvironment):
+    """ A RemoteEnvironment holding only the slavealloc masters above,
+        the real __init__ fetches them and loads the secrets
+    """
+    def __init__(self):
+        self.masters = dict([(master['nickname'], master) for master in masters])
+        self.indexMasters()
+
+class TestFindMaster(unittest.TestCase):
+    def setUp(self):
+        self.remoteEnv = MastersOnly()
+
+    def nickname(self, name):
+        master = self.remoteEnv.findMaster(name)
+        if master is None:
+            return None
+        return master['nickname']
+
+    def test_exact(self):
+        self.assertEqual(self.nickname('bm10-tests1-linux'), 'bm10-tests1-linux')
+        self.assertEqual(self.nickname('buildbot-master11.build.scl1.mozilla.com'), 'bm11-tests1-linux')
+        self.assertEqual(self.nickname('Buildbot-Master11.build.scl1.mozilla.com.'), 'bm11-tests1-linux')
+        self.assertEqual(self.nickname('buildbot-master30'), 'bm30-build1')
+
+    def test_partial(self):
+        self.assertEqual(self.nickname('buildbot-master10.build'), 'bm10-tests1-linux')
+        self.assertEqual(self.nickname('buildbot-master30.srv.releng'), 'bm30-build1')
+        self.assertEqual(self.nickname('srv.releng.usw2.mozilla.com'), 'bm30-build1')
+        self.assertEqual(self.nickname('releng.usw2'), 'bm30-build1')
+
+    def test_substring_fallback(self):
+        # shared suffixes and names off label boundaries are matched
+        # against the FQDNs like they always were
+        self.assertTrue(self.nickname('build.scl1.mozilla.com') in ('bm10-tests1-linux', 'bm11-tests1-linux'))
+        self.assertEqual(self.nickname('master30.srv'), 'bm30-build1')
+        self.assertEqual(self.nickname('ter11.build'), 'bm11-tests1-linux')
+
+    def test_unknown(self):
+        self.assertEqual(self.nickname('buildbot-master99'), None)
+        self.assertEqual(self.nickname(None), None)
+
+    def test_reindex(self):
+        del self.remoteEnv.masters['bm30-build1']
+        self.remoteEnv.indexMasters()
+        self.assertEqual(self.nickname('buildbot-master30'), None)
+        self.assertEqual(self.nickname('srv.releng.usw2.mozilla.com'), None)
+
+if __name__ == '__main__':
+    unittest.main()
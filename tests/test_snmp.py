@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.snmp tests, run from the top of the tree with
+        python -m unittest discover tests
+"""
+
+import socket
+import threading
+import unittest
+
+from releng import snmp
+
+
+def getResponse(requestID, errorStatus=0, errorIndex=0, community='private'):
+    pdu = snmp.encodeInteger(requestID) + snmp.encodeInteger(errorStatus) + \
+          snmp.encodeInteger(errorIndex) + snmp._tlv(snmp._SEQUENCE, '')
+    return snmp._tlv(snmp._SEQUENCE, snmp.encodeInteger(0) + snmp._tlv(snmp._OCTET_STRING, community) +
+                                     snmp._tlv(snmp._GET_RESPONSE, pdu))
+
+def requestID(data):
+    tag, message, _     = snmp._decode(data)
+    tag, version, n     = snmp._decode(message)
+    tag, community, n   = snmp._decode(message, n)
+    tag, pdu, n         = snmp._decode(message, n)
+    tag, value, n       = snmp._decode(pdu)
+    return snmp._decodeInteger(value)
+
+class FakeAgent(object):
+    """ Answers every SetRequest on a local udp port with errorStatus,
+        or not at all if errorStatus is None
+    """
+    def __init__(self, errorStatus=0):
+        self.errorStatus = errorStatus
+        self.requests    = []
+        self.sock        = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port        = self.sock.getsockname()[1]
+        self.thread      = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except socket.error:
+                break
+            self.requests.append(data)
+            if self.errorStatus is not None:
+                self.sock.sendto(getResponse(requestID(data), self.errorStatus, 1), address)
+
+    def close(self):
+        self.sock.close()
+
+class TestOutletOID(unittest.TestCase):
+    def test_infeed(self):
+        self.assertEqual(snmp.outletOID('AA14'), '%s.1.14' % snmp.sentryOutletControl)
+        self.assertEqual(snmp.outletOID('.AB3'), '%s.2.3' % snmp.sentryOutletControl)
+
+class TestEncoding(unittest.TestCase):
+    def test_integer(self):
+        for n in (0, 1, 127, 128, 255, 256, 0x7fffffff, -1, -129):
+            tag, value, _ = snmp._decode(snmp.encodeInteger(n))
+            self.assertEqual(snmp._decodeInteger(value), n)
+
+    def test_response(self):
+        self.assertEqual(snmp.decodeResponse(getResponse(1234, 3, 2)), (1234, 3, 2))
+
+    def test_not_a_response(self):
+        request = snmp.encodeSetRequest('private', 1, [('1.3.6.1', 3)])
+        self.assertRaises(snmp.SNMPError, snmp.decodeResponse, request)
+
+class TestSnmpSet(unittest.TestCase):
+    def test_ok(self):
+        agent = FakeAgent()
+        try:
+            self.assertEqual(snmp.snmpSetStatus('127.0.0.1', [('1.3.6.1.4.1', 3)], port=agent.port, timeout=1), 0)
+            self.assertTrue(snmp.snmpSet('127.0.0.1', [('1.3.6.1.4.1', 3)], port=agent.port, timeout=1))
+        finally:
+            agent.close()
+
+    def test_error_status(self):
+        agent = FakeAgent(errorStatus=3)
+        try:
+            self.assertEqual(snmp.snmpSetStatus('127.0.0.1', [('1.3.6.1.4.1', 3)], port=agent.port, timeout=1), 3)
+            self.assertFalse(snmp.snmpSet('127.0.0.1', [('1.3.6.1.4.1', 3)], port=agent.port, timeout=1))
+        finally:
+            agent.close()
+
+    def test_no_answer(self):
+        agent = FakeAgent(errorStatus=None)
+        try:
+            status = snmp.snmpSetStatus('127.0.0.1', [('1.3.6.1.4.1', 3)], port=agent.port, timeout=0.2, retries=1)
+            self.assertEqual(status, None)
+            self.assertEqual(len(agent.requests), 2)
+        finally:
+            agent.close()
+
+class TestPDUBatch(unittest.TestCase):
+    """ PDUBatch against a fake snmpSetStatus/snmpSet
+    """
+    def setUp(self):
+        self.calls     = []
+        self.status    = {}
+        self.setStatus = snmp.snmpSetStatus
+        self.set       = snmp.snmpSet
+        snmp.snmpSetStatus = self.fakeSetStatus
+        snmp.snmpSet       = self.fakeSet
+
+    def tearDown(self):
+        snmp.snmpSetStatus = self.setStatus
+        snmp.snmpSet       = self.set
+
+    def fakeSetStatus(self, agent, varbinds, **kwargs):
+        self.calls.append((agent, list(varbinds)))
+        return self.status.get((agent, len(varbinds)), 0)
+
+    def fakeSet(self, agent, varbinds, **kwargs):
+        return self.fakeSetStatus(agent, varbinds, **kwargs) == 0
+
+    def test_one_request_per_pdu(self):
+        batch = snmp.PDUBatch()
+        batch.add('tegra-001', 'pdu1', '1.1')
+        batch.add('tegra-002', 'pdu1', '1.2')
+        batch.add('tegra-003', 'pdu2', '2.1')
+        results = batch.run()
+
+        self.assertEqual(results, { 'tegra-001': True, 'tegra-002': True, 'tegra-003': True })
+        self.assertEqual(sorted(self.calls), [('pdu1', [('1.1', 3), ('1.2', 3)]), ('pdu2', [('2.1', 3)])])
+        self.assertEqual(batch.run(), {})
+
+    def test_error_status_retries_outlets(self):
+        self.status[('pdu1', 2)] = 2
+        batch = snmp.PDUBatch()
+        batch.add('tegra-001', 'pdu1', '1.1')
+        batch.add('tegra-002', 'pdu1', '1.2')
+        results = batch.run()
+
+        self.assertEqual(results, { 'tegra-001': True, 'tegra-002': True })
+        self.assertEqual(self.calls, [('pdu1', [('1.1', 3), ('1.2', 3)]), ('pdu1', [('1.1', 3)]), ('pdu1', [('1.2', 3)])])
+
+    def test_no_answer_is_not_retried(self):
+        self.status[('pdu1', 2)] = None
+        batch = snmp.PDUBatch()
+        batch.add('tegra-001', 'pdu1', '1.1')
+        batch.add('tegra-002', 'pdu1', '1.2')
+        results = batch.run()
+
+        self.assertEqual(results, { 'tegra-001': False, 'tegra-002': False })
+        self.assertEqual(len(self.calls), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.tracker tests, the escalation path driven through poll()
+"""
+
+import time
+import unittest
+
+from releng import tracker
+from releng.hoststate import healthy, awaitingRecovery
+
+
+class FakeHost(object):
+    def __init__(self, hostname, hasPDU=True, hasIPMI=True):
+        self.hostname = hostname
+        self.fqdn     = None
+        self.isTegra  = False
+        self.hasPDU   = hasPDU
+        self.hasIPMI  = hasIPMI
+
+class FakeRemoteEnv(object):
+    """ Records the escalated reboots and state changes, a reboot with
+        a method listed in fails is not sent
+    """
+    def __init__(self, fails=()):
+        self.fails     = fails
+        self.tracker   = None
+        self.reboots   = []
+        self.states    = []
+        self.hosts     = {}
+        self.known     = {}
+
+    def escalateReboot(self, host, method):
+        self.reboots.append((host.hostname, method))
+        if method in self.fails:
+            return False
+        self.tracker.track(host, method)
+        return True
+
+    def setState(self, hostname, state, reason=''):
+        self.states.append((hostname, state))
+
+    def slaveStatus(self, hostname):
+        return None
+
+    def findMaster(self, name):
+        return None
+
+    def getHost(self, hostname, connect=True):
+        return self.known.get(hostname, None)
+
+class FakeDB(object):
+    def __init__(self):
+        self.hashes = {}
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    def hdel(self, key, field):
+        self.hashes.get(key, {}).pop(field, None)
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def expire(self, key, seconds):
+        pass
+
+class TrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.probePort = tracker.probePort
+        self.trackers  = []
+
+    def tearDown(self):
+        tracker.probePort = self.probePort
+        for t in self.trackers:
+            t.join(0)
+
+    def tracker(self, remoteEnv, db=None):
+        # the background thread never polls, the tests call poll()
+        t = tracker.RebootTracker(remoteEnv, deadline=60, settle=0, interval=3600, db=db)
+        remoteEnv.tracker = t
+        self.trackers.append(t)
+        return t
+
+    def expire(self, t):
+        """ Move every deadline into the past and poll
+        """
+        for entry in t.entries.values():
+            entry['deadline'] = time.time() - 1
+        t.poll(t.entries.values())
+
+class TestEscalation(TrackerTest):
+    def test_ssh_pdu_ipmi(self):
+        remoteEnv = FakeRemoteEnv()
+        t         = self.tracker(remoteEnv)
+        t.track(FakeHost('talos-r3-fed-001'), 'ssh')
+
+        t.poll(t.entries.values())
+        self.assertEqual(remoteEnv.reboots, [])
+
+        self.expire(t)
+        self.assertEqual(remoteEnv.reboots, [('talos-r3-fed-001', 'pdu')])
+        self.expire(t)
+        self.assertEqual(remoteEnv.reboots[-1], ('talos-r3-fed-001', 'ipmi'))
+        self.assertEqual(t.entries['talos-r3-fed-001']['attempts'], ['ssh', 'pdu', 'ipmi'])
+
+        self.expire(t)
+        self.assertEqual(len(remoteEnv.reboots), 2)
+        self.assertEqual(t.entries, {})
+        self.assertTrue('talos-r3-fed-001' in t.failed)
+        self.assertEqual(remoteEnv.states, [('talos-r3-fed-001', awaitingRecovery)])
+
+    def test_unsupported_and_failed_methods_are_skipped(self):
+        remoteEnv = FakeRemoteEnv(fails=('pdu',))
+        t         = self.tracker(remoteEnv)
+        t.track(FakeHost('talos-r3-fed-001'), 'ssh')
+        t.track(FakeHost('w64-ix-slave01', hasPDU=False), 'ssh')
+
+        self.expire(t)
+        self.assertEqual(sorted(remoteEnv.reboots), [('talos-r3-fed-001', 'ipmi'),
+                                                     ('talos-r3-fed-001', 'pdu'),
+                                                     ('w64-ix-slave01', 'ipmi')])
+        self.assertEqual(t.entries['w64-ix-slave01']['method'], 'ipmi')
+
+    def test_recovered(self):
+        tracker.probePort = lambda host, timeout=5: True
+        remoteEnv = FakeRemoteEnv()
+        t         = self.tracker(remoteEnv)
+        t.track(FakeHost('talos-r3-fed-001'), 'pdu')
+
+        self.expire(t)
+        self.assertEqual(remoteEnv.reboots, [])
+        self.assertTrue('talos-r3-fed-001' in t.recovered)
+        self.assertEqual(remoteEnv.states, [('talos-r3-fed-001', healthy)])
+
+    def test_settle(self):
+        remoteEnv = FakeRemoteEnv()
+        t         = self.tracker(remoteEnv)
+        t.settle  = 3600
+        t.track(FakeHost('talos-r3-fed-001'), 'ssh')
+
+        self.expire(t)
+        self.assertEqual(remoteEnv.reboots, [])
+
+class TestPending(TrackerTest):
+    def test_resumed_by_the_next_run(self):
+        db        = FakeDB()
+        host      = FakeHost('talos-r3-fed-001')
+        remoteEnv = FakeRemoteEnv()
+        t         = self.tracker(remoteEnv, db)
+        t.track(host, 'ssh')
+        deadline  = t.entries[host.hostname]['deadline']
+
+        self.assertEqual(t.join(0), ['talos-r3-fed-001'])
+        self.assertTrue(host.hostname in db.hashes[tracker.pendingKey])
+
+        remoteEnv = FakeRemoteEnv()
+        remoteEnv.known[host.hostname] = host
+        t = self.tracker(remoteEnv, db)
+        self.assertEqual(t.resume(), ['talos-r3-fed-001'])
+        self.assertEqual(t.entries[host.hostname]['deadline'], deadline)
+
+        self.expire(t)
+        self.assertEqual(remoteEnv.reboots, [('talos-r3-fed-001', 'pdu')])
+        self.expire(t)
+        self.expire(t)
+        self.assertTrue(host.hostname in t.failed)
+        self.assertEqual(db.hashes[tracker.pendingKey], {})
+
+    def test_old_entries_are_dropped(self):
+        db = FakeDB()
+        db.hset(tracker.pendingKey, 'talos-r3-fed-001',
+                '{"started": 0, "method": "ssh", "rebooted": 0, "deadline": 600, "attempts": ["ssh"]}')
+        remoteEnv = FakeRemoteEnv()
+        remoteEnv.known['talos-r3-fed-001'] = FakeHost('talos-r3-fed-001')
+        t = self.tracker(remoteEnv, db)
+
+        self.assertEqual(t.resume(), [])
+        self.assertEqual(db.hashes[tracker.pendingKey], {})
+
+class TestTrackingTimes(unittest.TestCase):
+    def test_fits_every_step_in_wait(self):
+        self.assertEqual(tracker.trackingTimes(1800), (600, 120, 30))
+        for wait in (60, 300, 720, 1300):
+            deadline, settle, interval = tracker.trackingTimes(wait)
+            self.assertTrue(deadline * len(tracker.escalation) <= wait)
+            self.assertTrue(settle < deadline)
+            self.assertTrue(0 < interval <= deadline)
+
+if __name__ == '__main__':
+    unittest.main()
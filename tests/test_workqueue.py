@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" releng.workqueue tests against an in memory store with expiring keys
+"""
+
+import time
+import threading
+import unittest
+
+from releng.workqueue import WorkQueue
+
+
+class FakeDB(object):
+    """ The dbRedis calls WorkQueue makes, every one atomic. Keys given
+        an expiry vanish once it passes, like they do in redis.
+    """
+    def __init__(self):
+        self.data    = {}
+        self.expires = {}
+        self.lock    = threading.RLock()
+
+    def _get(self, key, default=None):
+        if key in self.expires and time.time() >= self.expires[key]:
+            self.data.pop(key, None)
+            del self.expires[key]
+        return self.data.get(key, default)
+
+    def _locked(func):
+        def wrapper(self, *args, **kwargs):
+            self.lock.acquire()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.lock.release()
+        return wrapper
+
+    @_locked
+    def get(self, key):
+        return self._get(key)
+
+    @_locked
+    def set(self, key, value, expires=None, nx=False):
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if expires is not None:
+            self.expires[key] = time.time() + expires
+        return True
+
+    @_locked
+    def exists(self, key):
+        return self._get(key) is not None
+
+    @_locked
+    def delete(self, key):
+        self.expires.pop(key, None)
+        return self.data.pop(key, None) is not None
+
+    @_locked
+    def expire(self, key, seconds=86400):
+        if self._get(key) is None:
+            return False
+        self.expires[key] = time.time() + seconds
+        return True
+
+    @_locked
+    def lpush(self, key, item):
+        self.data.setdefault(key, []).insert(0, item)
+
+    @_locked
+    def rpush(self, key, item):
+        self.data.setdefault(key, []).append(item)
+
+    @_locked
+    def rpoplpush(self, source, destination):
+        items = self._get(source, [])
+        if len(items) == 0:
+            return None
+        item = items.pop()
+        self.data.setdefault(destination, []).insert(0, item)
+        return item
+
+    @_locked
+    def lrange(self, key, start, end):
+        items = self._get(key, [])
+        if end == -1:
+            return list(items[start:])
+        return list(items[start:end + 1])
+
+    @_locked
+    def lrem(self, key, count, item):
+        items = self._get(key, [])
+        if item in items:
+            items.remove(item)
+            return 1
+        return 0
+
+    @_locked
+    def llen(self, key):
+        return len(self._get(key, []))
+
+    @_locked
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = value
+
+    @_locked
+    def hgetall(self, key):
+        return dict(self._get(key, {}))
+
+class QueueTest(unittest.TestCase):
+    def setUp(self):
+        self.db     = FakeDB()
+        self.queues = []
+
+    def tearDown(self):
+        for queue in self.queues:
+            queue.close()
+
+    def queue(self, worker, visibility=900, grace=30):
+        queue = WorkQueue(self.db, 'test', visibility=visibility, grace=grace, worker=worker)
+        self.queues.append(queue)
+        return queue
+
+class TestWorkQueue(QueueTest):
+    def test_sweep(self):
+        queue = self.queue('a')
+        self.assertEqual(queue.put(['tegra-001', 'tegra-002', 'tegra-003']), 3)
+
+        done = []
+        for item in queue.claims(interval=0):
+            done.append(item)
+            queue.ack(item, { 'reboot': item == 'tegra-002' })
+
+        self.assertEqual(done, ['tegra-001', 'tegra-002', 'tegra-003'])
+        self.assertEqual(queue.size(), 0)
+        self.assertEqual(queue.collect(), { 'tegra-001': { 'reboot': False },
+                                            'tegra-002': { 'reboot': True },
+                                            'tegra-003': { 'reboot': False } })
+        self.assertTrue(queue.join(timeout=0))
+
+    def test_each_item_is_claimed_once(self):
+        a = self.queue('a')
+        b = self.queue('b')
+        a.put(['tegra-001', 'tegra-002'])
+
+        self.assertEqual(a.claim(), 'tegra-001')
+        self.assertEqual(b.claim(), 'tegra-002')
+        self.assertEqual(a.claim(), None)
+        self.assertEqual(self.db.get(a.leaseKey('tegra-001')), 'a')
+        self.assertEqual(self.db.get(a.leaseKey('tegra-002')), 'b')
+
+    def test_renew(self):
+        a = self.queue('a')
+        b = self.queue('b')
+        a.put(['tegra-001'])
+        a.claim()
+
+        self.assertTrue(a.renew('tegra-001'))
+        self.assertFalse(b.renew('tegra-001'))
+
+        self.db.delete(a.leaseKey('tegra-001'))
+        self.assertFalse(a.renew('tegra-001'))
+
+    def test_reap_waits_for_grace(self):
+        queue = self.queue('a', grace=3600)
+        queue.put(['tegra-001'])
+        queue.claim()
+        self.db.delete(queue.leaseKey('tegra-001'))
+
+        self.assertEqual(queue.reap(), 0)
+        queue.orphans['tegra-001'] -= 3600
+        self.assertEqual(queue.reap(), 1)
+        self.assertEqual(queue.claim(), 'tegra-001')
+
+    def test_reap_leaves_leased_items(self):
+        queue = self.queue('a', grace=0)
+        queue.put(['tegra-001'])
+        queue.claim()
+
+        self.assertEqual(queue.reap(), 0)
+        self.assertEqual(self.db.lrange(queue.processing, 0, -1), ['tegra-001'])
+
+class TestCrash(QueueTest):
+    def test_reaped_item_is_processed(self):
+        a = self.queue('a', grace=0)
+        b = self.queue('b', grace=0)
+        a.put(['tegra-001', 'tegra-002'])
+
+        # a dies holding tegra-001, its lease runs out
+        self.assertEqual(a.claim(), 'tegra-001')
+        a.close()
+        self.db.delete(a.leaseKey('tegra-001'))
+
+        done = []
+        for item in b.claims(interval=0.01, timeout=5):
+            done.append(item)
+            b.ack(item, 'ok')
+
+        self.assertEqual(sorted(done), ['tegra-001', 'tegra-002'])
+        self.assertEqual(sorted(b.collect().keys()), ['tegra-001', 'tegra-002'])
+        self.assertEqual(b.size(), 0)
+
+    def test_claims_wait_for_live_workers(self):
+        a = self.queue('a', grace=0)
+        b = self.queue('b', grace=0)
+        a.put(['tegra-001'])
+        a.claim()
+
+        def finish():
+            time.sleep(0.2)
+            a.ack('tegra-001', 'ok')
+
+        thread = threading.Thread(target=finish)
+        thread.start()
+        start = time.time()
+        self.assertEqual(list(b.claims(interval=0.01, timeout=5)), [])
+        thread.join()
+
+        self.assertTrue(time.time() - start >= 0.2)
+        self.assertEqual(b.size(), 0)
+
+    def test_claims_give_up(self):
+        a = self.queue('a', grace=0)
+        b = self.queue('b', grace=0)
+        a.put(['tegra-001'])
+        a.claim()
+
+        self.assertEqual(list(b.claims(interval=0.01, timeout=0.1)), [])
+        self.assertEqual(b.size(), 1)
+
+class TestHeartbeat(QueueTest):
+    def test_leases_are_renewed(self):
+        queue = self.queue('a', visibility=0.3)
+        queue.put(['tegra-001'])
+        queue.claim()
+
+        time.sleep(0.6)
+        self.assertEqual(self.db.get(queue.leaseKey('tegra-001')), 'a')
+
+        queue.ack('tegra-001')
+        queue.close()
+        self.assertEqual(queue.thread, None)
+
+    def test_close_stops_renewing(self):
+        queue = self.queue('a', visibility=0.3)
+        queue.put(['tegra-001'])
+        queue.claim()
+        queue.close()
+
+        time.sleep(0.4)
+        self.assertEqual(self.db.get(queue.leaseKey('tegra-001')), None)
+
+if __name__ == '__main__':
+    unittest.main()